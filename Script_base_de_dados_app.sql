@@ -48,9 +48,11 @@ CREATE TABLE FORNECEDOR (
 CREATE TABLE CLIENTE (
     id_cliente INT AUTO_INCREMENT PRIMARY KEY,
     nome VARCHAR(100) NOT NULL,
+    nome_busca VARCHAR(100) NULL,
     cpf VARCHAR(14) NOT NULL UNIQUE,
     telefone VARCHAR(20) NULL, -- Corrigido: Campo de telefone adicionado
     id_endereco INT NOT NULL,
+    INDEX ix_cliente_nome_busca (nome_busca),
     FOREIGN KEY (id_endereco) REFERENCES ENDERECO(id_endereco)
 );
 
@@ -58,18 +60,28 @@ CREATE TABLE ESTOQUE (
     id_estoque INT AUTO_INCREMENT PRIMARY KEY,
     quantidade_produto INT DEFAULT 0,
     min_produto INT DEFAULT 1,
-    last_alert DATETIME NULL
+    abaixo_minimo BOOLEAN AS (quantidade_produto <= min_produto) STORED,
+    last_alert DATETIME NULL,
+    versao INT NOT NULL DEFAULT 0,
+    INDEX ix_estoque_abaixo_minimo (abaixo_minimo)
 );
 
 CREATE TABLE PRODUTO (
     id_produto INT AUTO_INCREMENT PRIMARY KEY,
     nome VARCHAR(200) NOT NULL,
+    nome_busca VARCHAR(200) NULL,
     descricao TEXT,
     preco DECIMAL(10,2) DEFAULT 0.00,
     preco_promocional DECIMAL(10,2) NULL,
     id_categoria INT NOT NULL,
     fornecedor_id INT,
     estoque_id INT NOT NULL,
+    ultima_venda DATETIME NULL,
+    INDEX ix_produto_nome (nome),
+    INDEX ix_produto_nome_busca (nome_busca),
+    FULLTEXT INDEX ft_produto_nome_busca (nome_busca),
+    INDEX ix_produto_ultima_venda (ultima_venda),
+    INDEX ix_produto_estoque_id (estoque_id),
     FOREIGN KEY (id_categoria) REFERENCES CATEGORIA(id_categoria),
     FOREIGN KEY (fornecedor_id) REFERENCES FORNECEDOR(id_fornecedor),
     FOREIGN KEY (estoque_id) REFERENCES ESTOQUE(id_estoque)
@@ -85,12 +97,28 @@ CREATE TABLE VENDA (
     FOREIGN KEY (id_pagamento) REFERENCES PAGAMENTO(id_pagamento)
 );
 
+-- Contadores acumulados do dashboard (total_vendas, total_produtos_estoque)
+CREATE TABLE INDICADOR (
+    chave VARCHAR(50) PRIMARY KEY,
+    valor DECIMAL(16,2) NOT NULL DEFAULT 0.00
+);
+
+-- Total de vendas pré-agregado por mês (gráfico do dashboard)
+CREATE TABLE VENDAS_MENSAIS (
+    ano INT NOT NULL,
+    mes INT NOT NULL,
+    valor_total DECIMAL(14,2) NOT NULL DEFAULT 0.00,
+    quantidade_vendas INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (ano, mes)
+);
+
 CREATE TABLE PRODUTO_VENDA (
     id_produto INT NOT NULL,
     id_venda INT NOT NULL,
     quantidade INT DEFAULT 1,
     preco_unitario DECIMAL(10,2) NOT NULL,
     PRIMARY KEY (id_produto, id_venda),
+    INDEX ix_produto_venda_id_venda (id_venda),
     FOREIGN KEY (id_produto) REFERENCES PRODUTO(id_produto),
     FOREIGN KEY (id_venda) REFERENCES VENDA(id_venda) ON DELETE CASCADE
 );
@@ -98,7 +126,7 @@ CREATE TABLE PRODUTO_VENDA (
 CREATE TABLE PEDIDO_FORNECEDOR (
     id_pedido INT AUTO_INCREMENT PRIMARY KEY,
     id_fornecedor INT NOT NULL,
-    data_pedido DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_pedido DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(50) DEFAULT 'Pendente',
     FOREIGN KEY (id_fornecedor) REFERENCES FORNECEDOR(id_fornecedor)
 );
@@ -117,7 +145,7 @@ CREATE TABLE MENSAGEM (
     fornecedor_id INT,
     produto_id INT,
     conteudo VARCHAR(2000),
-    data_envio DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_envio DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     status VARCHAR(50) DEFAULT 'pendente',
     FOREIGN KEY (fornecedor_id) REFERENCES FORNECEDOR(id_fornecedor),
     FOREIGN KEY (produto_id) REFERENCES PRODUTO(id_produto)
@@ -129,12 +157,32 @@ CREATE TABLE MOVIMENTACAO_ESTOQUE (
     id_usuario INT,
     tipo VARCHAR(50) NOT NULL,
     quantidade INT NOT NULL,
-    data_movimentacao DATETIME DEFAULT CURRENT_TIMESTAMP,
+    data_movimentacao DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
     observacao VARCHAR(255),
+    INDEX ix_movimentacao_estoque_produto_data (id_produto, data_movimentacao),
     FOREIGN KEY (id_produto) REFERENCES PRODUTO(id_produto),
     FOREIGN KEY (id_usuario) REFERENCES CONTA(id_conta)
 );
 
+-- MOVIMENTACAO_ESTOQUE é o razão do estoque: só recebe INSERTs. Para
+-- particioná-la por mês (opcional), use 'flask particionar-movimentacoes'.
+
+-- Saldos do razão em datas de corte (início de cada mês), gerados por
+-- 'flask gerar-snapshot-estoque' e pelo agendador.
+CREATE TABLE ESTOQUE_SNAPSHOT (
+    data_snapshot DATETIME NOT NULL,
+    id_produto INT NOT NULL,
+    quantidade INT NOT NULL,
+    PRIMARY KEY (data_snapshot, id_produto),
+    FOREIGN KEY (id_produto) REFERENCES PRODUTO(id_produto)
+);
+
+-- Índices das listagens paginadas por cursor (data + id, do mais recente ao mais antigo)
+CREATE INDEX ix_venda_data_compra ON VENDA (data_compra, id_venda);
+CREATE INDEX ix_pedido_fornecedor_data_pedido ON PEDIDO_FORNECEDOR (data_pedido, id_pedido);
+CREATE INDEX ix_mensagem_data_envio ON MENSAGEM (data_envio, id);
+CREATE INDEX ix_movimentacao_estoque_data ON MOVIMENTACAO_ESTOQUE (data_movimentacao, id_mov);
+
 -- =======================================================================
 -- DML - INSERÇÃO DE DADOS (VERSÃO EXPANDIDA)
 -- =======================================================================
@@ -160,32 +208,32 @@ INSERT INTO FORNECEDOR (nome, email, cnpj, telefone, id_endereco) VALUES
 ('Import Tech', 'contato@importtech.com', '55.666.777/0001-88', '(11) 5555-7777', 1);
 
 -- Corrigido: Adicionando telefones aos clientes
-INSERT INTO CLIENTE (nome, cpf, telefone, id_endereco) VALUES
-('Ana Silva', '11122233344', '(11) 98765-4321', 1), ('Bruno Costa', '22233344455', '(21) 91234-5678', 2),
-('Carla Dias', '33344455566', '(31) 95555-8888', 3), ('Daniel Fogaça', '44455566677', '(41) 98877-1234', 4),
-('Eduarda Matos', '55566677788', '(51) 99999-0000', 5), ('Fernanda Lima', '66677788899', '(11) 98888-1111', 6),
-('Guilherme Souza', '77788899900', '(21) 97777-2222', 7);
+INSERT INTO CLIENTE (nome, nome_busca, cpf, telefone, id_endereco) VALUES
+('Ana Silva', 'ana silva', '11122233344', '(11) 98765-4321', 1), ('Bruno Costa', 'bruno costa', '22233344455', '(21) 91234-5678', 2),
+('Carla Dias', 'carla dias', '33344455566', '(31) 95555-8888', 3), ('Daniel Fogaça', 'daniel fogaca', '44455566677', '(41) 98877-1234', 4),
+('Eduarda Matos', 'eduarda matos', '55566677788', '(51) 99999-0000', 5), ('Fernanda Lima', 'fernanda lima', '66677788899', '(11) 98888-1111', 6),
+('Guilherme Souza', 'guilherme souza', '77788899900', '(21) 97777-2222', 7);
 
 INSERT INTO ESTOQUE (quantidade_produto, min_produto) VALUES
 (50, 5), (75, 10), (20, 3), (40, 5), (100, 10), (200, 20), (30, 5), (15, 2), (250, 25), (60, 10),
 (15, 2), (40, 5), (80, 10), (120, 15), (5, 1);
 
-INSERT INTO PRODUTO (nome, descricao, preco, id_categoria, fornecedor_id, estoque_id) VALUES
-('Teclado Mecânico Gamer RGB', 'Teclado com switches blue e iluminação customizável.', 399.90, 1, 1, 1),
-('Mouse Gamer Laser 16000DPI', 'Mouse ergonômico com 8 botões programáveis.', 249.50, 1, 2, 2),
-('Monitor Curvo Ultrawide 29"', 'Monitor com resolução 2560x1080 e 144Hz.', 1799.00, 2, 2, 3),
-('Headset Gamer 7.1 Surround', 'Headset com som surround virtual.', 450.00, 1, 1, 4),
-('Webcam Full HD 1080p', 'Webcam com foco automático e microfone embutido.', 199.99, 5, 4, 5),
-('Mousepad Gamer Speed Extra Grande', 'Superfície de tecido para máxima velocidade. 900x400mm.', 89.90, 5, 3, 6),
-('Placa de Vídeo RTX 5080 16GB', 'Placa de vídeo de última geração para jogos em 4K.', 8999.90, 3, 2, 7),
-('FIFA 25 (PS5)', 'Lançamento do simulador de futebol.', 349.90, 4, 3, 8),
-('Cadeira Gamer Ergonômica', 'Cadeira com ajuste de altura e encosto reclinável.', 1250.00, 5, 5, 9),
-('SSD NVMe 2TB Gen4', 'SSD de alta velocidade para jogos e aplicações pesadas.', 950.00, 3, 1, 10),
-('Notebook Gamer Legion', 'Notebook com RTX 5070, 32GB RAM, 1TB SSD.', 12500.00, 6, 1, 11),
-('Microfone Condensador HyperX QuadCast', 'Microfone para streaming com 4 padrões polares.', 899.90, 1, 2, 12),
-('Grand Theft Auto V (PC)', 'Edição Premium Online.', 89.90, 4, 3, 13),
-('Filtro de Linha Clamper', '8 tomadas com proteção contra surtos.', 129.90, 5, 4, 14),
-('Gabinete Gamer Full Tower', 'Gabinete espaçoso com painel de vidro e 4 fans RGB.', 750.00, 3, 5, 15);
+INSERT INTO PRODUTO (nome, nome_busca, descricao, preco, id_categoria, fornecedor_id, estoque_id) VALUES
+('Teclado Mecânico Gamer RGB', 'teclado mecanico gamer rgb', 'Teclado com switches blue e iluminação customizável.', 399.90, 1, 1, 1),
+('Mouse Gamer Laser 16000DPI', 'mouse gamer laser 16000dpi', 'Mouse ergonômico com 8 botões programáveis.', 249.50, 1, 2, 2),
+('Monitor Curvo Ultrawide 29"', 'monitor curvo ultrawide 29', 'Monitor com resolução 2560x1080 e 144Hz.', 1799.00, 2, 2, 3),
+('Headset Gamer 7.1 Surround', 'headset gamer 7 1 surround', 'Headset com som surround virtual.', 450.00, 1, 1, 4),
+('Webcam Full HD 1080p', 'webcam full hd 1080p', 'Webcam com foco automático e microfone embutido.', 199.99, 5, 4, 5),
+('Mousepad Gamer Speed Extra Grande', 'mousepad gamer speed extra grande', 'Superfície de tecido para máxima velocidade. 900x400mm.', 89.90, 5, 3, 6),
+('Placa de Vídeo RTX 5080 16GB', 'placa de video rtx 5080 16gb', 'Placa de vídeo de última geração para jogos em 4K.', 8999.90, 3, 2, 7),
+('FIFA 25 (PS5)', 'fifa 25 ps5', 'Lançamento do simulador de futebol.', 349.90, 4, 3, 8),
+('Cadeira Gamer Ergonômica', 'cadeira gamer ergonomica', 'Cadeira com ajuste de altura e encosto reclinável.', 1250.00, 5, 5, 9),
+('SSD NVMe 2TB Gen4', 'ssd nvme 2tb gen4', 'SSD de alta velocidade para jogos e aplicações pesadas.', 950.00, 3, 1, 10),
+('Notebook Gamer Legion', 'notebook gamer legion', 'Notebook com RTX 5070, 32GB RAM, 1TB SSD.', 12500.00, 6, 1, 11),
+('Microfone Condensador HyperX QuadCast', 'microfone condensador hyperx quadcast', 'Microfone para streaming com 4 padrões polares.', 899.90, 1, 2, 12),
+('Grand Theft Auto V (PC)', 'grand theft auto v pc', 'Edição Premium Online.', 89.90, 4, 3, 13),
+('Filtro de Linha Clamper', 'filtro de linha clamper', '8 tomadas com proteção contra surtos.', 129.90, 5, 4, 14),
+('Gabinete Gamer Full Tower', 'gabinete gamer full tower', 'Gabinete espaçoso com painel de vidro e 4 fans RGB.', 750.00, 3, 5, 15);
 
 -- (O restante das inserções de VENDAS, PEDIDOS, etc. continua o mesmo)
 -- ...
@@ -388,4 +436,40 @@ INSERT INTO MOVIMENTACAO_ESTOQUE (id_produto, id_usuario, tipo, quantidade, obse
 
 INSERT INTO VENDA (data_compra, valor_total, id_cliente, id_pagamento) VALUES ('2025-04-08 17:00:00', 1199.50, 7, 1);
 INSERT INTO PRODUTO_VENDA (id_venda, id_produto, quantidade, preco_unitario) VALUES (41, 10, 1, 950.00), (41, 2, 1, 249.50);
-INSERT INTO MOVIMENTACAO_ESTOQUE (id_produto, id_usuario, tipo, quantidade, observacao) VALUES (10, 4, 'SAÍDA', 1, 'Venda #41'), (2, 4, 'SAÍDA', 1, 'Venda #41');
\ No newline at end of file
+INSERT INTO MOVIMENTACAO_ESTOQUE (id_produto, id_usuario, tipo, quantidade, observacao) VALUES (10, 4, 'SAÍDA', 1, 'Venda #41'), (2, 4, 'SAÍDA', 1, 'Venda #41');
+
+-- =======================================================================
+-- AGREGADOS - TOTAL DE VENDAS POR MÊS (equivalente a 'flask reconstruir-vendas-mensais')
+-- =======================================================================
+INSERT INTO VENDAS_MENSAIS (ano, mes, valor_total, quantidade_vendas)
+SELECT YEAR(data_compra), MONTH(data_compra), SUM(valor_total), COUNT(*)
+FROM VENDA
+GROUP BY YEAR(data_compra), MONTH(data_compra);
+
+-- =======================================================================
+-- DADOS DESNORMALIZADOS DO DASHBOARD (equivalente a 'flask reconciliar-indicadores')
+-- =======================================================================
+UPDATE PRODUTO p
+SET p.ultima_venda = (
+    SELECT MAX(v.data_compra) FROM PRODUTO_VENDA pv JOIN VENDA v ON v.id_venda = pv.id_venda
+    WHERE pv.id_produto = p.id_produto
+);
+
+-- =======================================================================
+-- SALDO INICIAL DO RAZÃO (equivalente a 'flask verificar-estoque --ajustar movimentacoes')
+-- =======================================================================
+-- As quantidades de ESTOQUE acima são o ponto de partida: a diferença para
+-- as movimentações já inseridas vira uma movimentação de SALDO INICIAL.
+INSERT INTO MOVIMENTACAO_ESTOQUE (id_produto, id_usuario, tipo, quantidade, observacao)
+SELECT p.id_produto, NULL, 'SALDO INICIAL', e.quantidade_produto - COALESCE(m.saldo, 0), 'Saldo inicial do razão'
+FROM PRODUTO p
+JOIN ESTOQUE e ON e.id_estoque = p.estoque_id
+LEFT JOIN (
+    SELECT id_produto, SUM(CASE WHEN tipo = 'SAÍDA' THEN -quantidade ELSE quantidade END) AS saldo
+    FROM MOVIMENTACAO_ESTOQUE GROUP BY id_produto
+) m ON m.id_produto = p.id_produto
+WHERE e.quantidade_produto <> COALESCE(m.saldo, 0);
+
+INSERT INTO INDICADOR (chave, valor) VALUES
+('total_vendas', (SELECT COALESCE(SUM(valor_total), 0) FROM VENDA)),
+('total_produtos_estoque', (SELECT COALESCE(SUM(quantidade_produto), 0) FROM ESTOQUE));
@@ -0,0 +1,390 @@
+"""
+Análises de vendas e estoque para o gerente: curva ABC, giro do estoque,
+dias de cobertura e produtos mais vendidos por período.
+
+As contas são feitas com pandas/NumPy, em operações sobre colunas inteiras,
+a partir de dois totais diários por produto:
+
+  - vendas: quantidade vendida e receita (quantidade x preço cobrado) de
+    cada produto em cada dia, de PRODUTO_VENDA + VENDA;
+  - movimentos: soma das variações com sinal de MOVIMENTACAO_ESTOQUE de
+    cada produto em cada dia (ver movimentacoes.variacao).
+
+As linhas são lidas do banco com pd.read_sql em lotes de LOTE_LEITURA, com
+os tipos das colunas definidos (TIPOS_*), e somadas por dia a cada lote.
+
+Snapshots: os totais dos dias já fechados ficam gravados em ANALISES_DIR,
+em Parquet (ou Feather) quando o pacote 'pyarrow' está instalado e em
+pickle do pandas quando não está (ANALISES_FORMATO). atualizar() lê do
+banco só os dias entre o último corte gravado e o início do dia de hoje
+(pelo relógio do banco) e regrava os arquivos; o agendador faz isso a cada
+ANALISES_HORAS e 'flask atualizar-analises' na hora. As análises juntam o
+snapshot com o que entrou depois do corte, lido na hora, então o resultado
+é o mesmo com o snapshot em dia, atrasado ou ausente; só muda o custo.
+
+Vendas ou movimentações gravadas com data anterior ao último corte (ex.:
+carga por script) só entram no snapshot com 'flask atualizar-analises
+--completo', que o refaz do zero.
+"""
+import os
+import json
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func
+
+from app import app, db
+from models import Produto, Estoque, Venda, ProdutoVenda, MovimentacaoEstoque
+import movimentacoes
+
+LOTE_LEITURA = 50000
+DIAS_PADRAO = 90
+DIAS_MAXIMO = 731
+JANELA_COBERTURA_PADRAO = 30
+# Curva ABC pela receita: A até 80% do acumulado, B até 95%, C o resto.
+LIMITE_CLASSE_A = 0.80
+LIMITE_CLASSE_B = 0.95
+MAIS_VENDIDOS_PADRAO = 10
+MAIS_VENDIDOS_MAXIMO = 100
+PERIODOS = {'dia': 'D', 'semana': 'W-SUN', 'mes': 'M'}
+ORDENS = ('quantidade', 'receita')
+FORMATOS = ('parquet', 'feather', 'pickle')
+EXTENSOES = {'parquet': 'parquet', 'feather': 'feather', 'pickle': 'pkl'}
+
+SNAPSHOT_VENDAS = 'vendas_diarias'
+SNAPSHOT_MOVIMENTOS = 'movimentos_diarios'
+
+TIPOS_VENDAS = {'id_produto': 'int32', 'quantidade': 'int32', 'preco_unitario': 'float64'}
+TIPOS_MOVIMENTOS = {'id_produto': 'int32', 'variacao': 'int32'}
+TIPOS_PRODUTOS = {'id_produto': 'int32', 'estoque': 'int64'}
+COLUNAS_VENDAS = {'data': 'datetime64[ns]', 'id_produto': 'int32', 'quantidade': 'int64', 'receita': 'float64'}
+COLUNAS_MOVIMENTOS = {'data': 'datetime64[ns]', 'id_produto': 'int32', 'variacao': 'int64'}
+
+logger = logging.getLogger(__name__)
+
+_trava = threading.Lock()
+# Snapshots já lidos neste processo: nome -> (mtime do arquivo, DataFrame).
+_carregados = {}
+
+
+# =======================================================================
+# LEITURA DO BANCO
+# =======================================================================
+
+def _ler_em_lotes(stmt, tipos, datas=None):
+    """DataFrames de até LOTE_LEITURA linhas do resultado de 'stmt', com os tipos de 'tipos'."""
+    # O engine que vai executar a consulta: o da réplica, nas rotas de leitura (replica.py).
+    if db.session.get_bind(clause=stmt).dialect.supports_server_side_cursors:
+        stmt = stmt.execution_options(stream_results=True)
+    conexao = db.session.connection(bind_arguments={'clause': stmt})
+    return pd.read_sql(stmt, conexao, chunksize=LOTE_LEITURA, dtype=tipos, parse_dates=datas)
+
+
+def _vazio(colunas):
+    return pd.DataFrame({nome: pd.Series(dtype=tipo) for nome, tipo in colunas.items()})
+
+
+def _somar_por_dia(partes, colunas):
+    """Junta os totais dos lotes (um dia pode estar em mais de um lote) num total por (data, id_produto)."""
+    if not partes:
+        return _vazio(colunas)
+    valores = [nome for nome in colunas if nome not in ('data', 'id_produto')]
+    total = pd.concat(partes, ignore_index=True).groupby(['data', 'id_produto'], as_index=False)[valores].sum()
+    return total.astype(colunas)
+
+
+def _no_intervalo(stmt, coluna, de, ate):
+    """Filtra 'coluna' em [de, ate); None não limita aquele lado."""
+    if de is not None:
+        stmt = stmt.where(coluna >= de.to_pydatetime())
+    if ate is not None:
+        stmt = stmt.where(coluna < ate.to_pydatetime())
+    return stmt
+
+
+def extrair_vendas(de=None, ate=None):
+    """Quantidade e receita de cada produto por dia, das vendas com data em [de, ate)."""
+    stmt = _no_intervalo(
+        db.select(Venda.data_compra.label('data'), ProdutoVenda.id_produto,
+                  func.coalesce(ProdutoVenda.quantidade, 0).label('quantidade'), ProdutoVenda.preco_unitario)
+        .join(Venda, Venda.id_venda == ProdutoVenda.id_venda),
+        Venda.data_compra, de, ate)
+    partes = []
+    for lote in _ler_em_lotes(stmt, TIPOS_VENDAS, ['data']):
+        lote['data'] = lote['data'].dt.normalize()
+        lote['receita'] = lote['quantidade'] * lote['preco_unitario']
+        partes.append(lote.groupby(['data', 'id_produto'], as_index=False, sort=False)[['quantidade', 'receita']].sum())
+    return _somar_por_dia(partes, COLUNAS_VENDAS)
+
+
+def extrair_movimentos(de=None, ate=None):
+    """Variação com sinal do estoque de cada produto por dia, das movimentações com data em [de, ate)."""
+    stmt = _no_intervalo(
+        db.select(MovimentacaoEstoque.data_movimentacao.label('data'), MovimentacaoEstoque.id_produto,
+                  movimentacoes.variacao().label('variacao')),
+        MovimentacaoEstoque.data_movimentacao, de, ate)
+    partes = []
+    for lote in _ler_em_lotes(stmt, TIPOS_MOVIMENTOS, ['data']):
+        lote['data'] = lote['data'].dt.normalize()
+        partes.append(lote.groupby(['data', 'id_produto'], as_index=False, sort=False)[['variacao']].sum())
+    return _somar_por_dia(partes, COLUNAS_MOVIMENTOS)
+
+
+def _produtos():
+    """id_produto, nome e estoque atual de todos os produtos, indexados por id_produto."""
+    stmt = db.select(Produto.id_produto, Produto.nome,
+                     func.coalesce(Estoque.quantidade_produto, 0).label('estoque')).join(Produto.estoque)
+    partes = list(_ler_em_lotes(stmt, TIPOS_PRODUTOS))
+    if not partes:
+        return pd.DataFrame({'nome': pd.Series(dtype=object), 'estoque': pd.Series(dtype='int64')},
+                            index=pd.Index([], dtype='int32', name='id_produto'))
+    return pd.concat(partes, ignore_index=True).set_index('id_produto')
+
+
+# =======================================================================
+# SNAPSHOTS
+# =======================================================================
+
+def formato():
+    """Formato dos snapshots: ANALISES_FORMATO, ou Parquet se o 'pyarrow' estiver instalado e pickle se não."""
+    escolhido = app.config['ANALISES_FORMATO']
+    if escolhido and escolhido not in FORMATOS:
+        raise ValueError(f'ANALISES_FORMATO não suportado: {escolhido}')
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        if escolhido in ('parquet', 'feather'):
+            raise RuntimeError(f"ANALISES_FORMATO={escolhido} requer o pacote 'pyarrow' (pip install pyarrow).")
+        return 'pickle'
+    return escolhido or 'parquet'
+
+
+def _caminho(nome, extensao=None):
+    return os.path.join(app.config['ANALISES_DIR'], f'{nome}.{extensao or EXTENSOES[formato()]}')
+
+
+def _ler_estado():
+    """{'ate': último corte gravado (AAAA-MM-DD), 'formato': ...}, ou {} se ainda não há snapshot."""
+    try:
+        with open(_caminho('estado', 'json'), encoding='utf-8') as arquivo:
+            estado = json.load(arquivo)
+    except (FileNotFoundError, ValueError):
+        return {}
+    # Snapshot de outro formato (ANALISES_FORMATO mudou): é refeito na próxima atualização.
+    return estado if estado.get('formato') == formato() else {}
+
+
+def _gravar_arquivo(caminho, escrever):
+    """Grava por um arquivo temporário e os.replace, para que um leitor nunca veja um arquivo pela metade."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    escrever(temporario)
+    os.replace(temporario, caminho)
+
+
+def _gravar(nome, tabela):
+    tabela = tabela.reset_index(drop=True)
+    escrita = {'parquet': lambda caminho: tabela.to_parquet(caminho, index=False),
+               'feather': tabela.to_feather,
+               'pickle': lambda caminho: tabela.to_pickle(caminho, compression=None)}[formato()]
+    _gravar_arquivo(_caminho(nome), escrita)
+
+
+def _carregar(nome, colunas):
+    """O snapshot 'nome', lido do disco só quando o arquivo mudou desde a última leitura neste processo."""
+    caminho = _caminho(nome)
+    try:
+        versao = os.stat(caminho).st_mtime_ns
+    except FileNotFoundError:
+        return _vazio(colunas)
+    carregado = _carregados.get(caminho)
+    if carregado is not None and carregado[0] == versao:
+        return carregado[1]
+    leitura = {'parquet': pd.read_parquet, 'feather': pd.read_feather,
+               'pickle': lambda caminho: pd.read_pickle(caminho, compression=None)}[formato()]
+    tabela = leitura(caminho).astype(colunas)
+    _carregados[caminho] = (versao, tabela)
+    return tabela
+
+
+def _dia(valor):
+    return pd.Timestamp(valor).normalize()
+
+
+def atualizar(completo=False):
+    """
+    Acrescenta aos snapshots os dias fechados (até ontem, pelo relógio do
+    banco) que ainda não estão neles; com 'completo', refaz tudo. Devolve o
+    número de linhas (produto x dia) novas de vendas e de movimentos.
+    """
+    with _trava:
+        estado = {} if completo else _ler_estado()
+        corte = _dia(movimentacoes.agora_no_banco())
+        desde = pd.Timestamp(estado['ate']) if estado.get('ate') else None
+        if desde is not None and desde >= corte:
+            return 0, 0
+        vendas = extrair_vendas(desde, corte)
+        movimentos = extrair_movimentos(desde, corte)
+        # Os dias são disjuntos: as linhas novas só se somam às antigas.
+        if desde is not None:
+            vendas_total = pd.concat([_carregar(SNAPSHOT_VENDAS, COLUNAS_VENDAS), vendas], ignore_index=True)
+            movimentos_total = pd.concat([_carregar(SNAPSHOT_MOVIMENTOS, COLUNAS_MOVIMENTOS), movimentos], ignore_index=True)
+        else:
+            vendas_total, movimentos_total = vendas, movimentos
+        _gravar(SNAPSHOT_VENDAS, vendas_total)
+        _gravar(SNAPSHOT_MOVIMENTOS, movimentos_total)
+        # O estado por último: quem lê o corte novo já encontra os arquivos com esses dias.
+        _gravar_arquivo(_caminho('estado', 'json'), lambda caminho: _gravar_json(caminho, {
+            'ate': corte.date().isoformat(), 'formato': formato(),
+            'linhas_vendas': len(vendas_total), 'linhas_movimentos': len(movimentos_total),
+        }))
+    logger.info('Snapshots das análises atualizados até %s: %d linha(s) de vendas e %d de movimentos novas',
+                corte.date(), len(vendas), len(movimentos))
+    return len(vendas), len(movimentos)
+
+
+def _gravar_json(caminho, dados):
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        json.dump(dados, arquivo)
+
+
+def _diarios(nome, colunas, extrair, de):
+    """Totais diários a partir do dia 'de': o snapshot até o último corte e o banco depois dele."""
+    corte = _ler_estado().get('ate')
+    if corte is None:
+        return extrair(de)
+    corte = pd.Timestamp(corte)
+    gravado = _carregar(nome, colunas)
+    gravado = gravado[gravado['data'] >= de]
+    return pd.concat([gravado, extrair(max(de, corte))], ignore_index=True)
+
+
+def vendas_desde(de):
+    return _diarios(SNAPSHOT_VENDAS, COLUNAS_VENDAS, extrair_vendas, de)
+
+
+def movimentos_desde(de):
+    return _diarios(SNAPSHOT_MOVIMENTOS, COLUNAS_MOVIMENTOS, extrair_movimentos, de)
+
+
+# =======================================================================
+# ANÁLISES
+# =======================================================================
+
+def _registros(tabela):
+    """Linhas do DataFrame como dicts para o JSON, com NaN/infinito como None."""
+    tabela = tabela.replace([np.inf, -np.inf], np.nan)
+    return tabela.astype(object).where(tabela.notna(), None).to_dict('records')
+
+
+def _periodo(de, ate):
+    return {'de': de.date().isoformat(), 'ate': ate.date().isoformat()}
+
+
+def curva_abc(de, ate):
+    """
+    Classificação ABC dos produtos pela receita entre os dias 'de' e 'ate'
+    (inclusivo). Em ordem decrescente de receita, um produto é A se o
+    acumulado antes dele está abaixo de LIMITE_CLASSE_A, B se abaixo de
+    LIMITE_CLASSE_B e C nos demais casos (inclusive sem vendas).
+    """
+    de, ate = _dia(de), _dia(ate)
+    vendas = vendas_desde(de)
+    vendas = vendas[vendas['data'] <= ate]
+    produtos = _produtos()
+    tabela = vendas.groupby('id_produto')[['quantidade', 'receita']].sum().reindex(produtos.index, fill_value=0)
+    tabela['nome'] = produtos['nome']
+    tabela = tabela.reset_index().sort_values(['receita', 'id_produto'], ascending=[False, True], ignore_index=True)
+    total = tabela['receita'].sum()
+    tabela['participacao'] = tabela['receita'] / total if total > 0 else 0.0
+    tabela['acumulado'] = tabela['participacao'].cumsum()
+    # O produto que cruza o limite ainda fica na classe: conta o acumulado antes dele.
+    anterior = tabela['acumulado'] - tabela['participacao']
+    tabela['classe'] = np.select(
+        [(tabela['receita'] > 0) & (anterior < LIMITE_CLASSE_A), (tabela['receita'] > 0) & (anterior < LIMITE_CLASSE_B)],
+        ['A', 'B'], default='C')
+    resumo = tabela.groupby('classe').agg(produtos=('id_produto', 'size'), receita=('receita', 'sum'))
+    resumo = resumo.reindex(['A', 'B', 'C'], fill_value=0)
+    tabela[['receita', 'participacao', 'acumulado']] = tabela[['receita', 'participacao', 'acumulado']].round(4)
+    return {
+        **_periodo(de, ate),
+        'receita_total': round(float(total), 2),
+        'resumo': {classe: {'produtos': int(linha['produtos']), 'receita': round(float(linha['receita']), 2)}
+                   for classe, linha in resumo.iterrows()},
+        'produtos': _registros(tabela[['id_produto', 'nome', 'quantidade', 'receita', 'participacao', 'acumulado', 'classe']]),
+    }
+
+
+def giro_e_cobertura(de, ate, janela=JANELA_COBERTURA_PADRAO):
+    """
+    Por produto, entre os dias 'de' e 'ate' (inclusivo):
+      - vendidos: unidades vendidas no período;
+      - estoque_medio: média do estoque no fim de cada dia do período,
+        reconstruída do estoque atual descontando as movimentações posteriores;
+      - giro: vendidos / estoque_medio;
+      - media_diaria: unidades vendidas por dia nos 'janela' dias até 'ate';
+      - dias_cobertura: quantos dias o estoque atual dura nesse ritmo.
+    Giro e cobertura são None quando o divisor é zero.
+    """
+    de, ate = _dia(de), _dia(ate)
+    inicio_janela = ate - pd.Timedelta(days=janela - 1)
+    dias = (ate - de).days + 1
+    produtos = _produtos()
+
+    vendas = vendas_desde(min(de, inicio_janela))
+    vendas = vendas[vendas['data'] <= ate]
+    vendidos = vendas.loc[vendas['data'] >= de].groupby('id_produto')['quantidade'].sum()
+    na_janela = vendas.loc[vendas['data'] >= inicio_janela].groupby('id_produto')['quantidade'].sum()
+
+    # Estoque no fim do dia d = atual - variações dos dias depois de d. Na média
+    # dos dias do período, uma movimentação do dia t conta nos dias d < t do
+    # período: clip(t - de, 0, dias) vezes. Assim não é preciso montar a
+    # matriz produto x dia, só somar as movimentações com peso.
+    movimentos = movimentos_desde(de + pd.Timedelta(days=1))
+    peso = np.clip((movimentos['data'] - de).dt.days.to_numpy(), 0, dias)
+    depois = pd.Series(movimentos['variacao'].to_numpy() * peso, index=movimentos['id_produto']).groupby(level=0).sum()
+
+    tabela = pd.DataFrame({
+        'nome': produtos['nome'],
+        'estoque_atual': produtos['estoque'],
+        'vendidos': vendidos.reindex(produtos.index, fill_value=0),
+        'estoque_medio': produtos['estoque'] - depois.reindex(produtos.index, fill_value=0) / dias,
+        'media_diaria': na_janela.reindex(produtos.index, fill_value=0) / janela,
+    })
+    medio = tabela['estoque_medio'].where(tabela['estoque_medio'] > 0)
+    tabela['giro'] = tabela['vendidos'] / medio
+    tabela['dias_cobertura'] = tabela['estoque_atual'] / tabela['media_diaria'].where(tabela['media_diaria'] > 0)
+    tabela = tabela.round({'estoque_medio': 2, 'media_diaria': 4, 'giro': 4, 'dias_cobertura': 1})
+    tabela = tabela.reset_index().sort_values(['giro', 'id_produto'], ascending=[False, True], na_position='last')
+    return {**_periodo(de, ate), 'janela_cobertura': janela, 'produtos': _registros(
+        tabela[['id_produto', 'nome', 'estoque_atual', 'vendidos', 'estoque_medio', 'giro', 'media_diaria', 'dias_cobertura']]
+    )}
+
+
+def mais_vendidos(de, ate, limite=MAIS_VENDIDOS_PADRAO, por=None, ordem='quantidade'):
+    """
+    Os 'limite' produtos mais vendidos (por 'quantidade' ou 'receita') entre
+    os dias 'de' e 'ate' (inclusivo), no período inteiro ou em cada dia,
+    semana (de segunda a domingo) ou mês ('por').
+    """
+    de, ate = _dia(de), _dia(ate)
+    vendas = vendas_desde(de)
+    vendas = vendas[vendas['data'] <= ate].copy()
+    if por:
+        vendas['periodo'] = vendas['data'].dt.to_period(PERIODOS[por]).dt.start_time
+    else:
+        vendas['periodo'] = de
+    tabela = vendas.groupby(['periodo', 'id_produto'], as_index=False)[['quantidade', 'receita']].sum()
+    outra = 'receita' if ordem == 'quantidade' else 'quantidade'
+    tabela = tabela.sort_values(['periodo', ordem, outra, 'id_produto'], ascending=[True, False, False, True])
+    tabela = tabela.groupby('periodo', sort=False).head(limite).copy()
+    tabela['posicao'] = tabela.groupby('periodo').cumcount() + 1
+    tabela['nome'] = tabela['id_produto'].map(_produtos()['nome'])
+    tabela['receita'] = tabela['receita'].round(2)
+    colunas = ['posicao', 'id_produto', 'nome', 'quantidade', 'receita']
+    return {**_periodo(de, ate), 'por': por, 'ordem': ordem, 'periodos': [
+        {'inicio': max(periodo, de).date().isoformat(), 'produtos': _registros(grupo[colunas])}
+        for periodo, grupo in tabela.groupby('periodo', sort=True)
+    ]}
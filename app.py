@@ -1,11 +1,7 @@
-import os, io, json
-from flask import Flask, render_template, request, redirect, session, url_for, jsonify, flash, send_file
-import pandas as pd
-from io import BytesIO
+import os, io, json, time
+from flask import Flask, render_template, request, redirect, session, url_for, jsonify, flash, send_file, g
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func, not_
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import func, not_, or_, and_
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 import click
@@ -19,13 +15,131 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Usa a tabela VENDAS_MENSAIS no gráfico do dashboard. Ative só depois de
+# criá-la e preenchê-la com 'flask reconstruir-vendas-mensais'.
+app.config['VENDAS_MENSAIS_ATIVO'] = os.getenv('VENDAS_MENSAIS_ATIVO', '0') == '1'
+# Tarefas em segundo plano (tarefas.py): exportações assíncronas e a
+# varredura periódica de estoque baixo.
+app.config['TAREFAS_ATIVO'] = os.getenv('TAREFAS_ATIVO', '1') == '1'
+app.config['TAREFAS_THREADS'] = int(os.getenv('TAREFAS_THREADS', '2'))
+app.config['ALERTA_ESTOQUE_MINUTOS'] = int(os.getenv('ALERTA_ESTOQUE_MINUTOS', '15'))
+# Intervalo da verificação do snapshot mensal do razão do estoque (0 = só
+# pelo comando 'flask gerar-snapshot-estoque').
+app.config['ESTOQUE_SNAPSHOT_HORAS'] = int(os.getenv('ESTOQUE_SNAPSHOT_HORAS', '6'))
+app.config['EXPORTACOES_DIR'] = os.getenv('EXPORTACOES_DIR', os.path.join(app.instance_path, 'exportacoes'))
+app.config['EXPORTACOES_HORAS'] = int(os.getenv('EXPORTACOES_HORAS', '24'))
+# Eventos ao vivo (eventos.py): vazio = só as telas conectadas a este processo;
+# 'redis://...' = entre todos os processos. Cada conexão ocupa uma thread,
+# por isso o padrão é metade de WEB_THREADS por processo.
+app.config['EVENTOS_URL'] = os.getenv('EVENTOS_URL', '')
+app.config['EVENTOS_CONEXOES_MAXIMAS'] = int(os.getenv('EVENTOS_CONEXOES_MAXIMAS', str(max(1, int(os.getenv('WEB_THREADS', '4')) // 2))))
+app.config['EVENTOS_DURACAO_MAXIMA'] = int(os.getenv('EVENTOS_DURACAO_MAXIMA', '300'))
+# Recibos das vendas, gerados na primeira leitura e servidos do disco (recibos.py).
+app.config['RECIBOS_DIR'] = os.getenv('RECIBOS_DIR', os.path.join(app.instance_path, 'recibos'))
+# Análises de vendas e estoque (analises.py): totais diários gravados em disco,
+# atualizados a cada ANALISES_HORAS (0 = só por 'flask atualizar-analises').
+# Formato: 'parquet' ou 'feather' (requerem pyarrow) ou 'pickle'; vazio =
+# Parquet quando o pyarrow está instalado, pickle quando não.
+app.config['ANALISES_DIR'] = os.getenv('ANALISES_DIR', os.path.join(app.instance_path, 'analises'))
+app.config['ANALISES_FORMATO'] = os.getenv('ANALISES_FORMATO', '')
+app.config['ANALISES_HORAS'] = int(os.getenv('ANALISES_HORAS', '6'))
+# Cache de leitura (cache.py): vazio = em memória, por processo; 'redis://...'
+# = compartilhado entre os processos.
+app.config['CACHE_URL'] = os.getenv('CACHE_URL', '')
+app.config['CACHE_TTL'] = int(os.getenv('CACHE_TTL', '60'))
+app.config['CACHE_TAMANHO'] = int(os.getenv('CACHE_TAMANHO', '1024'))
+# Métricas (metricas.py): instruções SQL acima deste tempo vão para o log de
+# consultas lentas; PERFIL_ATIVO libera o '?perfil=1' para gerentes; com
+# METRICAS_TOKEN, /metrics exige 'Authorization: Bearer <token>'.
+app.config['SQL_LENTA_MS'] = float(os.getenv('SQL_LENTA_MS', '200'))
+app.config['PERFIL_ATIVO'] = os.getenv('PERFIL_ATIVO', '0') == '1'
+app.config['METRICAS_TOKEN'] = os.getenv('METRICAS_TOKEN', '')
+# Pool de conexões (ver servidor.py). Cada processo abre até
+# DB_POOL_TAMANHO + DB_POOL_EXTRA conexões; DB_POOL_RECICLAR renova as
+# conexões antes que o MySQL as derrube por ociosidade (wait_timeout) e
+# DB_POOL_ESPERA é quanto uma requisição espera por uma conexão livre antes
+# de falhar. DB_ISOLAMENTO vazio mantém o padrão do banco; DB_TEMPO_LIMITE_MS
+# (0 = sem limite) interrompe SELECTs longos no MySQL.
+app.config['DB_POOL_TAMANHO'] = int(os.getenv('DB_POOL_TAMANHO', '10'))
+app.config['DB_POOL_EXTRA'] = int(os.getenv('DB_POOL_EXTRA', '5'))
+app.config['DB_POOL_RECICLAR'] = int(os.getenv('DB_POOL_RECICLAR', '1800'))
+app.config['DB_POOL_ESPERA'] = int(os.getenv('DB_POOL_ESPERA', '10'))
+app.config['DB_ISOLAMENTO'] = os.getenv('DB_ISOLAMENTO', '')
+app.config['DB_TEMPO_LIMITE_MS'] = int(os.getenv('DB_TEMPO_LIMITE_MS', '0'))
+# Conexões abertas na subida de cada processo (wsgi.py) e fração do pool em
+# uso a partir da qual /saude responde 503.
+app.config['DB_AQUECER'] = int(os.getenv('DB_AQUECER', '2'))
+app.config['SAUDE_SATURACAO_MAXIMA'] = float(os.getenv('SAUDE_SATURACAO_MAXIMA', '0.9'))
+# Réplica de leitura (replica.py) para relatórios e listagens; vazio = tudo
+# no banco principal. Acima de REPLICA_ATRASO_MAXIMO segundos de atraso, as
+# leituras voltam para o principal.
+app.config['REPLICA_DATABASE_URL'] = os.getenv('REPLICA_DATABASE_URL', '')
+app.config['REPLICA_ATRASO_MAXIMO'] = float(os.getenv('REPLICA_ATRASO_MAXIMO', '10'))
+app.config['REPLICA_VERIFICAR_SEGUNDOS'] = float(os.getenv('REPLICA_VERIFICAR_SEGUNDOS', '5'))
+# Tempo máximo para abrir uma conexão com a réplica: fora do ar, ela não
+# deve prender as requisições que só iam ler dela.
+app.config['REPLICA_CONEXAO_SEGUNDOS'] = int(os.getenv('REPLICA_CONEXAO_SEGUNDOS', '2'))
+# Senhas e login (autenticacao.py): método e custo do hash no formato do
+# Werkzeug, processos que calculam os hashes (0 = na própria thread),
+# cálculos simultâneos por processo web e tentativas de login por minuto
+# (0 = sem limite).
+app.config['SENHA_METODO'] = os.getenv('SENHA_METODO', 'pbkdf2:sha256:600000')
+app.config['SENHA_PROCESSOS'] = int(os.getenv('SENHA_PROCESSOS', '2'))
+app.config['SENHA_FILA_MAXIMA'] = int(os.getenv('SENHA_FILA_MAXIMA', '16'))
+app.config['SENHA_ESPERA_SEGUNDOS'] = float(os.getenv('SENHA_ESPERA_SEGUNDOS', '3'))
+app.config['LOGIN_TENTATIVAS_USUARIO'] = max(0, int(os.getenv('LOGIN_TENTATIVAS_USUARIO', '5')))
+app.config['LOGIN_TENTATIVAS_IP'] = max(0, int(os.getenv('LOGIN_TENTATIVAS_IP', '60')))
+# Validade, em segundos, da identidade (login e cargo) guardada em memória
+# para cada conta logada; uma conta apagada ou rebaixada perde o acesso nesse prazo.
+app.config['USUARIO_CACHE_SEGUNDOS'] = float(os.getenv('USUARIO_CACHE_SEGUNDOS', '30'))
 
-db = SQLAlchemy(app)
+def _opcoes_do_engine(url):
+    """Opções do engine de 'url' a partir das variáveis DB_* acima."""
+    opcoes = {'pool_pre_ping': True}
+    if app.config['DB_ISOLAMENTO']:
+        opcoes['isolation_level'] = app.config['DB_ISOLAMENTO']
+    # O SQLite não tem limite de conexões nem as derruba; o pool dele é o
+    # padrão do SQLAlchemy (e, em memória, não aceita estas opções).
+    if not (url or '').startswith('sqlite'):
+        opcoes.update(pool_size=app.config['DB_POOL_TAMANHO'], max_overflow=app.config['DB_POOL_EXTRA'],
+                      pool_recycle=app.config['DB_POOL_RECICLAR'], pool_timeout=app.config['DB_POOL_ESPERA'])
+    return opcoes
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = _opcoes_do_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+
+from replica import BIND_REPLICA, SessaoRoteada, leitura_na_replica, opcoes_de_conexao
+if app.config['REPLICA_DATABASE_URL']:
+    app.config['SQLALCHEMY_BINDS'] = {
+        BIND_REPLICA: {'url': app.config['REPLICA_DATABASE_URL'], **_opcoes_do_engine(app.config['REPLICA_DATABASE_URL']),
+                       'connect_args': opcoes_de_conexao(app.config['REPLICA_DATABASE_URL'], app.config['REPLICA_CONEXAO_SEGUNDOS'])}
+    }
+
+db = SQLAlchemy(app, session_options={'class_': SessaoRoteada})
 
 # Importa os modelos após a inicialização do 'db'
 from models import (Usuario, Fornecedor, Estoque, Produto, Venda, Categoria, 
                     Endereco, Mensagem, Cliente, Pagamento, ProdutoVenda,
-                    PedidoFornecedor, PedidoProduto, MovimentacaoEstoque)
+                    PedidoFornecedor, PedidoProduto, MovimentacaoEstoque, VendaMensal,
+                    Indicador, EstoqueSnapshot)
+import exportacao
+import consultas
+import importacao
+import busca
+import tarefas
+import cache
+import metricas
+import servidor
+import movimentacoes
+import autenticacao
+from autenticacao import exige_cargo
+import respostas
+import recibos
+import eventos
+import analises
+
+cache.dados.usar_backend(cache.criar_backend(
+    app.config['CACHE_URL'], tamanho_maximo=app.config['CACHE_TAMANHO'], ttl=app.config['CACHE_TTL']
+))
 
 
 # =======================================================================
@@ -47,31 +161,285 @@ def valida_cpf(cpf: str) -> bool:
     if resto != int(cpf[10]): return False
     return True
 
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 200
+
+def _ler_data_filtro(valor):
+    """Converte 'AAAA-MM-DD' em datetime, ignorando valores inválidos."""
+    try:
+        return datetime.strptime(valor, '%Y-%m-%d') if valor else None
+    except ValueError:
+        return None
+
+def _filtrar_periodo(stmt, coluna_data):
+    """Aplica os filtros 'de'/'ate' (AAAA-MM-DD, inclusivo) da query string."""
+    return _aplicar_periodo(stmt, coluna_data, _ler_data_filtro(request.args.get('de')),
+                            _ler_data_filtro(request.args.get('ate')))
+
+def _aplicar_periodo(stmt, coluna_data, de, ate):
+    """Filtra 'coluna_data' entre as datas 'de' e 'ate' (inclusivo); None não filtra."""
+    if de:
+        stmt = stmt.where(coluna_data >= de)
+    if ate:
+        stmt = stmt.where(coluna_data < ate + timedelta(days=1))
+    return stmt
+
+def paginar_keyset(query, coluna_data, coluna_id):
+    """
+    Pagina uma listagem por cursor (keyset), do registro mais recente para o
+    mais antigo, ordenando por (coluna_data, coluna_id).
+
+    Lê da query string: 'cursor' (data e id do último item da página anterior),
+    'por_pagina', e o intervalo de datas 'de'/'ate' (AAAA-MM-DD, inclusivo).
+    Como o filtro usa o índice (data, id), o custo de cada página depende
+    apenas do tamanho da página, e não do volume do histórico.
+
+    Retorna (itens, paginacao), onde 'paginacao' traz os parâmetros usados
+    para montar os links no template.
+    """
+    por_pagina = request.args.get('por_pagina', TAMANHO_PAGINA_PADRAO, type=int)
+    por_pagina = max(1, min(por_pagina, TAMANHO_PAGINA_MAXIMO))
+    de = _ler_data_filtro(request.args.get('de'))
+    ate = _ler_data_filtro(request.args.get('ate'))
+    query = _filtrar_periodo(query, coluna_data)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            data_cursor, id_cursor = cursor.rsplit('_', 1)
+            data_cursor = datetime.fromisoformat(data_cursor)
+            id_cursor = int(id_cursor)
+        except ValueError:
+            cursor = None
+        else:
+            query = query.filter(or_(
+                coluna_data < data_cursor,
+                and_(coluna_data == data_cursor, coluna_id < id_cursor)
+            ))
+
+    itens = query.order_by(coluna_data.desc(), coluna_id.desc()).limit(por_pagina + 1).all()
+    proximo_cursor = None
+    if len(itens) > por_pagina:
+        itens = itens[:por_pagina]
+        ultimo = itens[-1]
+        proximo_cursor = f"{getattr(ultimo, coluna_data.key).isoformat()}_{getattr(ultimo, coluna_id.key)}"
+
+    paginacao = {
+        'por_pagina': por_pagina,
+        'de': request.args.get('de') if de else None,
+        'ate': request.args.get('ate') if ate else None,
+        'cursor': cursor,
+        'proximo_cursor': proximo_cursor,
+    }
+    return itens, paginacao
+
+INDICADORES_DASHBOARD = ('total_vendas', 'total_produtos_estoque')
+DIAS_PRODUTO_PARADO = 90
+
+def incrementar_indicadores(**incrementos):
+    """
+    Soma os valores informados aos contadores do dashboard (tabela INDICADOR),
+    dentro da transação atual. Ex.: incrementar_indicadores(total_vendas=99.9).
+    """
+    for chave, valor in incrementos.items():
+        if valor:
+            consultas.upsert_incremento(Indicador, {'chave': chave}, {'valor': valor})
+
+# --- Dados de referência, lidos pelo cache (cache.py) ---
+# Devolvem só ids e valores simples, que podem ser guardados fora da sessão
+# do SQLAlchemy (e serializados, no cache compartilhado).
+
+def id_pagamento_padrao():
+    return cache.dados.obter_ou_calcular(
+        cache.REGIAO_PAGAMENTOS, 'padrao', lambda: db.session.query(Pagamento.id_pagamento).order_by(Pagamento.id_pagamento).limit(1).scalar()
+    )
+
+def id_fornecedor_padrao():
+    return cache.dados.obter_ou_calcular(
+        cache.REGIAO_FORNECEDORES, 'padrao', lambda: db.session.query(Fornecedor.id_fornecedor).order_by(Fornecedor.id_fornecedor).limit(1).scalar()
+    )
+
+def id_categoria_padrao():
+    return cache.dados.obter_ou_calcular(
+        cache.REGIAO_CATEGORIAS, 'padrao', lambda: db.session.query(Categoria.id_categoria).order_by(Categoria.id_categoria).limit(1).scalar()
+    )
+
+def listar_fornecedores():
+    """Fornecedores por nome, para os formulários: [{'id_fornecedor', 'nome'}]."""
+    return cache.dados.obter_ou_calcular(cache.REGIAO_FORNECEDORES, 'lista', lambda: [
+        {'id_fornecedor': f.id_fornecedor, 'nome': f.nome}
+        for f in db.session.query(Fornecedor.id_fornecedor, Fornecedor.nome).order_by(Fornecedor.nome)
+    ])
+
+class EstoqueInsuficiente(Exception):
+    """Um item da venda pede mais unidades do que há em estoque."""
+
+def registrar_venda(id_cliente, carrinho, id_usuario):
+    """
+    Registra uma venda com um número fixo de instruções SQL, qualquer que seja
+    o tamanho do carrinho ({id_produto: quantidade}).
+
+    Produtos e estoques são lidos numa única consulta IN com SELECT ... FOR
+    UPDATE (em ordem de id, para evitar deadlocks entre caixas). A baixa é
+    um único UPDATE condicional ('quantidade_produto >= quantidade'): se
+    alguma linha não for atualizada, outro caixa vendeu as últimas unidades
+    e a venda é recusada com EstoqueInsuficiente, sem vender a mais. Os itens
+    e as movimentações são inseridos em lote.
+
+    Não faz commit: quem chama confirma ou desfaz a transação.
+    """
+    if not carrinho:
+        raise ValueError('A venda não tem itens.')
+    produtos = Produto.query.join(Produto.estoque).options(*consultas.PRODUTO_COM_ESTOQUE_JOIN).filter(
+        Produto.id_produto.in_(list(carrinho))
+    ).order_by(Estoque.id_estoque).with_for_update().all()
+    if len(produtos) != len(carrinho):
+        raise ValueError('Produto não encontrado.')
+
+    baixas = {}
+    valor_total_venda = 0
+    for produto in produtos:
+        qty = carrinho[produto.id_produto]
+        baixas[produto.estoque_id] = baixas.get(produto.estoque_id, 0) + qty
+        if produto.estoque.quantidade_produto < baixas[produto.estoque_id]:
+            raise EstoqueInsuficiente(f'Estoque insuficiente para "{produto.nome}". Disponível: {produto.estoque.quantidade_produto}')
+        valor_total_venda += (produto.preco_promocional or produto.preco) * qty
+
+    baixa = db.case(baixas, value=Estoque.id_estoque)
+    resultado = db.session.execute(
+        db.update(Estoque).where(
+            Estoque.id_estoque.in_(list(baixas)), Estoque.quantidade_produto >= baixa
+        ).values(quantidade_produto=Estoque.quantidade_produto - baixa, versao=Estoque.versao + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if resultado.rowcount != len(baixas):
+        raise EstoqueInsuficiente('Estoque insuficiente: outro caixa vendeu as últimas unidades. Confira as quantidades.')
+
+    nova_venda_obj = Venda(
+        id_cliente=id_cliente,
+        id_pagamento=id_pagamento_padrao(),
+        valor_total=valor_total_venda,
+        data_compra=datetime.utcnow()
+    )
+    db.session.add(nova_venda_obj)
+    db.session.flush()
+
+    db.session.execute(db.insert(ProdutoVenda), [
+        {'id_venda': nova_venda_obj.id_venda, 'id_produto': p.id_produto,
+         'quantidade': carrinho[p.id_produto], 'preco_unitario': p.preco_promocional or p.preco}
+        for p in produtos
+    ])
+    db.session.execute(db.insert(MovimentacaoEstoque), [
+        {'id_produto': p.id_produto, 'id_usuario': id_usuario, 'tipo': 'SAÍDA',
+         'quantidade': carrinho[p.id_produto], 'observacao': f'Venda #{nova_venda_obj.id_venda}'}
+        for p in produtos
+    ])
+    db.session.execute(
+        db.update(Produto).where(Produto.id_produto.in_(list(carrinho)))
+        .values(ultima_venda=nova_venda_obj.data_compra).execution_options(synchronize_session=False)
+    )
+
+    incrementar_indicadores(total_vendas=valor_total_venda, total_produtos_estoque=-sum(carrinho.values()))
+    eventos.apos_commit(eventos.TIPO_VENDA, {'id_venda': nova_venda_obj.id_venda, 'valor_total': float(valor_total_venda),
+                                             'data_compra': nova_venda_obj.data_compra.isoformat()})
+    # As quantidades já estavam travadas (FOR UPDATE): as novas saem sem outra consulta.
+    eventos.apos_commit(eventos.TIPO_ESTOQUE, {'itens': [
+        eventos.item_estoque(p.id_produto, p.nome, p.estoque.quantidade_produto - baixas[p.estoque_id],
+                             p.estoque.versao + 1, p.estoque.min_produto, -carrinho[p.id_produto])
+        for p in produtos
+    ]})
+    if app.config['VENDAS_MENSAIS_ATIVO']:
+        data = nova_venda_obj.data_compra
+        consultas.upsert_incremento(
+            VendaMensal, {'ano': data.year, 'mes': data.month},
+            {'valor_total': valor_total_venda, 'quantidade_vendas': 1}
+        )
+    return nova_venda_obj
+
+def somar_estoque(variacoes):
+    """
+    Aplica {id_estoque: variação} a vários estoques com um único
+    UPDATE ... CASE, somando no banco (sem ler a quantidade antes).
+    """
+    if not variacoes:
+        return
+    variacao = db.case(variacoes, value=Estoque.id_estoque)
+    db.session.execute(
+        db.update(Estoque).where(Estoque.id_estoque.in_(list(variacoes)))
+        .values(quantidade_produto=Estoque.quantidade_produto + variacao, versao=Estoque.versao + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+def registrar_recebimento(id_pedido, recebidos, id_usuario):
+    """
+    Dá entrada no estoque dos itens de um pedido a fornecedor, com um número
+    fixo de instruções SQL qualquer que seja o número de linhas do pedido.
+    'recebidos' é {id_produto: quantidade recebida}; quantidades negativas
+    são ignoradas.
+
+    O status passa de 'Pendente' para 'Recebido' com um UPDATE condicional,
+    de forma que dois recebimentos simultâneos do mesmo pedido não somem o
+    estoque duas vezes. Não faz commit.
+    """
+    marcado = db.session.execute(
+        db.update(PedidoFornecedor).where(
+            PedidoFornecedor.id_pedido == id_pedido, PedidoFornecedor.status == 'Pendente'
+        ).values(status='Recebido')
+    )
+    if marcado.rowcount != 1:
+        raise ValueError(f'O pedido #{id_pedido} já foi processado.')
+
+    linhas = db.session.query(PedidoProduto.id_produto, Produto.estoque_id).join(
+        Produto, PedidoProduto.id_produto == Produto.id_produto
+    ).filter(PedidoProduto.id_pedido == id_pedido).all()
+
+    variacoes, movimentacoes = {}, []
+    for id_produto, id_estoque in linhas:
+        quantidade = recebidos.get(id_produto, -1)
+        if quantidade < 0:
+            continue
+        variacoes[id_estoque] = variacoes.get(id_estoque, 0) + quantidade
+        movimentacoes.append({
+            'id_produto': id_produto, 'id_usuario': id_usuario, 'tipo': 'ENTRADA',
+            'quantidade': quantidade, 'observacao': f'Recebimento do Pedido #{id_pedido}'
+        })
+
+    somar_estoque(variacoes)
+    if movimentacoes:
+        db.session.execute(db.insert(MovimentacaoEstoque), movimentacoes)
+    incrementar_indicadores(total_produtos_estoque=sum(variacoes.values()))
+    if variacoes:
+        recebidos_por_produto = {mov['id_produto']: mov['quantidade'] for mov in movimentacoes}
+        eventos.apos_commit(eventos.TIPO_ESTOQUE, {'itens': [
+            eventos.item_estoque(linha.id_produto, linha.nome, linha.quantidade_produto, linha.versao, linha.min_produto,
+                                 recebidos_por_produto[linha.id_produto])
+            for linha in db.session.execute(
+                db.select(Produto.id_produto, Produto.nome, Estoque.quantidade_produto, Estoque.versao, Estoque.min_produto)
+                .join(Estoque, Produto.estoque_id == Estoque.id_estoque)
+                .where(Produto.id_produto.in_(list(recebidos_por_produto)))
+            )
+        ]})
+
 def seed_essentials():
     """
     Verifica se os usuários essenciais (admin, seller) existem e garante que
-    suas senhas estejam corretamente criptografadas.
+    suas senhas estejam criptografadas. Só calcula o hash de quem ainda não
+    tem um (ex.: o 'placeholder_hash' do script SQL); senhas já criptografadas
+    com outra política são refeitas no próximo login.
     """
     print("Verificando e atualizando senhas dos usuários essenciais...")
     try:
-        admin_user = Usuario.query.filter_by(login='admin').first()
-        if admin_user:
-            admin_user.senha = generate_password_hash('admin')
-            print("Senha do 'admin' atualizada.")
-        else:
-            admin_user = Usuario(login='admin', senha=generate_password_hash('admin'), cargo='GERENTE')
-            db.session.add(admin_user)
-            print("Usuário 'admin' criado.")
-
-        seller_user = Usuario.query.filter_by(login='seller').first()
-        if seller_user:
-            seller_user.senha = generate_password_hash('seller')
-            print("Senha do 'seller' atualizada.")
-        else:
-            seller_user = Usuario(login='seller', senha=generate_password_hash('seller'), cargo='VENDEDOR')
-            db.session.add(seller_user)
-            print("Usuário 'seller' criado.")
-            
+        for login_, cargo in (('admin', 'GERENTE'), ('seller', 'VENDEDOR')):
+            usuario = Usuario.query.filter_by(login=login_).first()
+            if usuario is None:
+                db.session.add(Usuario(login=login_, senha=autenticacao.gerar_hash(login_), cargo=cargo))
+                print(f"Usuário '{login_}' criado.")
+            elif autenticacao.metodo_do_hash(usuario.senha) is None:
+                usuario.senha = autenticacao.gerar_hash(login_)
+                print(f"Senha do '{login_}' atualizada.")
+            else:
+                print(f"Senha do '{login_}' já criptografada.")
+
         db.session.commit()
         print("Usuários essenciais verificados/atualizados com sucesso.")
     except Exception as e:
@@ -80,13 +448,36 @@ def seed_essentials():
 
 
 # --- Rotas ---
+@app.before_request
+def iniciar_tarefas():
+    # O agendador sobe no primeiro request do processo (e não nos comandos 'flask ...').
+    tarefas.iniciar()
+
 @app.route('/login', methods=['GET','POST'])
 def login():
     if request.method=='POST':
         login_ = request.form.get('login')
         senha = request.form.get('senha')
+        espera = autenticacao.registrar_tentativa(login_, request.remote_addr)
+        if espera:
+            flash(f'Muitas tentativas de login. Tente novamente em {espera} segundo(s).', 'danger')
+            return render_template('login.html'), 429, {'Retry-After': str(espera)}
         user = Usuario.query.filter_by(login=login_).first()
-        if user and check_password_hash(user.senha, senha):
+        try:
+            senha_correta = autenticacao.verificar_senha(user.senha if user else None, senha)
+        except autenticacao.HashSobrecarregado:
+            flash('Muitos acessos ao mesmo tempo. Tente novamente em instantes.', 'warning')
+            return render_template('login.html'), 503, {'Retry-After': '2'}
+        if senha_correta and autenticacao.precisa_rehash(user.senha):
+            # Senha gravada com outra política: refeita agora, que temos a senha em texto.
+            try:
+                user.senha = autenticacao.gerar_hash(senha)
+                db.session.commit()
+            except autenticacao.HashSobrecarregado:
+                # A senha já conferiu: o login segue e o hash é refeito num próximo login.
+                pass
+        if senha_correta:
+            autenticacao.login_bem_sucedido(login_, user)
             session['user_id'] = user.id_conta
             session['cargo'] = user.cargo
             session['login'] = user.login
@@ -103,7 +494,12 @@ def register():
         if user_exists:
             flash('Este nome de usuário já está em uso. Por favor, escolha outro.', 'danger')
             return redirect(url_for('register'))
-        novo_usuario = Usuario(login=login, senha=generate_password_hash(senha), cargo='VENDEDOR')
+        try:
+            hash_senha = autenticacao.gerar_hash(senha)
+        except autenticacao.HashSobrecarregado:
+            flash('Muitos acessos ao mesmo tempo. Tente novamente em instantes.', 'warning')
+            return redirect(url_for('register'))
+        novo_usuario = Usuario(login=login, senha=hash_senha, cargo='VENDEDOR')
         db.session.add(novo_usuario)
         db.session.commit()
         flash('Conta criada com sucesso! Por favor, faça o login.', 'success')
@@ -116,69 +512,73 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/')
+@exige_cargo()
 def index():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    if session.get('cargo') == 'GERENTE':
+    if g.usuario.cargo == 'GERENTE':
         return redirect(url_for('dashboard'))
     return redirect(url_for('vendas'))
 
 @app.route('/dashboard')
+@exige_cargo('GERENTE')
+@leitura_na_replica
 def dashboard():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        return redirect(url_for('login'))
 
-    hoje = datetime.utcnow()
-    noventa_dias_atras = hoje - timedelta(days=90)
-    subquery_recentes = db.session.query(ProdutoVenda.id_produto).join(Venda).filter(
-        Venda.data_compra >= noventa_dias_atras
-    ).distinct().subquery()
-    produtos_parados = db.session.query(Produto).outerjoin(
-        subquery_recentes, Produto.id_produto == subquery_recentes.c.id_produto
-    ).filter(subquery_recentes.c.id_produto == None).all()
-
-    total_vendas = db.session.query(func.sum(Venda.valor_total)).scalar() or 0
-    total_produtos_estoque = db.session.query(func.sum(Estoque.quantidade_produto)).scalar() or 0
-    
+    limite = datetime.utcnow() - timedelta(days=DIAS_PRODUTO_PARADO)
+    produtos_parados = db.session.query(Produto).options(*consultas.PRODUTO_CARD).filter(
+        or_(Produto.ultima_venda == None, Produto.ultima_venda < limite)
+    ).all()
+
+    indicadores = dict(db.session.query(Indicador.chave, Indicador.valor).filter(
+        Indicador.chave.in_(INDICADORES_DASHBOARD)
+    ).all())
+    total_vendas = indicadores.get('total_vendas') or 0
+    total_produtos_estoque = int(indicadores.get('total_produtos_estoque') or 0)
+
     return render_template(
         'dashboard.html', 
-        user=session.get('login'),
+        user=g.usuario.login,
         total_vendas=total_vendas,
         total_produtos_estoque=total_produtos_estoque,
         produtos_parados=produtos_parados
     )
 
 @app.route('/estoque')
+@exige_cargo()
 def estoque():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     query = request.args.get('q')
-    produtos_query = Produto.query.order_by(Produto.nome)
     if query:
-        produtos_query = produtos_query.filter(Produto.nome.ilike(f'%{query}%'))
-    produtos = produtos_query.all()
+        produtos = busca.pesquisar_produtos(query, limite=TAMANHO_PAGINA_MAXIMO)
+    else:
+        produtos = Produto.query.options(*consultas.PRODUTO_CARD).order_by(Produto.nome).all()
     
-    produtos_estoque_baixo = db.session.query(Produto).join(Estoque).filter(
-        Estoque.quantidade_produto <= 5
-    ).all()
-
     return render_template('estoque.html', 
                            produtos=produtos, 
-                           cargo=session.get('cargo'), 
+                           cargo=g.usuario.cargo, 
                            search_query=query,
-                           produtos_estoque_baixo=produtos_estoque_baixo)
+                           produtos_estoque_baixo=produtos_abaixo_do_minimo())
+
+def produtos_abaixo_do_minimo():
+    """
+    Produtos com quantidade_produto <= min_produto, pelo índice de
+    ESTOQUE.abaixo_minimo (só as linhas marcadas são lidas, e o produto de
+    cada uma vem pelo índice de PRODUTO.estoque_id).
+    """
+    return db.session.query(
+        Produto.id_produto, Produto.nome, Estoque.quantidade_produto, Estoque.min_produto
+    ).select_from(Estoque).join(Produto, Produto.estoque_id == Estoque.id_estoque).filter(
+        Estoque.abaixo_minimo == True
+    ).order_by(Estoque.quantidade_produto, Produto.nome).all()
 
 @app.route('/mensagens')
+@exige_cargo('GERENTE')
 def mensagens():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        return redirect(url_for('login'))
-    msgs = Mensagem.query.order_by(Mensagem.data_envio.desc()).all()
-    return render_template('mensagens.html', mensagens=msgs)
+    query = Mensagem.query.options(*consultas.LISTA_MENSAGENS)
+    msgs, paginacao = paginar_keyset(query, Mensagem.data_envio, Mensagem.id)
+    return render_template('mensagens.html', mensagens=msgs, paginacao=paginacao)
 
 @app.route('/contatar_fornecedor/<int:id_produto>', methods=['GET', 'POST'])
+@exige_cargo()
 def contatar_fornecedor(id_produto):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     produto = Produto.query.get_or_404(id_produto)
     if not produto.fornecedor:
         flash('Este produto não tem um fornecedor associado.', 'warning')
@@ -207,9 +607,8 @@ def contatar_fornecedor(id_produto):
     return render_template('contatar_fornecedor.html', produto=produto)
 
 @app.route('/produto/novo', methods=['GET', 'POST'])
+@exige_cargo('GERENTE')
 def novo_produto():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        return redirect(url_for('login'))
     if request.method == 'POST':
         nome = request.form.get('nome')
         descricao = request.form.get('descricao')
@@ -221,33 +620,36 @@ def novo_produto():
         novo_estoque = Estoque(quantidade_produto=int(quantidade), min_produto=1)
         db.session.add(novo_estoque)
         db.session.flush()
-        fornecedor_padrao = Fornecedor.query.first()
-        categoria_padrao = Categoria.query.first()
-        novo_prod = Produto(nome=nome, descricao=descricao, preco=float(preco), estoque_id=novo_estoque.id_estoque, fornecedor_id=fornecedor_padrao.id_fornecedor, id_categoria=categoria_padrao.id_categoria)
+        novo_prod = Produto(nome=nome, nome_busca=busca.normalizar(nome), descricao=descricao, preco=float(preco), estoque_id=novo_estoque.id_estoque, fornecedor_id=id_fornecedor_padrao(), id_categoria=id_categoria_padrao())
         db.session.add(novo_prod)
+        if int(quantidade):
+            db.session.add(MovimentacaoEstoque(produto=novo_prod, id_usuario=g.usuario.id_conta, tipo=movimentacoes.TIPO_SALDO_INICIAL,
+                                               quantidade=int(quantidade), observacao='Cadastro do produto'))
+        incrementar_indicadores(total_produtos_estoque=int(quantidade))
         db.session.commit()
+        cache.dados.invalidar(cache.REGIAO_ESTOQUE)
         flash('Produto adicionado com sucesso!', 'success')
         return redirect(url_for('estoque'))
     return render_template('produto_form.html', title='Adicionar Novo Produto')
 
 @app.route('/produto/<int:id_produto>/editar', methods=['GET', 'POST'])
+@exige_cargo()
 def editar_produto(id_produto):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     produto = Produto.query.get_or_404(id_produto)
     if request.method == 'POST':
         produto.nome = request.form.get('nome')
+        produto.nome_busca = busca.normalizar(produto.nome)
         produto.descricao = request.form.get('descricao')
         produto.preco = float(request.form.get('preco'))
         db.session.commit()
+        cache.dados.invalidar(cache.REGIAO_ESTOQUE)
         flash('Produto atualizado com sucesso!', 'success')
         return redirect(url_for('estoque'))
     return render_template('produto_form.html', title='Editar Produto', produto=produto)
 
 @app.route('/produto/<int:id_produto>/promocao', methods=['GET', 'POST'])
+@exige_cargo('GERENTE')
 def criar_promocao(id_produto):
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        return redirect(url_for('login'))
     produto = Produto.query.get_or_404(id_produto)
     if request.method == 'POST':
         novo_preco_str = request.form.get('preco_promocional')
@@ -262,64 +664,75 @@ def criar_promocao(id_produto):
     return render_template('promocao_form.html', produto=produto)
 
 @app.route('/pedidos')
+@exige_cargo()
 def pedidos():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    lista_pedidos = PedidoFornecedor.query.order_by(PedidoFornecedor.data_pedido.desc()).all()
-    return render_template('pedidos.html', pedidos=lista_pedidos)
+    query = PedidoFornecedor.query.options(*consultas.LISTA_PEDIDOS)
+    lista_pedidos, paginacao = paginar_keyset(query, PedidoFornecedor.data_pedido, PedidoFornecedor.id_pedido)
+    return render_template('pedidos.html', pedidos=lista_pedidos, paginacao=paginacao)
+
+@app.route('/pedidos/<int:id_pedido>/confirmar', methods=['POST'])
+@exige_cargo()
+def confirmar_pedido(id_pedido):
+    """Transforma um rascunho gerado pela varredura de estoque baixo num pedido pendente."""
+    confirmado = db.session.execute(
+        PedidoFornecedor.__table__.update().where(
+            PedidoFornecedor.id_pedido == id_pedido, PedidoFornecedor.status == tarefas.PEDIDO_RASCUNHO
+        ).values(status='Pendente')
+    ).rowcount
+    db.session.commit()
+    if confirmado:
+        flash(f'Pedido #{id_pedido} confirmado.', 'success')
+    else:
+        flash('Este pedido não é um rascunho.', 'info')
+    return redirect(url_for('pedidos'))
 
 @app.route('/pedidos/novo', methods=['GET', 'POST'])
+@exige_cargo()
 def novo_pedido():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     if request.method == 'POST':
         id_fornecedor = request.form.get('fornecedor')
         produtos_ids = request.form.getlist('produto_id[]')
         quantidades = request.form.getlist('quantidade[]')
         if not id_fornecedor or not produtos_ids:
             flash('Selecione um fornecedor e adicione ao menos um produto.', 'warning')
-            fornecedores = Fornecedor.query.order_by(Fornecedor.nome).all()
-            produtos = Produto.query.order_by(Produto.nome).all()
-            return render_template('novo_pedido.html', fornecedores=fornecedores, produtos=produtos)
+            return render_template('novo_pedido.html', fornecedores=listar_fornecedores())
+        itens = [(int(pid), int(qty)) for pid, qty in zip(produtos_ids, quantidades) if pid and qty and int(qty) > 0]
+        nomes = dict(db.session.query(Produto.id_produto, Produto.nome).filter(
+            Produto.id_produto.in_({pid for pid, _ in itens})
+        ).all())
         novo_pedido_obj = PedidoFornecedor(id_fornecedor=id_fornecedor)
         db.session.add(novo_pedido_obj)
         db.session.flush()
-        itens_para_msg = []
-        for pid, qty in zip(produtos_ids, quantidades):
-            if pid and qty and int(qty) > 0:
-                item_pedido = PedidoProduto(pedido=novo_pedido_obj, id_produto=int(pid), quantidade_pedida=int(qty))
-                db.session.add(item_pedido)
-                produto_nome = Produto.query.get(int(pid)).nome
-                itens_para_msg.append(f"{produto_nome} ({qty} un)")
+        if itens:
+            db.session.execute(db.insert(PedidoProduto), [
+                {'id_pedido': novo_pedido_obj.id_pedido, 'id_produto': pid, 'quantidade_pedida': qty} for pid, qty in itens
+            ])
+        itens_para_msg = [f"{nomes.get(pid)} ({qty} un)" for pid, qty in itens]
         conteudo_msg = f"Pedido #{novo_pedido_obj.id_pedido} criado. Itens: {', '.join(itens_para_msg)}."
         nova_mensagem = Mensagem(fornecedor_id=id_fornecedor, conteudo=conteudo_msg, status='LOG do Sistema')
         db.session.add(nova_mensagem)
         db.session.commit()
         flash('Novo pedido criado com sucesso!', 'success')
         return redirect(url_for('pedidos'))
-    fornecedores = Fornecedor.query.order_by(Fornecedor.nome).all()
-    produtos = Produto.query.order_by(Produto.nome).all()
-    return render_template('novo_pedido.html', fornecedores=fornecedores, produtos=produtos)
+    return render_template('novo_pedido.html', fornecedores=listar_fornecedores())
 
 @app.route('/pedidos/<int:id_pedido>/receber', methods=['GET', 'POST'])
+@exige_cargo()
 def receber_pedido(id_pedido):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    pedido = PedidoFornecedor.query.get_or_404(id_pedido)
+    # No POST só o status e as quantidades do formulário são necessários; os
+    # itens são lidos em lote por registrar_recebimento.
+    opcoes = consultas.RECEBIMENTO_PEDIDO if request.method == 'GET' else ()
+    pedido = PedidoFornecedor.query.options(*opcoes).filter_by(id_pedido=id_pedido).first_or_404()
     if pedido.status != 'Pendente':
         flash('Este pedido já foi processado.', 'info')
         return redirect(url_for('pedidos'))
     if request.method == 'POST':
         try:
-            for item in pedido.itens:
-                quantidade_recebida = int(request.form.get(f'qty_{item.id_produto}'))
-                if quantidade_recebida >= 0 and item.produto.estoque:
-                    item.produto.estoque.quantidade_produto += quantidade_recebida
-                    mov = MovimentacaoEstoque(id_produto=item.id_produto, id_usuario=session.get('user_id'), tipo='ENTRADA', quantidade=quantidade_recebida, observacao=f'Recebimento do Pedido #{pedido.id_pedido}')
-                    db.session.add(mov)
-            pedido.status = 'Recebido'
+            recebidos = {int(campo[4:]): int(valor) for campo, valor in request.form.items() if campo.startswith('qty_')}
+            registrar_recebimento(pedido.id_pedido, recebidos, g.usuario.id_conta)
             db.session.commit()
-            flash(f'Estoque atualizado com sucesso a partir do pedido #{pedido.id_pedido}!', 'success')
+            cache.dados.invalidar(cache.REGIAO_ESTOQUE)
+            flash(f'Estoque atualizado com sucesso a partir do pedido #{id_pedido}!', 'success')
             return redirect(url_for('pedidos'))
         except Exception as e:
             db.session.rollback()
@@ -327,36 +740,44 @@ def receber_pedido(id_pedido):
     return render_template('receber_pedido.html', pedido=pedido)
 
 @app.route('/vendas')
+@exige_cargo()
+@leitura_na_replica
 def vendas():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    lista_vendas = db.session.query(Venda).options(joinedload(Venda.cliente), joinedload(Venda.itens)).order_by(Venda.data_compra.desc()).all()
-    return render_template('vendas.html', vendas=lista_vendas)
+    query = db.session.query(Venda).options(*consultas.LISTA_VENDAS)
+    lista_vendas, paginacao = paginar_keyset(query, Venda.data_compra, Venda.id_venda)
+    return render_template('vendas.html', vendas=lista_vendas, paginacao=paginacao)
 
 @app.route('/venda/<int:id_venda>')
+@exige_cargo()
 def venda_detalhes(id_venda):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    venda = db.session.query(Venda).options(joinedload(Venda.cliente), joinedload(Venda.itens).joinedload(ProdutoVenda.produto)).get(id_venda)
-    if not venda:
+    resposta = recibos.pagina(id_venda, 'venda_detalhes.html')
+    if resposta is None:
         flash('Venda não encontrada.', 'danger')
         return redirect(url_for('vendas'))
-    return render_template('venda_detalhes.html', venda=venda)
+    return resposta
 
 @app.route('/venda/<int:id_venda>/recibo')
+@exige_cargo()
 def recibo_venda(id_venda):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    venda = db.session.query(Venda).options(joinedload(Venda.cliente), joinedload(Venda.itens).joinedload(ProdutoVenda.produto)).get(id_venda)
-    if not venda:
+    resposta = recibos.pagina(id_venda, 'recibo.html')
+    if resposta is None:
         flash('Venda não encontrada.', 'danger')
         return redirect(url_for('vendas'))
-    return render_template('recibo.html', venda=venda)
+    return resposta
+
+@app.route('/venda/<int:id_venda>/recibo/imprimir')
+@exige_cargo()
+def recibo_para_impressao(id_venda):
+    """Recibo avulso, no tamanho de impressora de cupom, enviado do disco (ver recibos.py)."""
+    resposta = recibos.arquivo_para_impressao(id_venda)
+    if resposta is None:
+        flash('Venda não encontrada.', 'danger')
+        return redirect(url_for('vendas'))
+    return resposta
 
 @app.route('/vendas/nova', methods=['GET', 'POST'])
+@exige_cargo()
 def nova_venda():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
     if request.method == 'POST':
         id_cliente_selecionado = request.form.get('id_cliente_selecionado')
         if not id_cliente_selecionado:
@@ -370,124 +791,297 @@ def nova_venda():
             flash('Adicione ao menos um produto com quantidade maior que zero.', 'warning')
             return redirect(url_for('nova_venda'))
 
-        valor_total_venda = 0
-        itens_da_venda = []
-        
+        carrinho = {}
         for pid, qty_str in zip(produtos_ids, quantidades):
-            if not (pid and qty_str and qty_str.isdigit() and int(qty_str) > 0):
+            if not (pid and pid.isdigit() and qty_str and qty_str.isdigit() and int(qty_str) > 0):
                 continue
-            
-            qty = int(qty_str)
-            produto = Produto.query.get(int(pid))
-            
-            if produto.estoque.quantidade_produto < qty:
-                flash(f'Estoque insuficiente para "{produto.nome}". Disponível: {produto.estoque.quantidade_produto}', 'danger')
-                return redirect(url_for('nova_venda'))
-
-            preco_a_cobrar = produto.preco_promocional if produto.preco_promocional else produto.preco
-            valor_total_venda += float(preco_a_cobrar) * qty
-            itens_da_venda.append({'produto': produto, 'quantidade': qty, 'preco_unitario': preco_a_cobrar})
+            carrinho[int(pid)] = carrinho.get(int(pid), 0) + int(qty_str)
 
         try:
-            pagamento_padrao = Pagamento.query.first()
-            
-            nova_venda_obj = Venda(
-                id_cliente=id_cliente_selecionado, 
-                id_pagamento=pagamento_padrao.id_pagamento, 
-                valor_total=valor_total_venda,
-                data_compra=datetime.utcnow()
-            )
-            db.session.add(nova_venda_obj)
-            db.session.flush()
-
-            for item in itens_da_venda:
-                produto = item['produto']
-                quantidade_vendida = item['quantidade']
-                
-                produto_venda_link = ProdutoVenda(
-                    id_venda=nova_venda_obj.id_venda, 
-                    id_produto=produto.id_produto, 
-                    quantidade=quantidade_vendida,
-                    preco_unitario=item['preco_unitario']
-                )
-                db.session.add(produto_venda_link)
-                
-                produto.estoque.quantidade_produto -= quantidade_vendida
-                
-                mov = MovimentacaoEstoque(
-                    id_produto=produto.id_produto, 
-                    id_usuario=session.get('user_id'), 
-                    tipo='SAÍDA', 
-                    quantidade=quantidade_vendida,
-                    observacao=f'Venda #{nova_venda_obj.id_venda}'
-                )
-                db.session.add(mov)
-
+            id_venda = registrar_venda(id_cliente_selecionado, carrinho, g.usuario.id_conta).id_venda
             db.session.commit()
+            cache.dados.invalidar(cache.REGIAO_ESTOQUE, cache.REGIAO_VENDAS)
             flash('Venda registrada com sucesso!', 'success')
-            return redirect(url_for('recibo_venda', id_venda=nova_venda_obj.id_venda))
-        
+            return redirect(url_for('recibo_venda', id_venda=id_venda))
+        except EstoqueInsuficiente as e:
+            db.session.rollback()
+            flash(str(e), 'danger')
+            return redirect(url_for('nova_venda'))
         except Exception as e:
             db.session.rollback()
             flash(f'Ocorreu um erro ao registrar a venda: {e}', 'danger')
             return redirect(url_for('nova_venda'))
 
-    produtos = Produto.query.join(Estoque).filter(Estoque.quantidade_produto > 0).order_by(Produto.nome).all()
-    return render_template('nova_venda.html', produtos=produtos)
+    # Os produtos são escolhidos por busca (/api/produtos/busca), sem listar o catálogo na página.
+    return render_template('nova_venda.html')
 
 @app.route('/historico')
+@exige_cargo()
+@leitura_na_replica
 def historico():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    movimentacoes = MovimentacaoEstoque.query.order_by(MovimentacaoEstoque.data_movimentacao.desc()).all()
-    return render_template('historico.html', movimentacoes=movimentacoes)
+    query = MovimentacaoEstoque.query.options(*consultas.LISTA_MOVIMENTACOES)
+    movimentacoes, paginacao = paginar_keyset(query, MovimentacaoEstoque.data_movimentacao, MovimentacaoEstoque.id_mov)
+    return render_template('historico.html', movimentacoes=movimentacoes, paginacao=paginacao)
 
 # --- APIs ---
 @app.route('/api/produto/update', methods=['POST'])
+@exige_cargo(api=True)
 def api_produto_update():
-    if 'user_id' not in session:
-        return jsonify({"error": "Acesso negado"}), 403
     data = request.json
     pid = data.get('id')
     nova_quantidade = data.get('quantidade')
     if pid is None or nova_quantidade is None:
         return jsonify({"error": "Dados inválidos"}), 400
-    produto = Produto.query.get(pid)
-    if not produto or not produto.estoque:
-        return jsonify({"error": "Produto não encontrado"}), 404
+    versao = data.get('versao')
     try:
-        quantidade_antiga = produto.estoque.quantidade_produto
-        produto.estoque.quantidade_produto = int(nova_quantidade)
-        diferenca = int(nova_quantidade) - quantidade_antiga
-        mov = MovimentacaoEstoque(id_produto=pid, id_usuario=session.get('user_id'), tipo='AJUSTE MANUAL', quantidade=diferenca, observacao=f'Alterado por {session.get("login", "usuário")}')
-        db.session.add(mov)
+        resultados, variacao = movimentacoes.ajustar_quantidades(
+            {int(pid): (int(nova_quantidade), None if versao is None else int(versao))},
+            g.usuario.id_conta, f'Alterado por {g.usuario.login}'
+        )
+        resultado = resultados[int(pid)]
+        if resultado['status'] == 'nao_encontrado':
+            db.session.rollback()
+            return jsonify({"error": "Produto não encontrado"}), 404
+        if resultado['status'] == 'conflito':
+            db.session.rollback()
+            return jsonify({"error": "O estoque foi alterado por outra pessoa.", **resultado}), 409
+        incrementar_indicadores(total_produtos_estoque=variacao)
         db.session.commit()
-        return jsonify({"success": True, "message": "Estoque atualizado."})
+        cache.dados.invalidar(cache.REGIAO_ESTOQUE)
+        return jsonify({"success": True, "message": "Estoque atualizado.", "versao": resultado['versao']})
+    except movimentacoes.ConflitoDeVersao as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+AJUSTES_MAXIMO = 5000
+
+@app.route('/api/estoque/ajustes', methods=['POST'])
+@exige_cargo(api=True)
+def api_ajustar_estoque():
+    """
+    Contagem de estoque em lote: {"itens": [{"id": id_produto, "quantidade": n,
+    "versao": versão lida junto com a quantidade}, ...]}. Grava numa só
+    transação os itens cuja versão não mudou e devolve, para cada item, o
+    status ('ok', 'conflito' ou 'nao_encontrado'), a quantidade e a versão
+    atuais. Um item em conflito não impede a gravação dos demais.
+    """
+    dados = request.get_json(silent=True)
+    lista = dados.get('itens') if isinstance(dados, dict) else None
+    if not isinstance(lista, list) or not lista:
+        return jsonify({"error": "Informe a lista 'itens'."}), 400
+    if len(lista) > AJUSTES_MAXIMO:
+        return jsonify({"error": f"No máximo {AJUSTES_MAXIMO} itens por lote."}), 400
+    itens = {}
+    for posicao, item in enumerate(lista):
+        try:
+            id_produto, quantidade, versao = int(item['id']), int(item['quantidade']), int(item['versao'])
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": f"Item {posicao}: informe id, quantidade e versao como números inteiros."}), 400
+        if quantidade < 0 or id_produto in itens:
+            return jsonify({"error": f"Item {posicao}: quantidade negativa ou produto repetido no lote."}), 400
+        itens[id_produto] = (quantidade, versao)
+
+    try:
+        resultados, variacao = movimentacoes.ajustar_quantidades(
+            itens, g.usuario.id_conta, f'Contagem de estoque por {g.usuario.login}'
+        )
+        incrementar_indicadores(total_produtos_estoque=variacao)
+        db.session.commit()
+    except movimentacoes.ConflitoDeVersao as e:
+        db.session.rollback()
+        return jsonify({"error": f"{e} Envie o lote de novo."}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+    cache.dados.invalidar(cache.REGIAO_ESTOQUE)
+
+    conflitos = sum(1 for resultado in resultados.values() if resultado['status'] != 'ok')
+    return jsonify({
+        "success": not conflitos,
+        "aplicados": len(resultados) - conflitos,
+        "conflitos": conflitos,
+        "itens": [{"id": id_produto, **resultados[id_produto]} for id_produto in itens],
+    })
+
+@app.route('/api/estoque/abaixo_minimo')
+@exige_cargo(api=True)
+def api_estoque_abaixo_minimo():
+    """Lista de estoque baixo (a mesma do alerta da página de estoque), para consulta rápida."""
+    itens = produtos_abaixo_do_minimo()
+    return jsonify({
+        'total': len(itens),
+        'produtos': [{'id_produto': i.id_produto, 'nome': i.nome,
+                      'quantidade': i.quantidade_produto, 'minimo': i.min_produto} for i in itens],
+    })
+
+@app.route('/api/produtos/busca')
+@exige_cargo(api=True)
+def api_buscar_produtos():
+    """Autocompletar de produtos: ?q=termo&limite=10&em_estoque=1."""
+    limite = max(1, min(request.args.get('limite', busca.LIMITE_PADRAO, type=int), busca.LIMITE_MAXIMO))
+    produtos = busca.pesquisar_produtos(request.args.get('q', ''), limite,
+                                        em_estoque=request.args.get('em_estoque') == '1')
+    return jsonify([{
+        'id_produto': p.id_produto,
+        'nome': p.nome,
+        'preco': float(p.preco_promocional or p.preco or 0),
+        'estoque': p.estoque.quantidade_produto,
+    } for p in produtos])
+
+GRAFICO_ESTOQUE_TOP = 10
+GRAFICO_ESTOQUE_TOP_MAXIMO = 50
+MAX_AGE_ANO_FECHADO = 24 * 3600
+
 @app.route('/api/relatorios/vendas/por_mes')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
 def vendas_por_mes():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        return jsonify({"error": "Acesso negado"}), 403
     ano = request.args.get('ano', datetime.utcnow().year, type=int)
+    # Um ano fechado não recebe mais vendas: o navegador guarda a resposta sem revalidar.
+    fechado = ano < datetime.utcnow().year
+    return respostas.json_em_cache(cache.REGIAO_VENDAS, ('por_mes', ano), lambda: _vendas_por_mes(ano),
+                                   max_age=MAX_AGE_ANO_FECHADO if fechado else 0)
+
+def _vendas_por_mes(ano):
     totais = [0.0] * 12
-    vendas_no_ano = db.session.query(Venda).filter(db.extract('year', Venda.data_compra) == ano).all()
-    for v in vendas_no_ano:
-        if v.data_compra:
-            mes = v.data_compra.month - 1
-            totais[mes] += float(v.valor_total or 0.0)
-    return jsonify({"ano": ano, "mensal": totais})
+    if app.config['VENDAS_MENSAIS_ATIVO']:
+        linhas = db.session.query(VendaMensal.mes, VendaMensal.valor_total).filter(VendaMensal.ano == ano)
+    else:
+        # Intervalo [1º de janeiro, 1º de janeiro do ano seguinte) em vez de
+        # extract('year', ...), para que o banco use o índice de data_compra.
+        mes = db.extract('month', Venda.data_compra)
+        linhas = db.session.query(mes, func.sum(Venda.valor_total)).filter(
+            Venda.data_compra >= datetime(ano, 1, 1),
+            Venda.data_compra < datetime(ano + 1, 1, 1)
+        ).group_by(mes)
+    for mes, total in linhas:
+        totais[int(mes) - 1] = float(total or 0.0)
+    return {"ano": ano, "mensal": totais}
 
 @app.route('/api/relatorios/estoque_atual')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
 def estoque_atual():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
+    """Os 'top' produtos com mais estoque (padrão GRAFICO_ESTOQUE_TOP) e a soma dos demais em 'Outros'."""
+    top = max(1, min(request.args.get('top', GRAFICO_ESTOQUE_TOP, type=int), GRAFICO_ESTOQUE_TOP_MAXIMO))
+    return respostas.json_em_cache(cache.REGIAO_ESTOQUE, ('grafico', top), lambda: _estoque_atual(top))
+
+def _estoque_atual(top):
+    # O agrupamento é feito no banco: só top + 1 linhas saem dele, qualquer que seja o catálogo.
+    quantidade = func.coalesce(Estoque.quantidade_produto, 0)
+    ranking = db.select(
+        Produto.nome, quantidade.label('quantidade'),
+        func.row_number().over(order_by=(quantidade.desc(), Produto.id_produto)).label('posicao'),
+    ).join(Produto.estoque).subquery()
+    no_top = ranking.c.posicao <= top
+    grupo = db.case((no_top, ranking.c.posicao), else_=top + 1)
+    linhas = db.session.execute(
+        db.select(func.min(db.case((no_top, ranking.c.nome), else_='Outros')), func.sum(ranking.c.quantidade))
+        .group_by(grupo).order_by(func.min(ranking.c.posicao))
+    ).all()
+    return {'labels': [rotulo for rotulo, _ in linhas], 'data': [int(total) for _, total in linhas]}
+
+@app.route('/api/relatorios/estoque_em')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
+def estoque_em():
+    """Quantidade de cada produto no início do dia 'data' (AAAA-MM-DD), calculada pelo razão."""
+    data = _ler_data_filtro(request.args.get('data'))
+    if data is None:
+        return jsonify({"error": "Informe a data no formato AAAA-MM-DD."}), 400
+    linhas = db.session.execute(movimentacoes.consulta_saldos(data).add_columns(Produto.nome).order_by(Produto.nome))
+    return jsonify({'data': data.date().isoformat(), 'produtos': [
+        {'id_produto': id_produto, 'nome': nome, 'quantidade': int(quantidade)} for id_produto, quantidade, nome in linhas
+    ]})
+
+def _periodo_analise():
+    """
+    (de, ate) das análises, pela query string 'de'/'ate' (AAAA-MM-DD,
+    inclusivo); o padrão são os últimos analises.DIAS_PADRAO dias até hoje.
+    Levanta ValueError com a mensagem para o usuário.
+    """
+    ate = _ler_data_filtro(request.args.get('ate')) or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    de = _ler_data_filtro(request.args.get('de')) or ate - timedelta(days=analises.DIAS_PADRAO - 1)
+    if de > ate:
+        raise ValueError("A data inicial é posterior à final.")
+    if (ate - de).days >= analises.DIAS_MAXIMO:
+        raise ValueError(f"O período das análises é de no máximo {analises.DIAS_MAXIMO} dias.")
+    return de, ate
+
+@app.route('/api/analises/abc')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
+def analise_abc():
+    """Curva ABC dos produtos pela receita no período (ver analises.curva_abc)."""
+    try:
+        de, ate = _periodo_analise()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return respostas.json_em_cache(cache.REGIAO_VENDAS, ('analise_abc', de, ate), lambda: analises.curva_abc(de, ate))
+
+@app.route('/api/analises/giro')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
+def analise_giro():
+    """Giro do estoque no período e dias de cobertura pela média de vendas dos últimos 'janela' dias."""
+    try:
+        de, ate = _periodo_analise()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    janela = max(1, min(request.args.get('janela', analises.JANELA_COBERTURA_PADRAO, type=int), analises.DIAS_MAXIMO))
+    return respostas.json_em_cache(cache.REGIAO_ESTOQUE, ('analise_giro', de, ate, janela),
+                                   lambda: analises.giro_e_cobertura(de, ate, janela))
+
+@app.route('/api/analises/mais_vendidos')
+@exige_cargo('GERENTE', api=True)
+@leitura_na_replica
+def analise_mais_vendidos():
+    """Produtos mais vendidos no período, ou em cada dia/semana/mês dele ('por')."""
+    try:
+        de, ate = _periodo_analise()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    por = request.args.get('por') or None
+    ordem = request.args.get('ordem', 'quantidade')
+    if por is not None and por not in analises.PERIODOS:
+        return jsonify({"error": f"'por' deve ser um de: {', '.join(analises.PERIODOS)}."}), 400
+    if ordem not in analises.ORDENS:
+        return jsonify({"error": f"'ordem' deve ser um de: {', '.join(analises.ORDENS)}."}), 400
+    limite = max(1, min(request.args.get('limite', analises.MAIS_VENDIDOS_PADRAO, type=int), analises.MAIS_VENDIDOS_MAXIMO))
+    return respostas.json_em_cache(cache.REGIAO_VENDAS, ('analise_mais_vendidos', de, ate, limite, por, ordem),
+                                   lambda: analises.mais_vendidos(de, ate, limite, por, ordem))
+
+@app.route('/eventos')
+@exige_cargo()
+def eventos_ao_vivo():
+    """Server-Sent Events com as vendas e as mudanças de estoque, para o dashboard e a página de estoque."""
+    resposta = eventos.resposta_sse(request.headers.get('Last-Event-ID'))
+    if resposta is None:
+        return jsonify({"error": "Muitas conexões ao vivo neste servidor."}), 503, {'Retry-After': '60'}
+    return resposta
+
+@app.route('/metrics')
+def metrics():
+    """Métricas por rota no formato de texto do Prometheus (ver metricas.py)."""
+    token = app.config['METRICAS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
         return jsonify({"error": "Acesso negado"}), 403
-    produtos = Produto.query.join(Estoque).order_by(Estoque.quantidade_produto.desc()).all()
-    labels = [p.nome for p in produtos]
-    data = [p.estoque.quantidade_produto for p in produtos]
-    return jsonify({'labels': labels, 'data': data})
+    return app.response_class(metricas.exposicao(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/saude')
+def saude():
+    """Saúde/prontidão para o balanceador: banco acessível e pool não saturado (ver servidor.py)."""
+    corpo, status = servidor.saude()
+    return jsonify(corpo), status
+
+@app.route('/api/cache/estatisticas')
+@exige_cargo('GERENTE', api=True)
+def estatisticas_cache():
+    """Acertos e faltas do cache por região, neste processo."""
+    return jsonify(cache.dados.estatisticas())
 
 @app.route('/api/cliente/cpf/<string:cpf>')
 def api_buscar_cliente_por_cpf(cpf):
@@ -501,6 +1095,13 @@ def api_buscar_cliente_por_cpf(cpf):
     else:
         return jsonify({'error': 'Cliente não encontrado'}), 404
 
+@app.route('/api/clientes/pesquisar')
+@exige_cargo(api=True)
+def api_pesquisar_clientes():
+    """Busca clientes por início do CPF ou do nome: ?q=termo&limite=10."""
+    limite = max(1, min(request.args.get('limite', busca.LIMITE_CLIENTES, type=int), busca.LIMITE_CLIENTES_MAXIMO))
+    return jsonify(busca.pesquisar_clientes(request.args.get('q', ''), limite))
+
 @app.route('/api/cliente/novo', methods=['POST'])
 def api_cadastrar_cliente():
     """Cadastra um novo cliente e retorna em JSON."""
@@ -521,107 +1122,202 @@ def api_cadastrar_cliente():
         novo_endereco = Endereco(cep=cep or 'N/A', numero=numero or 'S/N')
         db.session.add(novo_endereco)
         db.session.flush()
-        novo_cliente = Cliente(nome=nome, cpf=cpf_limpo, telefone=telefone, id_endereco=novo_endereco.id_endereco)
+        novo_cliente = Cliente(nome=nome, nome_busca=busca.normalizar(nome), cpf=cpf_limpo, telefone=telefone, id_endereco=novo_endereco.id_endereco)
         db.session.add(novo_cliente)
         db.session.commit()
+        # O novo cliente precisa aparecer na próxima busca do caixa.
+        cache.dados.invalidar(cache.REGIAO_CLIENTES)
         return jsonify({'id_cliente': novo_cliente.id_cliente, 'nome': novo_cliente.nome, 'cpf': novo_cliente.cpf}), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': f'Erro ao salvar no banco: {str(e)}'}), 500
 
 # --- ROTAS DE EXPORTAÇÃO DE RELATÓRIOS ---
+# Os relatórios são gerados em fluxo pelo módulo 'exportacao': cada rota só
+# define a consulta (apenas as colunas necessárias) e o layout das colunas.
+# O formato é escolhido por '?formato=xlsx|csv|ndjson' e os relatórios de
+# vendas e histórico aceitam o mesmo filtro de período 'de'/'ate' das listagens.
+
+RELATORIO_PRODUTOS = {
+    'nome_arquivo': 'relatorio_produtos', 'aba': 'Produtos',
+    'colunas': [
+        {'titulo': 'ID', 'chave': 'id_produto', 'largura': 8},
+        {'titulo': 'Nome', 'chave': 'nome', 'largura': 40},
+        {'titulo': 'Descrição', 'chave': 'descricao', 'largura': 50},
+        {'titulo': 'Preço (R$)', 'chave': 'preco', 'largura': 14, 'dinheiro': True},
+        {'titulo': 'Quantidade em Estoque', 'chave': 'quantidade_produto', 'largura': 22},
+        {'titulo': 'Estoque Mínimo', 'chave': 'min_produto', 'largura': 16},
+        {'titulo': 'Fornecedor', 'chave': 'fornecedor', 'largura': 30, 'padrao': 'N/A'},
+    ],
+}
+
+RELATORIO_HISTORICO = {
+    'nome_arquivo': 'relatorio_historico', 'aba': 'Historico_Movimentacoes',
+    'colunas': [
+        {'titulo': 'Data', 'chave': 'data_movimentacao', 'largura': 20, 'strftime': '%d/%m/%Y %H:%M:%S'},
+        {'titulo': 'Produto', 'chave': 'produto', 'largura': 40},
+        {'titulo': 'Tipo', 'chave': 'tipo', 'largura': 16},
+        {'titulo': 'Quantidade', 'chave': 'quantidade', 'largura': 12},
+        {'titulo': 'Usuário', 'chave': 'usuario', 'largura': 20, 'padrao': 'Sistema'},
+        {'titulo': 'Observação', 'chave': 'observacao', 'largura': 40},
+    ],
+}
+
+RELATORIO_VENDAS = {
+    'nome_arquivo': 'relatorio_vendas', 'aba': 'Historico_Vendas',
+    'colunas': [
+        {'titulo': 'ID da Venda', 'chave': 'id_venda', 'largura': 12},
+        {'titulo': 'Cliente', 'chave': 'cliente', 'largura': 30, 'padrao': 'N/A'},
+        {'titulo': 'Data', 'chave': 'data_compra', 'largura': 12, 'strftime': '%d/%m/%Y'},
+        {'titulo': 'Nº de Itens', 'chave': 'n_itens', 'largura': 12},
+        {'titulo': 'Valor Total (R$)', 'chave': 'valor_total', 'largura': 20, 'dinheiro': True},
+    ],
+}
+
+def _formato_exportacao():
+    formato = request.args.get('formato', 'xlsx')
+    return formato if formato in exportacao.FORMATOS else 'xlsx'
+
+def consulta_relatorio_produtos(de=None, ate=None):
+    stmt = db.select(
+        Produto.id_produto, Produto.nome, Produto.descricao, Produto.preco,
+        Estoque.quantidade_produto, Estoque.min_produto, Fornecedor.nome.label('fornecedor')
+    ).join(Estoque, Produto.estoque_id == Estoque.id_estoque).outerjoin(
+        Fornecedor, Produto.fornecedor_id == Fornecedor.id_fornecedor
+    )
+    return stmt, [Produto.id_produto]
+
+def consulta_relatorio_historico(de=None, ate=None):
+    stmt = db.select(
+        MovimentacaoEstoque.id_mov, MovimentacaoEstoque.data_movimentacao, Produto.nome.label('produto'),
+        MovimentacaoEstoque.tipo, MovimentacaoEstoque.quantidade, Usuario.login.label('usuario'),
+        MovimentacaoEstoque.observacao
+    ).join(Produto, MovimentacaoEstoque.id_produto == Produto.id_produto).outerjoin(
+        Usuario, MovimentacaoEstoque.id_usuario == Usuario.id_conta
+    )
+    stmt = _aplicar_periodo(stmt, MovimentacaoEstoque.data_movimentacao, de, ate)
+    return stmt, [MovimentacaoEstoque.data_movimentacao, MovimentacaoEstoque.id_mov]
+
+def consulta_relatorio_vendas(de=None, ate=None):
+    n_itens = db.select(func.count()).where(ProdutoVenda.id_venda == Venda.id_venda).scalar_subquery()
+    stmt = db.select(
+        Venda.id_venda, Cliente.nome.label('cliente'), Venda.data_compra,
+        n_itens.label('n_itens'), Venda.valor_total
+    ).outerjoin(Cliente, Venda.id_cliente == Cliente.id_cliente)
+    stmt = _aplicar_periodo(stmt, Venda.data_compra, de, ate)
+    return stmt, [Venda.data_compra, Venda.id_venda]
+
+# Relatórios exportáveis: nome -> (layout, consulta(de, ate), página de origem).
+RELATORIOS = {
+    'produtos': (RELATORIO_PRODUTOS, consulta_relatorio_produtos, 'estoque'),
+    'historico': (RELATORIO_HISTORICO, consulta_relatorio_historico, 'historico'),
+    'vendas': (RELATORIO_VENDAS, consulta_relatorio_vendas, 'vendas'),
+}
+
+def _periodo_exportacao():
+    return _ler_data_filtro(request.values.get('de')), _ler_data_filtro(request.values.get('ate'))
+
 @app.route('/export/produtos')
+@exige_cargo('GERENTE', voltar_para='estoque')
+@leitura_na_replica
 def exportar_produtos():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        flash('Acesso negado.', 'danger')
-        return redirect(url_for('estoque'))
     try:
-        produtos = Produto.query.join(Estoque).all()
-        dados_para_exportar = []
-        for p in produtos:
-            dados_para_exportar.append({
-                'ID': p.id_produto, 'Nome': p.nome, 'Descrição': p.descricao,
-                'Preço (R$)': float(p.preco), 'Quantidade em Estoque': p.estoque.quantidade_produto,
-                'Estoque Mínimo': p.estoque.min_produto, 'Fornecedor': p.fornecedor.nome if p.fornecedor else 'N/A'
-            })
-        df = pd.DataFrame(dados_para_exportar)
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine='xlsxwriter')
-        df.to_excel(writer, index=False, sheet_name='Produtos')
-        writer.close()
-        output.seek(0)
-        return send_file(output, download_name='relatorio_produtos.xlsx', as_attachment=True)
+        stmt, chaves = consulta_relatorio_produtos()
+        return exportacao.exportar(RELATORIO_PRODUTOS, stmt, chaves, _formato_exportacao())
     except Exception as e:
         flash(f"Erro ao gerar relatório: {e}", "danger")
         return redirect(url_for('estoque'))
 
 @app.route('/export/historico')
+@exige_cargo('GERENTE', voltar_para='historico')
+@leitura_na_replica
 def exportar_historico():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        flash('Acesso negado.', 'danger')
-        return redirect(url_for('historico'))
     try:
-        movimentacoes = MovimentacaoEstoque.query.order_by(MovimentacaoEstoque.data_movimentacao.desc()).all()
-        dados_para_exportar = []
-        for mov in movimentacoes:
-            dados_para_exportar.append({
-                'Data': mov.data_movimentacao.strftime('%d/%m/%Y %H:%M:%S'), 'Produto': mov.produto.nome,
-                'Tipo': mov.tipo, 'Quantidade': mov.quantidade, 'Usuário': mov.usuario.login if mov.usuario else 'Sistema',
-                'Observação': mov.observacao
-            })
-        df = pd.DataFrame(dados_para_exportar)
-        output = BytesIO()
-        writer = pd.ExcelWriter(output, engine='xlsxwriter')
-        df.to_excel(writer, index=False, sheet_name='Historico_Movimentacoes')
-        writer.close()
-        output.seek(0)
-        return send_file(output, download_name='relatorio_historico.xlsx', as_attachment=True)
+        stmt, chaves = consulta_relatorio_historico(*_periodo_exportacao())
+        return exportacao.exportar(RELATORIO_HISTORICO, stmt, chaves, _formato_exportacao())
     except Exception as e:
         flash(f"Erro ao gerar relatório: {e}", "danger")
         return redirect(url_for('historico'))
 
 @app.route('/export/vendas')
+@exige_cargo('GERENTE', voltar_para='vendas')
+@leitura_na_replica
 def exportar_vendas():
-    if 'user_id' not in session or session.get('cargo') != 'GERENTE':
-        flash('Acesso negado.', 'danger')
-        return redirect(url_for('vendas'))
     try:
-        lista_vendas = db.session.query(Venda).options(
-            joinedload(Venda.cliente), 
-            joinedload(Venda.itens)
-        ).order_by(Venda.data_compra.desc()).all()
-        dados_para_exportar = []
-        for venda in lista_vendas:
-            dados_para_exportar.append({
-                'ID da Venda': venda.id_venda,
-                'Cliente': venda.cliente.nome if venda.cliente else 'N/A',
-                'Data': venda.data_compra.strftime('%d/%m/%Y'),
-                'Nº de Itens': len(venda.itens),
-                'Valor Total (R$)': float(venda.valor_total)
-            })
-        df = pd.DataFrame(dados_para_exportar)
-        output = BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, index=False, sheet_name='Historico_Vendas')
-            workbook  = writer.book
-            worksheet = writer.sheets['Historico_Vendas']
-            money_format = workbook.add_format({'num_format': 'R$ #,##0.00'})
-            worksheet.set_column('A:A', 12)
-            worksheet.set_column('B:B', 30)
-            worksheet.set_column('C:C', 12)
-            worksheet.set_column('D:D', 12)
-            worksheet.set_column('E:E', 20, money_format)
-        output.seek(0)
-        return send_file(
-            output, 
-            download_name='relatorio_vendas.xlsx', 
-            as_attachment=True,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        stmt, chaves = consulta_relatorio_vendas(*_periodo_exportacao())
+        return exportacao.exportar(RELATORIO_VENDAS, stmt, chaves, _formato_exportacao())
     except Exception as e:
         flash(f"Erro ao gerar relatório de vendas: {e}", "danger")
         return redirect(url_for('vendas'))
 
+# --- Exportações em segundo plano (tarefas.py) ---
+# O relatório é gerado fora da requisição, na área de downloads; a página de
+# status acompanha o andamento e libera o download quando ele termina.
+
+@app.route('/exportacoes/<relatorio>', methods=['POST'])
+@exige_cargo('GERENTE', api=True)
+def agendar_exportacao(relatorio):
+    if relatorio not in RELATORIOS:
+        return jsonify({"error": "Relatório desconhecido"}), 404
+    layout, consulta, pagina = RELATORIOS[relatorio]
+    formato = request.values.get('formato', 'xlsx')
+    formato = formato if formato in exportacao.FORMATOS else 'xlsx'
+    de, ate = _periodo_exportacao()
+    try:
+        status = tarefas.agendar_exportacao(relatorio, layout, consulta, formato, de, ate, g.usuario.id_conta)
+    except tarefas.TarefasDesativadas as e:
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({"error": str(e)}), 503
+        flash(str(e), 'warning')
+        return redirect(url_for(pagina))
+    if request.accept_mimetypes.best == 'application/json':
+        resposta = jsonify(_status_exportacao_json(status))
+        resposta.headers['Location'] = url_for('api_status_exportacao', id_exportacao=status['id'])
+        return resposta, 202
+    return redirect(url_for('status_exportacao', id_exportacao=status['id']))
+
+def _status_exportacao_json(status):
+    dados = {chave: status.get(chave) for chave in
+             ('id', 'relatorio', 'formato', 'de', 'ate', 'status', 'linhas', 'tamanho', 'erro', 'criado_em', 'concluido_em')}
+    dados['url_status'] = url_for('api_status_exportacao', id_exportacao=status['id'])
+    if status['status'] == tarefas.STATUS_CONCLUIDA:
+        dados['url_download'] = url_for('baixar_exportacao', id_exportacao=status['id'])
+    return dados
+
+def _exportacao_do_usuario(id_exportacao):
+    """Status da exportação, ou None se ela não existe ou foi pedida por outro usuário."""
+    status = tarefas.ler_status(id_exportacao)
+    if not status or status.get('id_usuario') != g.usuario.id_conta:
+        return None
+    return status
+
+@app.route('/exportacoes/<id_exportacao>')
+@exige_cargo('GERENTE')
+def status_exportacao(id_exportacao):
+    status = _exportacao_do_usuario(id_exportacao)
+    if not status:
+        flash('Exportação não encontrada (os arquivos são apagados após algumas horas).', 'warning')
+        return redirect(url_for('dashboard'))
+    return render_template('exportacao.html', exportacao=_status_exportacao_json(status))
+
+@app.route('/api/exportacoes/<id_exportacao>')
+@exige_cargo('GERENTE', api=True)
+def api_status_exportacao(id_exportacao):
+    status = _exportacao_do_usuario(id_exportacao)
+    if not status:
+        return jsonify({"error": "Exportação não encontrada"}), 404
+    return jsonify(_status_exportacao_json(status))
+
+@app.route('/exportacoes/<id_exportacao>/arquivo')
+@exige_cargo('GERENTE')
+def baixar_exportacao(id_exportacao):
+    status = _exportacao_do_usuario(id_exportacao)
+    if not status or status['status'] != tarefas.STATUS_CONCLUIDA:
+        flash('Exportação não encontrada ou ainda não concluída.', 'warning')
+        return redirect(url_for('dashboard'))
+    return send_file(tarefas.caminho_arquivo(status), as_attachment=True,
+                     download_name=status['nome_arquivo'], mimetype=exportacao.MIMETYPES[status['formato']])
+
 
 # =======================================================================
 # COMANDO DE SETUP SIMPLIFICADO
@@ -641,6 +1337,275 @@ def setup_command():
     print("O banco de dados principal deve ser populado via script SQL.")
     print("Este comando apenas garante as senhas corretas para login.")
 
+@app.cli.command("reconstruir-vendas-mensais")
+def reconstruir_vendas_mensais_command():
+    """
+    Recalcula a tabela VENDAS_MENSAIS a partir de VENDA, com um único
+    INSERT ... SELECT ... GROUP BY. Use após importar vendas por script SQL
+    ou antes de ativar VENDAS_MENSAIS_ATIVO.
+    """
+    db.create_all()
+    ano = db.extract('year', Venda.data_compra)
+    mes = db.extract('month', Venda.data_compra)
+    agregado = db.select(ano, mes, func.sum(Venda.valor_total), func.count(Venda.id_venda)).group_by(ano, mes)
+    try:
+        db.session.execute(VendaMensal.__table__.delete())
+        db.session.execute(VendaMensal.__table__.insert().from_select(
+            ['ano', 'mes', 'valor_total', 'quantidade_vendas'], agregado
+        ))
+        db.session.commit()
+        cache.dados.invalidar(cache.REGIAO_VENDAS)
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Erro ao reconstruir VENDAS_MENSAIS: {e}")
+    print(f"VENDAS_MENSAIS reconstruída: {VendaMensal.query.count()} mês(es).")
+
+@app.cli.command("reconciliar-indicadores")
+def reconciliar_indicadores_command():
+    """
+    Recalcula, a partir das tabelas de origem, os dados desnormalizados do
+    dashboard: PRODUTO.ultima_venda e os contadores da tabela INDICADOR.
+    Informa quantos valores estavam divergentes antes da correção.
+    """
+    db.create_all()
+    ultima_venda_real = db.select(func.max(Venda.data_compra)).join(
+        ProdutoVenda, ProdutoVenda.id_venda == Venda.id_venda
+    ).where(ProdutoVenda.id_produto == Produto.id_produto).scalar_subquery()
+    sentinela = datetime(1900, 1, 1)
+    try:
+        divergentes = db.session.query(func.count(Produto.id_produto)).filter(
+            func.coalesce(Produto.ultima_venda, sentinela) != func.coalesce(ultima_venda_real, sentinela)
+        ).scalar()
+        db.session.execute(Produto.__table__.update().values(ultima_venda=ultima_venda_real))
+        print(f"PRODUTO.ultima_venda: {divergentes} produto(s) corrigido(s).")
+
+        reais = {
+            'total_vendas': db.session.query(func.sum(Venda.valor_total)).scalar() or 0,
+            'total_produtos_estoque': db.session.query(func.sum(Estoque.quantidade_produto)).scalar() or 0,
+        }
+        for chave, valor in reais.items():
+            indicador = db.session.get(Indicador, chave)
+            if indicador is None:
+                indicador = Indicador(chave=chave, valor=0)
+                db.session.add(indicador)
+            if indicador.valor != valor:
+                print(f"INDICADOR '{chave}': {indicador.valor} -> {valor}")
+            indicador.valor = valor
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Erro ao reconciliar indicadores: {e}")
+    print("Indicadores reconciliados.")
+
+@app.cli.command("verificar-consultas")
+def verificar_consultas_command():
+    """
+    Acessa as páginas principais como gerente e falha se alguma executar mais
+    instruções SQL do que o orçamento definido em consultas.ORCAMENTO_CONSULTAS.
+    """
+    gerente = Usuario.query.filter_by(cargo='GERENTE').first()
+    if not gerente:
+        raise click.ClickException("Nenhum usuário GERENTE encontrado. Rode 'flask setup' antes.")
+
+    orcamento = dict(consultas.ORCAMENTO_CONSULTAS)
+    venda = Venda.query.order_by(Venda.id_venda.desc()).first()
+    pedido = PedidoFornecedor.query.filter_by(status='Pendente').first()
+    for url, limite in consultas.ORCAMENTO_DETALHES.items():
+        if '{id_venda}' in url and venda:
+            orcamento[url.format(id_venda=venda.id_venda)] = limite
+        elif '{id_pedido}' in url and pedido:
+            orcamento[url.format(id_pedido=pedido.id_pedido)] = limite
+    db.session.remove()
+    # Mede o caminho sem cache: um cache local novo, vazio (e não o
+    # compartilhado, que poderia já ter as respostas).
+    cache.dados.usar_backend(cache.CacheLRU(tamanho_maximo=app.config['CACHE_TAMANHO'], ttl=app.config['CACHE_TTL']))
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sess:
+        sess['user_id'] = gerente.id_conta
+        sess['cargo'] = gerente.cargo
+        sess['login'] = gerente.login
+    # Como no uso normal, o usuário já está no cache de identidades desde o login.
+    autenticacao.lembrar_usuario(gerente)
+
+    falhas = 0
+    for url, limite in orcamento.items():
+        try:
+            total = consultas.verificar_orcamento(cliente, url, limite)
+            print(f"OK     {url}: {total}/{limite}")
+        except consultas.OrcamentoExcedido as e:
+            falhas += 1
+            print(f"FALHOU {e}")
+    if falhas:
+        raise click.ClickException(f"{falhas} rota(s) acima do orçamento de consultas.")
+    print("Todas as rotas dentro do orçamento de consultas.")
+
+
+@app.cli.command("reindexar-busca")
+def reindexar_busca_command():
+    """
+    Recalcula o nome normalizado (nome_busca) de produtos e clientes, usado
+    nas buscas, e reconstrói o índice de texto dos produtos. Rode após
+    carregar produtos ou clientes por script SQL.
+    """
+    db.create_all()
+    try:
+        produtos, clientes = busca.reindexar()
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Erro ao reindexar a busca: {e}")
+    print(f"Busca reindexada: {produtos} produto(s) e {clientes} cliente(s).")
+
+@app.cli.command("varrer-estoque-baixo")
+def varrer_estoque_baixo_command():
+    """
+    Executa agora a varredura de estoque baixo (a mesma que o agendador roda
+    a cada ALERTA_ESTOQUE_MINUTOS): cria rascunhos de pedido e mensagens para
+    os itens no mínimo ainda não alertados e marca ESTOQUE.last_alert.
+    """
+    try:
+        resumo = tarefas.varrer_estoque_baixo()
+    except Exception as e:
+        raise click.ClickException(f"Erro na varredura de estoque baixo: {e}")
+    print(f"Itens alertados: {resumo['alertados']}, rascunhos de pedido: {resumo['rascunhos']}, "
+          f"itens rearmados: {resumo['rearmados']}.")
+
+@app.cli.command("verificar-estoque")
+@click.option("--completo", is_flag=True, help="Soma o razão inteiro, sem partir do último snapshot (confere também os snapshots).")
+@click.option("--ajustar", type=click.Choice(['movimentacoes', 'estoque']),
+              help="Corrige as divergências: 'movimentacoes' lança ajustes no razão; 'estoque' grava em ESTOQUE o saldo do razão.")
+def verificar_estoque_command(completo, ajustar):
+    """
+    Compara ESTOQUE.quantidade_produto com o saldo do razão
+    (MOVIMENTACAO_ESTOQUE) e falha se algum produto divergir. Ao adotar o
+    razão numa base antiga, use --ajustar movimentacoes uma vez para lançar
+    os saldos iniciais; depois disso, o razão é a referência (--ajustar estoque).
+    """
+    divergentes = movimentacoes.divergencias(usar_snapshot=not completo)
+    if not divergentes:
+        print("ESTOQUE confere com o razão.")
+        return
+    for linha in divergentes[:50]:
+        print(f"#{linha.id_produto} {linha.nome}: ESTOQUE {linha.estoque}, razão {linha.razao}")
+    if len(divergentes) > 50:
+        print(f"... e mais {len(divergentes) - 50} produto(s).")
+    if not ajustar:
+        raise click.ClickException(f"{len(divergentes)} produto(s) com ESTOQUE diferente do razão.")
+    try:
+        if ajustar == 'movimentacoes':
+            movimentacoes.ajustar_movimentacoes(divergentes)
+        else:
+            incrementar_indicadores(total_produtos_estoque=movimentacoes.ajustar_estoque(divergentes))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Erro ao ajustar as divergências: {e}")
+    cache.dados.invalidar(cache.REGIAO_ESTOQUE)
+    print(f"{len(divergentes)} produto(s) ajustado(s) ({ajustar}).")
+
+@app.cli.command("gerar-snapshot-estoque")
+@click.option("--data", help="Data de corte, AAAA-MM-DD (padrão: início do mês corrente).")
+def gerar_snapshot_estoque_command(data):
+    """
+    Grava em ESTOQUE_SNAPSHOT o saldo de cada produto na data de corte, a
+    partir do snapshot anterior e das movimentações desde então. O agendador
+    faz o mesmo para o início de cada mês.
+    """
+    corte = _ler_data_filtro(data)
+    if data and corte is None:
+        raise click.ClickException("Data inválida; use AAAA-MM-DD.")
+    try:
+        linhas = movimentacoes.gerar_snapshot(corte)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise click.ClickException(f"Erro ao gerar o snapshot: {e}")
+    print(f"Snapshot gravado: {linhas} produto(s)." if linhas else "Nada a gravar: o snapshot já existe ou o corte é recente demais.")
+
+@app.cli.command("atualizar-analises")
+@click.option("--completo", is_flag=True, help="Refaz os snapshots do zero, em vez de acrescentar só os dias novos.")
+def atualizar_analises_command(completo):
+    """
+    Acrescenta aos snapshots das análises (ANALISES_DIR) os totais diários de
+    vendas e movimentações dos dias fechados desde o último corte. O
+    agendador faz o mesmo a cada ANALISES_HORAS.
+    """
+    try:
+        vendas, movimentos = analises.atualizar(completo)
+    except Exception as e:
+        raise click.ClickException(f"Erro ao atualizar as análises: {e}")
+    print(f"Snapshots das análises em {app.config['ANALISES_DIR']} ({analises.formato()}): "
+          f"{vendas} linha(s) de vendas e {movimentos} de movimentos novas.")
+
+@app.cli.command("particionar-movimentacoes")
+@click.option("--meses", default=3, show_default=True, help="Meses à frente com partição criada.")
+@click.option("--simular", is_flag=True, help="Só mostra as instruções, sem executá-las.")
+def particionar_movimentacoes_command(meses, simular):
+    """
+    (MySQL) Particiona MOVIMENTACAO_ESTOQUE por mês ou, se já estiver
+    particionada, cria as partições dos próximos meses. Rode no cron uma vez
+    por mês. Remove as chaves estrangeiras da tabela, que o InnoDB não aceita
+    em tabelas particionadas.
+    """
+    if db.engine.dialect.name != 'mysql':
+        raise click.ClickException("O particionamento só está disponível no MySQL.")
+    instrucoes = movimentacoes.ddl_particionamento(meses)
+    if not instrucoes:
+        print("As partições já estão criadas.")
+        return
+    for instrucao in instrucoes:
+        print(instrucao + ';')
+        if not simular:
+            db.session.execute(db.text(instrucao))
+    db.session.commit()
+
+@app.cli.command("import")
+@click.argument("caminho", type=click.Path(exists=True, dir_okay=False))
+@click.option("--formato", type=click.Choice(importacao.FORMATOS), help="Formato do arquivo (padrão: pela extensão).")
+@click.option("--lote", default=importacao.TAMANHO_LOTE, show_default=True, help="Registros gravados por commit.")
+@click.option("--sem-atualizar", is_flag=True, help="Ignora produtos que já existem, em vez de atualizá-los.")
+@click.option("--simular", is_flag=True, help="Apenas mostra o que seria importado, sem gravar nada.")
+def importar_command(caminho, formato, lote, sem_atualizar, simular):
+    """
+    Importa um catálogo de produtos (JSON, NDJSON ou CSV) ou executa um script
+    SQL. Produtos são casados pelo nome: os existentes são atualizados com os
+    campos presentes no arquivo e os novos são inseridos em lotes.
+    """
+    db.create_all()
+    try:
+        formato = formato or importacao.detectar_formato(caminho)
+        if formato == 'sql':
+            if simular:
+                raise click.ClickException("--simular não se aplica a scripts SQL.")
+            importacao.executar_script_sql(caminho)
+            cache.dados.limpar()
+            print(f"Script {caminho} executado.")
+            return
+
+        inicio = time.perf_counter()
+
+        def progresso(relatorio):
+            decorrido = time.perf_counter() - inicio
+            print(f"  {relatorio['lidos']} registros lidos ({relatorio['lidos'] / decorrido:.0f}/s)...")
+
+        relatorio = importacao.importar(importacao.ler_registros(caminho, formato), tamanho_lote=lote,
+                                        atualizar=not sem_atualizar, simular=simular, progresso=progresso)
+        if not simular:
+            cache.dados.invalidar(cache.REGIAO_ESTOQUE, cache.REGIAO_FORNECEDORES, cache.REGIAO_CATEGORIAS)
+    except click.ClickException:
+        raise
+    except Exception as e:
+        raise click.ClickException(f"Erro ao importar {caminho}: {e}")
+
+    print(f"{'SIMULAÇÃO - nada foi gravado. ' if simular else ''}Importação concluída em {time.perf_counter() - inicio:.1f}s:")
+    for chave in ('lidos', 'inseridos', 'atualizados', 'ignorados', 'invalidos',
+                  'categorias_criadas', 'fornecedores_criados', 'sem_fornecedor'):
+        print(f"  {chave.replace('_', ' ')}: {relatorio[chave]}")
+    for erro in relatorio['erros']:
+        print(f"  ! {erro}")
+    if relatorio['sem_fornecedor']:
+        print("  (fornecedores desconhecidos sem CNPJ no arquivo não são cadastrados; os produtos ficam sem fornecedor)")
+
 
 # --- Inicialização ---
 if __name__ == '__main__':
@@ -0,0 +1,244 @@
+"""
+Senhas e proteção do login.
+
+  - Política de hash: SENHA_METODO, no formato do Werkzeug (ex.:
+    'pbkdf2:sha256:600000' ou 'scrypt:32768:8:1'). Uma senha gravada com
+    outro método ou outro custo é refeita com a política atual no próximo
+    login que acertar a senha (precisa_rehash).
+  - O cálculo do hash (gerar e conferir) roda num pool de SENHA_PROCESSOS
+    processos, fora das threads que atendem as requisições, com no máximo
+    SENHA_FILA_MAXIMA cálculos em andamento ou na fila por processo web.
+    Acima disso, o login responde 503 em vez de acumular CPU e deixar o
+    caixa sem resposta. SENHA_PROCESSOS=0 calcula na própria thread.
+  - Limite de tentativas: baldes de fichas em memória por login e por IP
+    (LOGIN_TENTATIVAS_USUARIO e LOGIN_TENTATIVAS_IP por minuto, com rajada
+    do mesmo tamanho; 0 desliga o limite). Cada tentativa gasta uma ficha dos dois baldes; um
+    login certo enche de novo o balde do usuário. O limite por IP é mais
+    folgado porque os caixas de uma loja costumam sair pelo mesmo IP.
+    Os baldes são deste processo: com N processos, o limite efetivo é até
+    N vezes maior.
+  - Usuário da requisição: @exige_cargo(...) nas rotas identifica o usuário
+    uma vez por requisição e o deixa em g.usuario (Identidade: id_conta,
+    login, cargo). A identidade vem de um cache em memória por id_conta,
+    com validade de USUARIO_CACHE_SEGUNDOS; só na falta o banco é lido.
+    Uma sessão cuja conta foi apagada ou mudou de cargo é encerrada, e o
+    usuário volta ao login. Com vários processos, a mudança é percebida em
+    até USUARIO_CACHE_SEGUNDOS.
+"""
+import time
+import math
+import multiprocessing
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import wraps
+from flask import g, session, redirect, url_for, jsonify, flash
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app import app, db
+from models import Usuario
+import cache
+import metricas
+
+MAX_BALDES = 10000
+
+
+class HashSobrecarregado(RuntimeError):
+    """Há cálculos de hash demais em andamento neste processo; tente de novo em instantes."""
+
+
+# =======================================================================
+# HASH DAS SENHAS
+# =======================================================================
+
+_pool = None
+_trava_pool = threading.Lock()
+_vagas = threading.BoundedSemaphore(app.config['SENHA_FILA_MAXIMA'])
+_metodo_efetivo = None
+_hash_ficticio = None
+
+
+def _executar(funcao, *args):
+    """Roda funcao(*args) no pool de processos, respeitando o limite de cálculos simultâneos."""
+    global _pool
+    if not app.config['SENHA_PROCESSOS']:
+        return funcao(*args)
+    if not _vagas.acquire(timeout=app.config['SENHA_ESPERA_SEGUNDOS']):
+        raise HashSobrecarregado('Muitos logins ao mesmo tempo.')
+    try:
+        if _pool is None:
+            with _trava_pool:
+                if _pool is None:
+                    # 'spawn', não fork: o pool nasce numa thread de requisição, com outras
+                    # threads rodando, e um filho por fork herdaria travas (logging, pool
+                    # do banco, agendador) que elas estivessem segurando.
+                    _pool = ProcessPoolExecutor(max_workers=app.config['SENHA_PROCESSOS'],
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _pool.submit(funcao, *args).result()
+    finally:
+        _vagas.release()
+
+
+def gerar_hash(senha):
+    return _executar(generate_password_hash, senha, app.config['SENHA_METODO'])
+
+
+def verificar_senha(hash_gravado, senha):
+    """
+    Confere a senha. Sem hash gravado (usuário inexistente), confere contra um
+    hash fictício, para que a resposta leve o mesmo tempo e não revele quais
+    logins existem.
+    """
+    global _hash_ficticio
+    if not hash_gravado:
+        if _hash_ficticio is None:
+            _hash_ficticio = gerar_hash('senha-ficticia')
+        _executar(check_password_hash, _hash_ficticio, senha or '')
+        return False
+    return _executar(check_password_hash, hash_gravado, senha or '')
+
+
+def metodo_do_hash(hash_gravado):
+    """'pbkdf2:sha256:600000$sal$hash' -> 'pbkdf2:sha256:600000'; None se não for um hash do Werkzeug."""
+    if not hash_gravado or hash_gravado.count('$') < 2:
+        return None
+    return hash_gravado.split('$', 1)[0]
+
+
+def precisa_rehash(hash_gravado):
+    """Se o hash foi gerado com método ou custo diferente de SENHA_METODO."""
+    global _metodo_efetivo
+    if _metodo_efetivo is None:
+        # O Werkzeug completa os parâmetros omitidos ('scrypt' -> 'scrypt:32768:8:1').
+        _metodo_efetivo = metodo_do_hash(generate_password_hash('', app.config['SENHA_METODO']))
+    return metodo_do_hash(hash_gravado) != _metodo_efetivo
+
+
+# =======================================================================
+# LIMITE DE TENTATIVAS
+# =======================================================================
+
+class BaldeDeFichas:
+    """
+    Limite de taxa por chave: cada chave tem até 'capacidade' fichas, repostas
+    à razão de 'por_segundo'. Guarda no máximo MAX_BALDES chaves (descarta as
+    usadas há mais tempo). Capacidade 0 desliga o limite. Seguro para uso por
+    várias threads.
+    """
+
+    def __init__(self, capacidade, por_segundo):
+        self.capacidade = capacidade
+        self.por_segundo = por_segundo
+        self._baldes = OrderedDict()  # chave -> (fichas, instante)
+        self._trava = threading.Lock()
+
+    def consumir(self, chave):
+        """Gasta uma ficha. Devolve 0 se havia ficha, ou os segundos até a próxima."""
+        if self.capacidade <= 0:
+            return 0
+        agora = time.monotonic()
+        with self._trava:
+            fichas, instante = self._baldes.pop(chave, (self.capacidade, agora))
+            fichas = min(self.capacidade, fichas + (agora - instante) * self.por_segundo)
+            espera = 0 if fichas >= 1 else (1 - fichas) / self.por_segundo
+            self._baldes[chave] = (fichas - 1 if not espera else fichas, agora)
+            while len(self._baldes) > MAX_BALDES:
+                self._baldes.popitem(last=False)
+            return espera
+
+    def encher(self, chave):
+        with self._trava:
+            self._baldes.pop(chave, None)
+
+
+tentativas_por_login = BaldeDeFichas(app.config['LOGIN_TENTATIVAS_USUARIO'], app.config['LOGIN_TENTATIVAS_USUARIO'] / 60)
+tentativas_por_ip = BaldeDeFichas(app.config['LOGIN_TENTATIVAS_IP'], app.config['LOGIN_TENTATIVAS_IP'] / 60)
+
+
+def registrar_tentativa(login, ip):
+    """Gasta uma tentativa do login e do IP. Devolve 0 se pode tentar, ou os segundos (inteiros) a esperar."""
+    espera = max(tentativas_por_ip.consumir(ip or '-'), tentativas_por_login.consumir((login or '').strip().lower()))
+    return math.ceil(espera)
+
+
+def login_bem_sucedido(login, usuario):
+    """Enche o balde do login e guarda a identidade do usuário, já lida do banco pelo login."""
+    tentativas_por_login.encher((login or '').strip().lower())
+    lembrar_usuario(usuario)
+
+
+# =======================================================================
+# USUÁRIO DA REQUISIÇÃO
+# =======================================================================
+
+Identidade = namedtuple('Identidade', 'id_conta login cargo')
+
+# Cargos que cada cargo inclui: o gerente também pode tudo o que o vendedor pode.
+CARGOS_INCLUIDOS = {
+    'GERENTE': frozenset({'GERENTE', 'VENDEDOR'}),
+    'VENDEDOR': frozenset({'VENDEDOR'}),
+}
+
+_identidades = cache.CacheLRU(tamanho_maximo=MAX_BALDES, ttl=app.config['USUARIO_CACHE_SEGUNDOS'])
+
+
+def lembrar_usuario(usuario):
+    """Grava a identidade atual do usuário no cache (ex.: logo depois do login)."""
+    _identidades.gravar(usuario.id_conta, Identidade(usuario.id_conta, usuario.login, usuario.cargo))
+
+
+def _carregar_identidade():
+    id_conta = session.get('user_id')
+    if id_conta is None:
+        return None, 'anonimo'
+    identidade = _identidades.obter(id_conta)
+    origem = 'cache'
+    if identidade is None:
+        linha = db.session.execute(
+            db.select(Usuario.id_conta, Usuario.login, Usuario.cargo).where(Usuario.id_conta == id_conta)
+        ).first()
+        identidade = Identidade(*linha) if linha else None
+        origem = 'banco'
+        if identidade is not None:
+            _identidades.gravar(id_conta, identidade)
+    if identidade is None or identidade.cargo != session.get('cargo'):
+        # Conta apagada ou com outro cargo desde o login: a sessão não vale mais.
+        session.clear()
+        return None, 'encerrada'
+    return identidade, origem
+
+
+def usuario_atual():
+    """Identidade do usuário logado nesta requisição (ou None), lida uma vez e guardada em g.usuario."""
+    if 'usuario' not in g:
+        inicio = time.perf_counter()
+        g.usuario, origem = _carregar_identidade()
+        metricas.identificacao_segundos.observar((('origem', origem),), time.perf_counter() - inicio)
+    return g.usuario
+
+
+def tem_cargo(identidade, cargo):
+    return identidade is not None and (cargo is None or cargo in CARGOS_INCLUIDOS.get(identidade.cargo, ()))
+
+
+def exige_cargo(cargo=None, api=False, voltar_para=None):
+    """
+    Protege uma rota: exige um usuário logado e, com 'cargo', que o cargo dele
+    inclua esse (ver CARGOS_INCLUIDOS). Sem acesso, rotas com api=True
+    respondem 403 em JSON; as demais vão para o login, ou, para um usuário
+    logado sem o cargo, para a página 'voltar_para' com um aviso.
+    """
+    def decorador(rota):
+        @wraps(rota)
+        def rota_protegida(*args, **kwargs):
+            identidade = usuario_atual()
+            if tem_cargo(identidade, cargo):
+                return rota(*args, **kwargs)
+            if api:
+                return jsonify({"error": "Acesso negado"}), 403
+            if identidade is not None and voltar_para:
+                flash('Acesso negado.', 'danger')
+                return redirect(url_for(voltar_para))
+            return redirect(url_for('login'))
+        return rota_protegida
+    return decorador
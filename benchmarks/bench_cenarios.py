@@ -0,0 +1,313 @@
+"""
+Benchmark de carga por cenários de uso, com comparação contra uma linha de base.
+
+Cada usuário virtual (thread) faz login e repete os cenários escolhidos:
+
+  venda        formulário da venda -> busca de cliente -> busca de produto
+               -> finalizar (POST /vendas/nova) -> recibo
+  dashboard    /dashboard e as duas APIs dos gráficos
+  listagens    /vendas, /historico, /pedidos e a busca do estoque
+  exportacao   exportação CSV de um mês de vendas e do catálogo de produtos
+  recebimento  tela e POST de recebimento de um pedido pendente
+
+Cada requisição é um "passo" medido. O resultado traz, por passo, as
+latências p50/p95/p99 em ms, além da vazão total (requisições/s) e do pico
+de memória (RSS). Com o cliente de teste do Flask (padrão), a aplicação roda
+neste processo e o RSS é o dela. Com --url, as requisições vão por HTTP
+para um servidor já rodando; para medir o RSS do servidor no Linux,
+informe --pid-servidor.
+
+A base é gerada com gerador.py (--gerar pequena|media|grande|N) ou
+reaproveitada de uma execução anterior (sem --gerar).
+
+Uso:
+    python benchmarks/bench_cenarios.py --gerar pequena --salvar-base base.json
+    python benchmarks/bench_cenarios.py --comparar base.json          # sai com 1 se houver regressão
+    python benchmarks/bench_cenarios.py --cenarios venda dashboard --usuarios 8 --iteracoes 100
+    python benchmarks/bench_cenarios.py --url http://127.0.0.1:5000 --pid-servidor 1234
+
+Sem BENCH_DATABASE_URL, usa um banco SQLite temporário (o mesmo do gerador.py).
+"""
+import sys, json, math, time, random, argparse, resource, platform, threading
+import http.cookiejar
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import datetime
+
+import comum
+comum.configurar_banco('cenarios')
+
+from app import app, db
+import gerador
+from models import Produto, Venda, PedidoFornecedor, PedidoProduto
+
+CENARIOS = ('venda', 'dashboard', 'listagens', 'exportacao', 'recebimento')
+TERMOS_PRODUTO = [palavra.lower() for palavra in gerador.PALAVRAS if ' ' not in palavra and '-' not in palavra]
+TERMOS_CLIENTE = [nome.lower() for nome in gerador.NOMES if nome.isascii()]
+ITENS_POR_PEDIDO = 3
+# Diferenças de p95 menores que isto (ms) são tratadas como ruído na comparação.
+RUIDO_MS = 2.0
+
+
+# =======================================================================
+# CLIENTES (Flask test client ou HTTP)
+# =======================================================================
+
+class ClienteFlask:
+    def __init__(self):
+        self._cliente = app.test_client()
+
+    def requisitar(self, metodo, url, dados=None):
+        resposta = self._cliente.open(url, method=metodo, data=dados)
+        return resposta.status_code, resposta.get_data(), resposta.headers
+
+
+class _SemRedirecionamento(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ClienteHTTP:
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+        self._abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _SemRedirecionamento)
+
+    def requisitar(self, metodo, url, dados=None):
+        corpo = urllib.parse.urlencode(dados, doseq=True).encode() if dados is not None else None
+        pedido = urllib.request.Request(self.base + url, data=corpo, method=metodo)
+        try:
+            with self._abridor.open(pedido) as resposta:
+                return resposta.status, resposta.read(), resposta.headers
+        except urllib.error.HTTPError as erro:
+            return erro.code, erro.read(), erro.headers
+
+
+# =======================================================================
+# CENÁRIOS
+# =======================================================================
+
+class Sessao:
+    """Um usuário virtual: faz as requisições e guarda a latência de cada passo."""
+
+    def __init__(self, cliente, medicoes, trava, aleatorio):
+        self.cliente = cliente
+        self.medicoes = medicoes
+        self.trava = trava
+        self.aleatorio = aleatorio
+        self.medir = True
+
+    def passo(self, nome, metodo, url, dados=None, esperado=(200,)):
+        inicio = time.perf_counter()
+        status, corpo, cabecalhos = self.cliente.requisitar(metodo, url, dados)
+        duracao = time.perf_counter() - inicio
+        if self.medir:
+            with self.trava:
+                medicao = self.medicoes.setdefault(nome, {'duracoes': [], 'erros': 0})
+                medicao['duracoes'].append(duracao)
+                medicao['erros'] += status not in esperado
+        return status, corpo, cabecalhos
+
+    def json(self, nome, url):
+        status, corpo, _ = self.passo(nome, 'GET', url)
+        return json.loads(corpo) if status == 200 else None
+
+
+def cenario_venda(sessao, contexto):
+    sessao.passo('venda: formulário', 'GET', '/vendas/nova')
+    clientes = sessao.json('venda: busca cliente', '/api/clientes/pesquisar?' + urllib.parse.urlencode({'q': sessao.aleatorio.choice(TERMOS_CLIENTE)}))
+    produtos = sessao.json('venda: busca produto', '/api/produtos/busca?' + urllib.parse.urlencode({'q': sessao.aleatorio.choice(TERMOS_PRODUTO), 'em_estoque': 1}))
+    if not clientes or not produtos:
+        return
+    escolhidos = sessao.aleatorio.sample(produtos, min(len(produtos), sessao.aleatorio.randint(1, 3)))
+    dados = {'id_cliente_selecionado': str(sessao.aleatorio.choice(clientes)['id_cliente']),
+             'produto_id[]': [str(p['id_produto']) for p in escolhidos], 'quantidade[]': ['1'] * len(escolhidos)}
+    _, _, cabecalhos = sessao.passo('venda: finalizar', 'POST', '/vendas/nova', dados, esperado=(302,))
+    destino = urllib.parse.urlsplit(cabecalhos.get('Location', '')).path
+    if '/recibo' in destino:
+        sessao.passo('venda: recibo', 'GET', destino)
+
+
+def cenario_dashboard(sessao, contexto):
+    sessao.passo('dashboard: página', 'GET', '/dashboard')
+    sessao.passo('dashboard: vendas por mês', 'GET', f"/api/relatorios/vendas/por_mes?ano={contexto['ano']}")
+    sessao.passo('dashboard: estoque atual', 'GET', '/api/relatorios/estoque_atual')
+
+
+def cenario_listagens(sessao, contexto):
+    sessao.passo('listagens: vendas', 'GET', '/vendas')
+    sessao.passo('listagens: histórico', 'GET', '/historico')
+    sessao.passo('listagens: pedidos', 'GET', '/pedidos')
+    sessao.passo('listagens: busca no estoque', 'GET', '/estoque?' + urllib.parse.urlencode({'q': sessao.aleatorio.choice(TERMOS_PRODUTO)}))
+
+
+def cenario_exportacao(sessao, contexto):
+    sessao.passo('exportação: vendas do mês (csv)', 'GET', f"/export/vendas?formato=csv&de={contexto['mes_de']}&ate={contexto['mes_ate']}")
+    sessao.passo('exportação: produtos (csv)', 'GET', '/export/produtos?formato=csv')
+
+
+def cenario_recebimento(sessao, contexto):
+    with sessao.trava:
+        if not contexto['pedidos']:
+            return
+        id_pedido, produtos = contexto['pedidos'].pop()
+    sessao.passo('recebimento: tela', 'GET', f'/pedidos/{id_pedido}/receber')
+    sessao.passo('recebimento: confirmar', 'POST', f'/pedidos/{id_pedido}/receber',
+                 {f'qty_{p}': '10' for p in produtos}, esperado=(302,))
+
+
+FUNCOES = {'venda': cenario_venda, 'dashboard': cenario_dashboard, 'listagens': cenario_listagens,
+           'exportacao': cenario_exportacao, 'recebimento': cenario_recebimento}
+
+
+def preparar_contexto(cenarios, pedidos_necessarios, semente):
+    """Dados que os cenários precisam: um mês com vendas e pedidos pendentes exclusivos para o recebimento."""
+    with app.app_context():
+        ultima = db.session.query(db.func.max(Venda.data_compra)).scalar() or datetime.utcnow()
+        contexto = {'ano': ultima.year, 'mes_de': ultima.strftime('%Y-%m-01'), 'mes_ate': ultima.strftime('%Y-%m-%d'),
+                    'pedidos': []}
+        if 'recebimento' in cenarios and pedidos_necessarios:
+            aleatorio = random.Random(semente)
+            total_produtos = db.session.query(db.func.max(Produto.id_produto)).scalar()
+            for _ in range(pedidos_necessarios):
+                pedido = PedidoFornecedor(id_fornecedor=1, status='Pendente')
+                db.session.add(pedido)
+                db.session.flush()
+                produtos = aleatorio.sample(range(1, total_produtos + 1), ITENS_POR_PEDIDO)
+                db.session.execute(db.insert(PedidoProduto), [
+                    {'id_pedido': pedido.id_pedido, 'id_produto': p, 'quantidade_pedida': 10} for p in produtos])
+                contexto['pedidos'].append((pedido.id_pedido, produtos))
+            db.session.commit()
+        db.session.remove()
+    return contexto
+
+
+# =======================================================================
+# EXECUÇÃO E RELATÓRIO
+# =======================================================================
+
+def usuario_virtual(criar_cliente, cenarios, contexto, iteracoes, aquecimento, medicoes, trava, semente):
+    sessao = Sessao(criar_cliente(), medicoes, trava, random.Random(semente))
+    sessao.passo('login', 'POST', '/login', {'login': 'admin', 'senha': 'admin'}, esperado=(302,))
+    for i in range(aquecimento + iteracoes):
+        sessao.medir = i >= aquecimento
+        for cenario in cenarios:
+            FUNCOES[cenario](sessao, contexto)
+
+
+def percentil(ordenados, p):
+    return ordenados[max(0, math.ceil(p / 100 * len(ordenados)) - 1)]
+
+
+def rss_pico_mb(pid_servidor=None):
+    """Pico de memória residente em MB: do servidor (VmHWM, Linux) ou deste processo."""
+    if pid_servidor:
+        with open(f'/proc/{pid_servidor}/status') as status:
+            for linha in status:
+                if linha.startswith('VmHWM:'):
+                    return int(linha.split()[1]) / 1024
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+def resumir(medicoes, duracao, pid_servidor):
+    passos = {}
+    for nome, medicao in sorted(medicoes.items()):
+        ordenados = sorted(medicao['duracoes'])
+        passos[nome] = {
+            'requisicoes': len(ordenados), 'erros': medicao['erros'],
+            'p50_ms': round(percentil(ordenados, 50) * 1000, 2), 'p95_ms': round(percentil(ordenados, 95) * 1000, 2),
+            'p99_ms': round(percentil(ordenados, 99) * 1000, 2), 'media_ms': round(sum(ordenados) / len(ordenados) * 1000, 2),
+        }
+    total = sum(p['requisicoes'] for p in passos.values())
+    return {'passos': passos, 'requisicoes': total, 'duracao_s': round(duracao, 2),
+            'vazao_rps': round(total / duracao, 1), 'rss_pico_mb': round(rss_pico_mb(pid_servidor), 1)}
+
+
+def comparar(resultado, base, tolerancia):
+    """Lista as regressões (p95 por passo, vazão e RSS) além da tolerância relativa."""
+    regressoes = []
+    for nome, atual in resultado['passos'].items():
+        anterior = base['passos'].get(nome)
+        if anterior and atual['p95_ms'] > anterior['p95_ms'] * (1 + tolerancia) and atual['p95_ms'] - anterior['p95_ms'] > RUIDO_MS:
+            regressoes.append(f"{nome}: p95 {anterior['p95_ms']} -> {atual['p95_ms']} ms")
+    if resultado['vazao_rps'] < base['vazao_rps'] * (1 - tolerancia):
+        regressoes.append(f"vazão: {base['vazao_rps']} -> {resultado['vazao_rps']} req/s")
+    if resultado['rss_pico_mb'] > base['rss_pico_mb'] * (1 + tolerancia):
+        regressoes.append(f"RSS de pico: {base['rss_pico_mb']} -> {resultado['rss_pico_mb']} MB")
+    return regressoes
+
+
+def imprimir(resultado, base=None):
+    print(f"{'passo':<36} {'n':>6} {'erros':>5} {'p50':>9} {'p95':>9} {'p99':>9}" + ('   p95 base' if base else ''))
+    for nome, p in resultado['passos'].items():
+        linha = f"{nome:<36} {p['requisicoes']:>6} {p['erros']:>5} {p['p50_ms']:>7.1f}ms {p['p95_ms']:>7.1f}ms {p['p99_ms']:>7.1f}ms"
+        anterior = base and base['passos'].get(nome)
+        print(linha + (f"   {anterior['p95_ms']:>7.1f}ms" if anterior else ''))
+    print(f"{resultado['requisicoes']} requisições em {resultado['duracao_s']}s -> {resultado['vazao_rps']} req/s; "
+          f"RSS de pico: {resultado['rss_pico_mb']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cenarios', nargs='+', choices=CENARIOS, default=list(CENARIOS))
+    parser.add_argument('--usuarios', type=int, default=1, help='usuários virtuais simultâneos (threads)')
+    parser.add_argument('--iteracoes', type=int, default=30, help='repetições dos cenários por usuário')
+    parser.add_argument('--aquecimento', type=int, default=2, help='repetições iniciais não medidas')
+    parser.add_argument('--gerar', help='gera a base antes: pequena, media, grande ou um número de vendas')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--url', help='servidor HTTP já rodando (padrão: cliente de teste do Flask)')
+    parser.add_argument('--pid-servidor', type=int, help='PID do servidor, para medir o RSS dele (Linux)')
+    parser.add_argument('--saida', help='grava o resultado em JSON')
+    parser.add_argument('--salvar-base', help='grava o resultado como linha de base (JSON)')
+    parser.add_argument('--comparar', help='compara com uma linha de base e sai com 1 se houver regressão')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='piora relativa aceita na comparação')
+    args = parser.parse_args()
+
+    print(f"Banco: {app.config['SQLALCHEMY_DATABASE_URI']}")
+    if args.gerar:
+        vendas = gerador.ESCALAS.get(args.gerar) or int(args.gerar)
+        print(f"Gerando a base ({vendas} vendas)...")
+        with app.app_context():
+            gerador.gerar(vendas, args.semente)
+            db.session.remove()
+
+    contexto = preparar_contexto(args.cenarios, args.usuarios * (args.iteracoes + args.aquecimento), args.semente)
+    criar_cliente = (lambda: ClienteHTTP(args.url)) if args.url else ClienteFlask
+    medicoes, trava = {}, threading.Lock()
+    threads = [threading.Thread(target=usuario_virtual, args=(
+        criar_cliente, args.cenarios, contexto, args.iteracoes, args.aquecimento, medicoes, trava, args.semente + i
+    )) for i in range(args.usuarios)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    resultado = resumir(medicoes, time.perf_counter() - inicio, args.pid_servidor)
+    resultado['meta'] = {
+        'data': datetime.now().isoformat(timespec='seconds'), 'banco': args.url or app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'cenarios': args.cenarios, 'usuarios': args.usuarios, 'iteracoes': args.iteracoes,
+        'python': platform.python_version(), 'maquina': platform.node(),
+    }
+
+    base = None
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as arquivo:
+            base = json.load(arquivo)
+    imprimir(resultado, base)
+    for caminho in filter(None, (args.saida, args.salvar_base)):
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            json.dump(resultado, arquivo, ensure_ascii=False, indent=2)
+        print(f"Resultado gravado em {caminho}")
+    if base:
+        regressoes = comparar(resultado, base, args.tolerancia)
+        for regressao in regressoes:
+            print(f"REGRESSÃO {regressao}")
+        if regressoes:
+            sys.exit(1)
+        print(f"Sem regressões em relação a {args.comparar} (tolerância de {args.tolerancia:.0%}).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""
+Funções compartilhadas pelos scripts de benchmark.
+
+Importe este módulo ANTES de 'app': ele aponta DATABASE_URL para o banco de
+benchmark (BENCH_DATABASE_URL ou um SQLite temporário), já que a aplicação lê
+a configuração no momento da importação.
+"""
+import os, sys, tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def configurar_banco(nome):
+    """Define o banco do benchmark 'nome' e devolve a URL usada."""
+    sqlite_tmp = os.path.join(tempfile.gettempdir(), f'rytek_bench_{nome}.db')
+    os.environ['DATABASE_URL'] = os.getenv('BENCH_DATABASE_URL', f'sqlite:///{sqlite_tmp}')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # Sem o agendador (tarefas.py) disputando o banco durante a medição.
+    os.environ.setdefault('TAREFAS_ATIVO', '0')
+    return os.environ['DATABASE_URL']
+
+
+def recriar_base():
+    """
+    Apaga e recria todas as tabelas e insere os cadastros mínimos: um
+    endereço, uma categoria, um pagamento, um fornecedor, um cliente e um
+    usuário vendedor (todos com id 1). Deve ser chamada dentro de um app context.
+    """
+    from app import db
+    from models import Endereco, Categoria, Pagamento, Fornecedor, Cliente, Usuario
+
+    db.drop_all()
+    db.create_all()
+    endereco = Endereco(cep='00000-000', numero='1')
+    db.session.add(endereco)
+    db.session.flush()
+    db.session.add_all([Categoria(nome_categoria='Bench'), Pagamento(tipo='PIX')])
+    db.session.add(Fornecedor(nome='Fornecedor Bench', cnpj='00.000.000/0001-00', id_endereco=endereco.id_endereco))
+    db.session.add(Cliente(nome='Cliente Bench', cpf='52998224725', id_endereco=endereco.id_endereco))
+    db.session.add(Usuario(login='bench', senha='-', cargo='VENDEDOR'))
+    db.session.commit()
+
+
+def criar_produtos(quantidade, estoque_inicial):
+    """Cria 'quantidade' produtos (ids 1..N), cada um com seu estoque. Chamar num app context."""
+    from app import db
+    from models import Estoque, Produto
+
+    estoques = [{'quantidade_produto': estoque_inicial, 'min_produto': 1} for _ in range(quantidade)]
+    db.session.execute(db.insert(Estoque), estoques)
+    db.session.execute(db.insert(Produto), [
+        {'nome': f'Produto Bench {i}', 'nome_busca': f'produto bench {i}', 'preco': 10 + i % 100, 'id_categoria': 1,
+         'fornecedor_id': 1, 'estoque_id': i}
+        for i in range(1, quantidade + 1)
+    ])
+    db.session.commit()
+
+
+def cliente_logado(app, cargo='VENDEDOR'):
+    """Cliente de teste do Flask com a sessão do usuário de benchmark (id 1)."""
+    cliente = app.test_client()
+    with cliente.session_transaction() as sess:
+        sess['user_id'] = 1
+        sess['cargo'] = cargo
+        sess['login'] = 'bench'
+    return cliente
@@ -0,0 +1,232 @@
+"""
+Busca de produtos por nome (página de estoque e seletores de produto da
+venda e do pedido) e de clientes por CPF ou nome (caixa da nova venda).
+
+A busca é feita sobre PRODUTO.nome_busca, uma cópia do nome em minúsculas,
+sem acentos e sem pontuação (ver normalizar()), mantida por toda escrita que
+altera o nome. Cada banco usa o seu índice de texto:
+  - MySQL:  índice FULLTEXT em nome_busca (MATCH ... AGAINST em modo booleano,
+            com busca por prefixo de cada palavra).
+  - SQLite: tabela virtual FTS5 'PRODUTO_BUSCA' (conteúdo externo, mantida
+            por triggers), com índices de prefixo de 2 e 3 letras.
+  - Outros: LIKE em nome_busca (sem índice de texto).
+
+Os resultados trazem primeiro os nomes que começam com o termo digitado e
+depois os demais, pela relevância do índice.
+
+Clientes são buscados pelo início do CPF (índice único de CLIENTE.cpf) ou
+pelo início do nome normalizado (CLIENTE.nome_busca, indexado), e as
+respostas recentes ficam por poucos segundos no cache da aplicação
+(região cache.REGIAO_CLIENTES).
+"""
+import re
+import unicodedata
+from sqlalchemy import DDL, case, event, literal_column
+
+from app import db
+import consultas
+import cache
+from models import Produto, Estoque, Cliente
+
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 50
+TABELA_FTS = 'PRODUTO_BUSCA'
+# Palavras menores que isso ficam fora do índice FULLTEXT do InnoDB
+# (innodb_ft_min_token_size) e são filtradas com LIKE.
+TAMANHO_MINIMO_FULLTEXT = 3
+
+LIMITE_CLIENTES = 10
+LIMITE_CLIENTES_MAXIMO = 20
+# Dígitos mínimos para buscar por CPF (menos que isso casaria boa parte da base).
+DIGITOS_MINIMOS_CPF = 3
+# Respostas da busca de clientes ficam em cache por poucos segundos: o
+# caixa repete os mesmos prefixos enquanto digita e apaga.
+TTL_CACHE_CLIENTES = 30
+
+
+def sem_acento(texto):
+    return ''.join(c for c in unicodedata.normalize('NFKD', texto) if not unicodedata.combining(c))
+
+
+def normalizar(texto):
+    """'Cadeira Gamer - Preta (Ergonômica)' -> 'cadeira gamer preta ergonomica'."""
+    if not texto:
+        return ''
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', sem_acento(texto).lower()).split())
+
+
+# =======================================================================
+# ÍNDICE FTS5 DO SQLITE
+# =======================================================================
+
+# Criados junto com a tabela PRODUTO (db.create_all) e recriados por
+# 'flask reindexar-busca'. O índice guarda só nome_busca; os dados continuam
+# em PRODUTO ('content'), e os triggers mantêm o índice em dia.
+DDL_FTS_SQLITE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} USING fts5("
+    f"nome_busca, content='PRODUTO', content_rowid='id_produto', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS produto_busca_ai AFTER INSERT ON PRODUTO BEGIN "
+    f"INSERT INTO {TABELA_FTS}(rowid, nome_busca) VALUES (new.id_produto, new.nome_busca); END",
+    f"CREATE TRIGGER IF NOT EXISTS produto_busca_ad AFTER DELETE ON PRODUTO BEGIN "
+    f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, nome_busca) VALUES ('delete', old.id_produto, old.nome_busca); END",
+    f"CREATE TRIGGER IF NOT EXISTS produto_busca_au AFTER UPDATE OF nome_busca ON PRODUTO BEGIN "
+    f"INSERT INTO {TABELA_FTS}({TABELA_FTS}, rowid, nome_busca) VALUES ('delete', old.id_produto, old.nome_busca); "
+    f"INSERT INTO {TABELA_FTS}(rowid, nome_busca) VALUES (new.id_produto, new.nome_busca); END",
+)
+DROP_FTS_SQLITE = (
+    "DROP TRIGGER IF EXISTS produto_busca_ai",
+    "DROP TRIGGER IF EXISTS produto_busca_ad",
+    "DROP TRIGGER IF EXISTS produto_busca_au",
+    f"DROP TABLE IF EXISTS {TABELA_FTS}",
+)
+
+for _instrucao in DDL_FTS_SQLITE:
+    event.listen(Produto.__table__, 'after_create', DDL(_instrucao).execute_if(dialect='sqlite'))
+for _instrucao in DROP_FTS_SQLITE:
+    event.listen(Produto.__table__, 'before_drop', DDL(_instrucao).execute_if(dialect='sqlite'))
+
+_fts = db.table(TABELA_FTS, db.column('rowid'), db.column('rank'))
+
+
+# =======================================================================
+# CONSULTA
+# =======================================================================
+
+def pesquisar_produtos(termo, limite=LIMITE_PADRAO, em_estoque=False):
+    """
+    Devolve até 'limite' produtos (com o estoque já carregado) cujo nome
+    contém todas as palavras de 'termo', cada uma como prefixo de uma
+    palavra do nome: 'cad gam' encontra 'Cadeira Gamer'. Com 'em_estoque',
+    só produtos com quantidade maior que zero.
+    """
+    palavras = normalizar(termo).split()
+    if not palavras:
+        return []
+    consulta = db.session.query(Produto).join(Produto.estoque).options(*consultas.PRODUTO_COM_ESTOQUE_JOIN)
+    if em_estoque:
+        consulta = consulta.filter(Estoque.quantidade_produto > 0)
+    consulta, relevancia = _filtrar_por_palavras(consulta, palavras)
+    comeca_com = case((Produto.nome_busca.like(f"{' '.join(palavras)}%"), 0), else_=1)
+    return consulta.order_by(comeca_com, *relevancia, Produto.nome_busca).limit(limite).all()
+
+
+def _filtrar_por_palavras(consulta, palavras):
+    """Aplica o filtro do índice de texto do banco. Devolve (consulta, ordenação por relevância)."""
+    # normalizar() só deixa [a-z0-9], então as palavras não precisam de escape.
+    dialeto = db.session.get_bind().dialect.name
+    if dialeto == 'sqlite':
+        expressao = ' '.join(f'"{p}"*' for p in palavras)
+        consulta = consulta.join(_fts, _fts.c.rowid == Produto.id_produto).filter(
+            literal_column(TABELA_FTS).op('MATCH')(expressao)
+        )
+        return consulta, [_fts.c.rank]
+    if dialeto == 'mysql':
+        longas = [p for p in palavras if len(p) >= TAMANHO_MINIMO_FULLTEXT]
+        curtas = [p for p in palavras if len(p) < TAMANHO_MINIMO_FULLTEXT]
+        if not longas:
+            # Só palavras curtas (ex.: 'tv'): prefixo do nome, pelo índice comum.
+            return consulta.filter(Produto.nome_busca.like(f"{' '.join(palavras)}%")), []
+        relevancia = Produto.nome_busca.match(' '.join(f'+{p}*' for p in longas))
+        consulta = consulta.filter(relevancia)
+        for p in curtas:
+            consulta = consulta.filter(Produto.nome_busca.like(f'%{p}%'))
+        return consulta, [relevancia.desc()]
+    for p in palavras:
+        consulta = consulta.filter(Produto.nome_busca.like(f'%{p}%'))
+    return consulta, []
+
+
+def _comeca_com(coluna, prefixo):
+    """
+    'coluna começa com prefixo' como LIKE 'prefixo%', com % e _ escapados. O
+    MySQL usa o índice B-tree para esse padrão com qualquer collation (um
+    intervalo [prefixo, prefixo + '~') não serve: no utf8mb4_unicode_ci o '~'
+    vem antes dos dígitos e das letras).
+    """
+    escapado = prefixo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return coluna.like(f'{escapado}%', escape='\\')
+
+
+def pesquisar_clientes(termo, limite=LIMITE_CLIENTES):
+    """
+    Busca clientes por CPF ou nome. Se o termo tiver só dígitos (e pontuação
+    de CPF), procura CPFs que começam com eles; senão, nomes que começam com
+    o termo e, se faltarem resultados, nomes com alguma palavra começando
+    com ele ('silva' encontra 'Ana Silva'; essa segunda etapa não usa índice).
+    Devolve até 'limite' dicionários {id_cliente, nome, cpf}, vindos do cache
+    quando a mesma busca foi feita há pouco.
+    """
+    termo = (termo or '').strip()
+    digitos = ''.join(filter(str.isdigit, termo))
+    if digitos and not re.sub(r'[\d.\-\s]', '', termo):
+        if len(digitos) < DIGITOS_MINIMOS_CPF:
+            return []
+        chave = ('cpf', digitos, limite)
+    else:
+        nome = normalizar(termo)
+        if not nome:
+            return []
+        chave = ('nome', nome, limite)
+
+    return cache.dados.obter_ou_calcular(
+        cache.REGIAO_CLIENTES, chave, lambda: _consultar_clientes(chave[0], chave[1], limite), ttl=TTL_CACHE_CLIENTES
+    )
+
+
+def _consultar_clientes(tipo, valor, limite):
+    colunas = (Cliente.id_cliente, Cliente.nome, Cliente.cpf)
+    if tipo == 'cpf':
+        linhas = db.session.query(*colunas).filter(_comeca_com(Cliente.cpf, valor)).order_by(
+            Cliente.cpf).limit(limite).all()
+    else:
+        linhas = db.session.query(*colunas).filter(_comeca_com(Cliente.nome_busca, valor)).order_by(
+            Cliente.nome_busca).limit(limite).all()
+        if len(linhas) < limite and len(valor) >= TAMANHO_MINIMO_FULLTEXT:
+            linhas += db.session.query(*colunas).filter(
+                Cliente.nome_busca.like(f'% {valor}%'), db.not_(_comeca_com(Cliente.nome_busca, valor))
+            ).order_by(
+                Cliente.nome_busca).limit(limite - len(linhas)).all()
+    return [{'id_cliente': l.id_cliente, 'nome': l.nome, 'cpf': l.cpf} for l in linhas]
+
+
+# =======================================================================
+# REINDEXAÇÃO
+# =======================================================================
+
+def reindexar(tamanho_lote=5000):
+    """
+    Recalcula nome_busca de todos os produtos e clientes, em lotes por id, e
+    reconstrói o índice de texto dos produtos. Devolve (produtos, clientes)
+    processados.
+    """
+    sqlite = db.session.get_bind().dialect.name == 'sqlite'
+    if sqlite:
+        # Sem o índice e os triggers durante a atualização em massa; o
+        # índice é reconstruído de uma vez no final.
+        for instrucao in DROP_FTS_SQLITE:
+            db.session.execute(DDL(instrucao))
+    produtos = _recalcular_nome_busca(Produto, Produto.id_produto, tamanho_lote)
+    clientes = _recalcular_nome_busca(Cliente, Cliente.id_cliente, tamanho_lote)
+    if sqlite:
+        for instrucao in DDL_FTS_SQLITE:
+            db.session.execute(DDL(instrucao))
+        db.session.execute(db.text(f"INSERT INTO {TABELA_FTS}({TABELA_FTS}) VALUES ('rebuild')"))
+        db.session.commit()
+    cache.dados.invalidar(cache.REGIAO_CLIENTES)
+    return produtos, clientes
+
+
+def _recalcular_nome_busca(modelo, coluna_id, tamanho_lote):
+    total, ultimo_id = 0, 0
+    while True:
+        lote = db.session.query(coluna_id, modelo.nome).filter(
+            coluna_id > ultimo_id
+        ).order_by(coluna_id).limit(tamanho_lote).all()
+        if not lote:
+            return total
+        db.session.execute(db.update(modelo), [
+            {coluna_id.key: id_linha, 'nome_busca': normalizar(nome)} for id_linha, nome in lote
+        ])
+        db.session.commit()
+        total += len(lote)
+        ultimo_id = lote[-1][0]
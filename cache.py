@@ -0,0 +1,202 @@
+"""
+Cache de leitura da aplicação, para dados que mudam pouco e são lidos a toda
+hora: fornecedores, categoria e forma de pagamento padrão, os gráficos do
+dashboard e as buscas de clientes do caixa.
+
+As entradas são agrupadas em regiões (REGIAO_*). Quem grava no banco
+invalida as regiões afetadas depois do commit (dados.invalidar(...)), e o
+TTL limita por quanto tempo um dado alterado por fora da aplicação (script
+SQL, outro processo com cache local) continua sendo servido.
+
+O armazenamento é plugável (CACHE_URL):
+  - vazio ou 'memoria://': CacheLRU, em memória, por processo. Com vários
+    processos, a invalidação vale só para o processo que fez a escrita; os
+    demais enxergam a mudança quando o TTL vence.
+  - 'redis://...': CacheRedis, compartilhado entre processos e máquinas
+    (requer o pacote 'redis'). Qualquer objeto com obter/gravar/invalidar/
+    limpar serve no lugar dele, por exemplo um CacheLRU em testes locais.
+"""
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict, Counter
+
+logger = logging.getLogger(__name__)
+
+REGIAO_FORNECEDORES = 'fornecedores'
+REGIAO_CATEGORIAS = 'categorias'
+REGIAO_PAGAMENTOS = 'pagamentos'
+REGIAO_ESTOQUE = 'estoque'
+REGIAO_VENDAS = 'vendas'
+REGIAO_CLIENTES = 'clientes'
+
+_AUSENTE = object()
+
+
+class CacheLRU:
+    """
+    Dicionário limitado a 'tamanho_maximo' entradas, que descarta a usada há
+    mais tempo quando enche, e cujas entradas expiram 'ttl' segundos depois
+    de gravadas. Seguro para uso por várias threads.
+
+    As chaves usadas por CacheDados são tuplas (região, chave); invalidar()
+    apaga as entradas de uma região.
+    """
+
+    def __init__(self, tamanho_maximo=256, ttl=30):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl = ttl
+        self._dados = OrderedDict()
+        self._trava = threading.Lock()
+
+    def obter(self, chave, padrao=None):
+        with self._trava:
+            entrada = self._dados.get(chave)
+            if entrada is None:
+                return padrao
+            expira_em, valor = entrada
+            if expira_em < time.monotonic():
+                del self._dados[chave]
+                return padrao
+            self._dados.move_to_end(chave)
+            return valor
+
+    def gravar(self, chave, valor, ttl=None):
+        with self._trava:
+            self._dados[chave] = (time.monotonic() + (ttl or self.ttl), valor)
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.tamanho_maximo:
+                self._dados.popitem(last=False)
+
+    def invalidar(self, regiao):
+        with self._trava:
+            for chave in [c for c in self._dados if isinstance(c, tuple) and c[0] == regiao]:
+                del self._dados[chave]
+
+    def limpar(self):
+        with self._trava:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class CacheRedis:
+    """
+    Cache compartilhado no Redis. Os valores são gravados com pickle e cada
+    região guarda num SET as chaves que contém, para ser invalidada de uma
+    vez. Falhas de conexão não derrubam a requisição: contam como falta e
+    ficam no log.
+    """
+
+    def __init__(self, url, prefixo='rytekshop:', ttl=60):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL aponta para o Redis, mas o pacote 'redis' não está instalado (pip install redis).")
+        self._erros = redis.RedisError
+        self._cliente = redis.Redis.from_url(url)
+        self.prefixo = prefixo
+        self.ttl = ttl
+
+    def _chave(self, chave):
+        regiao, resto = chave if isinstance(chave, tuple) else (None, chave)
+        return f'{self.prefixo}{regiao}:{resto!r}', f'{self.prefixo}{regiao}:__chaves__'
+
+    def obter(self, chave, padrao=None):
+        try:
+            valor = self._cliente.get(self._chave(chave)[0])
+        except self._erros:
+            logger.warning('Cache Redis indisponível (leitura)', exc_info=True)
+            return padrao
+        return padrao if valor is None else pickle.loads(valor)
+
+    def gravar(self, chave, valor, ttl=None):
+        nome, indice = self._chave(chave)
+        try:
+            with self._cliente.pipeline() as pipe:
+                pipe.set(nome, pickle.dumps(valor), ex=ttl or self.ttl)
+                pipe.sadd(indice, nome)
+                pipe.execute()
+        except self._erros:
+            logger.warning('Cache Redis indisponível (gravação)', exc_info=True)
+
+    def invalidar(self, regiao):
+        indice = f'{self.prefixo}{regiao}:__chaves__'
+        try:
+            chaves = self._cliente.smembers(indice)
+            self._cliente.delete(indice, *chaves)
+        except self._erros:
+            logger.warning('Cache Redis indisponível: região %s não invalidada', regiao, exc_info=True)
+
+    def limpar(self):
+        try:
+            chaves = list(self._cliente.scan_iter(match=f'{self.prefixo}*'))
+            if chaves:
+                self._cliente.delete(*chaves)
+        except self._erros:
+            logger.warning('Cache Redis indisponível: cache não limpo', exc_info=True)
+
+
+def criar_backend(url, tamanho_maximo=1024, ttl=60):
+    """Escolhe o armazenamento pela URL (ver o início do módulo)."""
+    if not url or url.startswith('memoria://'):
+        return CacheLRU(tamanho_maximo=tamanho_maximo, ttl=ttl)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return CacheRedis(url, ttl=ttl)
+    raise ValueError(f'CACHE_URL não suportada: {url}')
+
+
+class CacheDados:
+    """
+    Cache por regiões sobre um backend plugável, com contadores de acertos e
+    faltas por região (os contadores são deste processo).
+
+        fornecedores = dados.obter_ou_calcular(REGIAO_FORNECEDORES, 'lista', listar)
+        ...
+        db.session.commit()
+        dados.invalidar(REGIAO_FORNECEDORES)
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else CacheLRU(tamanho_maximo=1024, ttl=60)
+        self._acertos = Counter()
+        self._faltas = Counter()
+        self._trava = threading.Lock()
+
+    def usar_backend(self, backend):
+        self.backend = backend
+
+    def obter_ou_calcular(self, regiao, chave, calcular, ttl=None):
+        """Devolve o valor em cache ou, numa falta, calcula com calcular(), grava e devolve."""
+        valor = self.backend.obter((regiao, chave), _AUSENTE)
+        with self._trava:
+            (self._faltas if valor is _AUSENTE else self._acertos)[regiao] += 1
+        if valor is _AUSENTE:
+            valor = calcular()
+            self.backend.gravar((regiao, chave), valor, ttl)
+        return valor
+
+    def invalidar(self, *regioes):
+        for regiao in regioes:
+            self.backend.invalidar(regiao)
+
+    def limpar(self):
+        self.backend.limpar()
+
+    def estatisticas(self):
+        """{região: {'acertos', 'faltas', 'taxa_acerto'}} desde o início do processo."""
+        with self._trava:
+            regioes = sorted(set(self._acertos) | set(self._faltas))
+            return {
+                regiao: {
+                    'acertos': self._acertos[regiao],
+                    'faltas': self._faltas[regiao],
+                    'taxa_acerto': round(self._acertos[regiao] / (self._acertos[regiao] + self._faltas[regiao]), 4),
+                } for regiao in regioes
+            }
+
+
+# Instância usada pela aplicação; app.py troca o backend conforme CACHE_URL.
+dados = CacheDados()
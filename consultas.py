@@ -0,0 +1,179 @@
+"""
+Camada de consultas: opções de carregamento (eager loading) por tela e
+contagem de instruções SQL por requisição.
+
+Cada tela declara aqui quais relacionamentos o template vai acessar, para
+que eles venham na mesma consulta (joinedload/contains_eager, para relações
+muitos-para-um) ou numa única consulta extra (selectinload, para coleções),
+em vez de uma consulta por linha (N+1).
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.dialects import mysql, sqlite
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
+
+from app import db
+from models import (Produto, Venda, ProdutoVenda, PedidoFornecedor, PedidoProduto,
+                    Mensagem, MovimentacaoEstoque)
+
+
+# =======================================================================
+# OPÇÕES DE CARREGAMENTO POR TELA
+# =======================================================================
+
+# Cards de produto (estoque.html, dashboard.html): quantidade em estoque.
+PRODUTO_CARD = (joinedload(Produto.estoque),)
+
+# Consultas que já fazem JOIN com ESTOQUE: reaproveita o JOIN para preencher
+# 'produto.estoque' sem uma segunda leitura.
+PRODUTO_COM_ESTOQUE_JOIN = (contains_eager(Produto.estoque),)
+
+# vendas.html: cliente e número de itens de cada venda. Os itens vêm por
+# selectinload, que não multiplica as linhas da consulta paginada (LIMIT).
+LISTA_VENDAS = (joinedload(Venda.cliente), selectinload(Venda.itens))
+
+# venda_detalhes.html e recibo.html: cliente, itens e o produto de cada item.
+DETALHE_VENDA = (
+    joinedload(Venda.cliente),
+    selectinload(Venda.itens).joinedload(ProdutoVenda.produto),
+)
+
+# historico.html: nome do produto e login do usuário de cada movimentação.
+LISTA_MOVIMENTACOES = (
+    joinedload(MovimentacaoEstoque.produto),
+    joinedload(MovimentacaoEstoque.usuario),
+)
+
+# pedidos.html: fornecedor de cada pedido.
+LISTA_PEDIDOS = (joinedload(PedidoFornecedor.fornecedor),)
+
+# receber_pedido.html e o recebimento: itens, produto de cada item e seu estoque.
+RECEBIMENTO_PEDIDO = (
+    joinedload(PedidoFornecedor.fornecedor),
+    selectinload(PedidoFornecedor.itens).joinedload(PedidoProduto.produto).joinedload(Produto.estoque),
+)
+
+# mensagens.html: fornecedor de cada mensagem.
+LISTA_MENSAGENS = (joinedload(Mensagem.fornecedor),)
+
+
+# =======================================================================
+# ESCRITAS ATÔMICAS
+# =======================================================================
+
+def upsert_incremento(modelo, chave, incrementos):
+    """
+    Insere a linha de 'modelo' identificada por 'chave' (dict coluna -> valor)
+    com os valores de 'incrementos', ou, se ela já existir, soma 'incrementos'
+    às colunas atuais. É uma única instrução atômica (sem ler antes de
+    escrever), então vendas simultâneas não perdem atualizações.
+    """
+    dialeto = db.session.get_bind().dialect.name
+    valores = {**chave, **incrementos}
+    tabela = modelo.__table__
+    if dialeto == 'mysql':
+        stmt = mysql.insert(tabela).values(**valores)
+        stmt = stmt.on_duplicate_key_update({c: tabela.c[c] + stmt.inserted[c] for c in incrementos})
+    elif dialeto == 'sqlite':
+        stmt = sqlite.insert(tabela).values(**valores)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(chave),
+            set_={c: tabela.c[c] + stmt.excluded[c] for c in incrementos},
+        )
+    else:
+        atualizado = db.session.execute(
+            tabela.update().where(*[tabela.c[c] == v for c, v in chave.items()])
+            .values({c: tabela.c[c] + v for c, v in incrementos.items()})
+        )
+        if atualizado.rowcount:
+            return
+        stmt = tabela.insert().values(**valores)
+    db.session.execute(stmt)
+
+
+# =======================================================================
+# CONTAGEM DE INSTRUÇÕES SQL E ORÇAMENTO POR ROTA
+# =======================================================================
+
+# Número máximo de instruções SQL que cada página pode executar. Como as
+# listagens são paginadas e os relacionamentos carregados de forma antecipada,
+# esses números não dependem do volume de dados. Se uma alteração fizer uma
+# rota passar do orçamento, há um N+1 novo (ou uma consulta esquecida).
+ORCAMENTO_CONSULTAS = {
+    '/dashboard': 2,
+    '/estoque': 2,
+    '/vendas': 2,
+    '/historico': 1,
+    '/pedidos': 1,
+    '/mensagens': 1,
+    '/vendas/nova': 0,
+    '/pedidos/novo': 1,
+    '/estoque?q=gamer': 2,
+    '/api/produtos/busca?q=gam': 1,
+    '/api/clientes/pesquisar?q=ana': 2,
+    '/api/clientes/pesquisar?q=529': 1,
+    '/api/relatorios/vendas/por_mes': 1,
+    '/api/relatorios/estoque_atual': 1,
+    '/api/estoque/abaixo_minimo': 1,
+    # Data do último snapshot + saldos a partir dele.
+    '/api/relatorios/estoque_em?data=2025-01-01': 2,
+    # Produtos + o que entrou depois do último corte dos snapshots (analises.py).
+    '/api/analises/abc': 2,
+    '/api/analises/giro': 3,
+    '/api/analises/mais_vendidos?por=mes': 2,
+}
+
+# Páginas de detalhe: a URL é montada com o registro mais recente do banco.
+ORCAMENTO_DETALHES = {
+    '/venda/{id_venda}': 2,
+    '/venda/{id_venda}/recibo': 2,
+    '/venda/{id_venda}/recibo/imprimir': 2,
+    '/pedidos/{id_pedido}/receber': 2,
+}
+
+
+class OrcamentoExcedido(AssertionError):
+    """Uma rota executou mais instruções SQL do que o orçamento permite."""
+
+
+@contextmanager
+def contar_consultas(engine=None):
+    """
+    Conta as instruções SQL executadas dentro do bloco.
+
+        with contar_consultas() as instrucoes:
+            cliente.get('/estoque')
+        print(len(instrucoes))
+
+    Devolve a lista das instruções executadas (texto SQL), na ordem.
+    """
+    # Sem 'engine', conta em todos (o principal e a réplica de leitura, se houver).
+    engines = [engine] if engine is not None else list(db.engines.values())
+    instrucoes = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        instrucoes.append(statement)
+
+    for motor in engines:
+        event.listen(motor, 'before_cursor_execute', registrar)
+    try:
+        yield instrucoes
+    finally:
+        for motor in engines:
+            event.remove(motor, 'before_cursor_execute', registrar)
+
+
+def verificar_orcamento(cliente, url, limite):
+    """
+    Faz um GET em 'url' com o cliente de teste do Flask e lança
+    OrcamentoExcedido se a requisição executar mais de 'limite' instruções.
+    Devolve o número de instruções executadas.
+    """
+    with contar_consultas() as instrucoes:
+        resposta = cliente.get(url)
+    if resposta.status_code >= 400:
+        raise OrcamentoExcedido(f'{url} respondeu {resposta.status_code}')
+    if len(instrucoes) > limite:
+        detalhes = '\n'.join(f'  {i + 1}. {sql}' for i, sql in enumerate(instrucoes))
+        raise OrcamentoExcedido(f'{url} executou {len(instrucoes)} instruções SQL (orçamento: {limite}):\n{detalhes}')
+    return len(instrucoes)
@@ -0,0 +1,282 @@
+"""
+Eventos ao vivo para as telas abertas, por Server-Sent Events (/eventos).
+
+O dashboard e a página de estoque recebem pequenos eventos em vez de
+recarregar a página inteira:
+
+  - 'venda': uma venda registrada (id, valor, data);
+  - 'estoque': a nova quantidade, a versão e o alerta de estoque baixo de
+    cada produto alterado por uma venda, um recebimento de pedido ou um
+    ajuste de estoque (edição rápida ou contagem em lote);
+  - 'recarregar': o canal perdeu eventos (reconexão em outro processo ou
+    depois de muito tempo, cliente lento); a tela deve buscar os dados de
+    novo.
+
+Quem grava chama apos_commit(tipo, dados) dentro da transação; o evento só
+é publicado se ela for confirmada (eventos da sessão after_commit /
+after_rollback do SQLAlchemy), então uma venda desfeita não aparece nas telas.
+
+A publicação é plugável (EVENTOS_URL):
+  - vazio ou 'memoria://': os eventos vão direto para as conexões deste
+    processo. Com vários processos, cada tela só vê o que foi gravado pelo
+    processo em que está conectada.
+  - 'redis://...': os eventos passam por um canal pub/sub do Redis, e cada
+    processo repassa a todas as suas conexões (requer o pacote 'redis').
+
+Em cada processo, um único CanalLocal distribui os eventos para as conexões
+abertas e guarda os últimos HISTORICO_EVENTOS, para que o navegador, ao
+reconectar com Last-Event-ID, receba o que perdeu.
+
+Cada conexão ocupa uma thread do servidor enquanto está aberta. Por isso há
+no máximo EVENTOS_CONEXOES_MAXIMAS conexões por processo (as demais recebem
+503 e a tela segue sem atualização automática, tentando de novo mais tarde),
+e cada conexão é encerrada depois de EVENTOS_DURACAO_MAXIMA segundos; o
+navegador reconecta sozinho, sem perder eventos.
+"""
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import deque
+from sqlalchemy import event
+
+from app import app, db
+from replica import SessaoRoteada
+
+TIPO_VENDA = 'venda'
+TIPO_ESTOQUE = 'estoque'
+TIPO_RECARREGAR = 'recarregar'
+
+HISTORICO_EVENTOS = 256
+TAMANHO_FILA = 100
+PULSO_SEGUNDOS = 15
+RECONEXAO_MS = 3000
+CANAL_REDIS = 'rytekshop:eventos'
+
+_PENDENTES = 'eventos_pendentes'
+
+logger = logging.getLogger(__name__)
+
+
+class Assinatura:
+    """Uma conexão aberta: a fila de eventos ainda não enviados a ela."""
+
+    def __init__(self):
+        self.fila = queue.Queue(maxsize=TAMANHO_FILA)
+
+
+class CanalLocal:
+    """
+    Distribui os eventos para as conexões deste processo. Um cliente que não
+    lê a tempo (fila cheia) recebe 'recarregar' no lugar dos eventos perdidos.
+    Seguro para uso por várias threads.
+    """
+
+    def __init__(self, conexoes_maximas):
+        self.conexoes_maximas = conexoes_maximas
+        self._assinaturas = set()
+        self._historico = deque(maxlen=HISTORICO_EVENTOS)
+        self._trava = threading.Lock()
+
+    def assinar(self, ultimo_id=None):
+        """
+        (assinatura, eventos perdidos desde 'ultimo_id'), ou (None, None) se
+        o limite de conexões foi atingido. Os eventos perdidos são
+        [RECARREGAR] quando 'ultimo_id' já saiu do histórico.
+        """
+        with self._trava:
+            if len(self._assinaturas) >= self.conexoes_maximas:
+                return None, None
+            assinatura = Assinatura()
+            self._assinaturas.add(assinatura)
+            perdidos = []
+            if ultimo_id:
+                ids = [evento['id'] for evento in self._historico]
+                if ultimo_id in ids:
+                    perdidos = list(self._historico)[ids.index(ultimo_id) + 1:]
+                else:
+                    perdidos = [_evento(TIPO_RECARREGAR, {})]
+            return assinatura, perdidos
+
+    def cancelar(self, assinatura):
+        with self._trava:
+            self._assinaturas.discard(assinatura)
+
+    def entregar(self, evento):
+        with self._trava:
+            self._historico.append(evento)
+            assinaturas = list(self._assinaturas)
+        for assinatura in assinaturas:
+            try:
+                assinatura.fila.put_nowait(evento)
+            except queue.Full:
+                _esvaziar(assinatura.fila)
+                assinatura.fila.put_nowait(_evento(TIPO_RECARREGAR, {}))
+
+    def conexoes(self):
+        with self._trava:
+            return len(self._assinaturas)
+
+
+def _esvaziar(fila):
+    while True:
+        try:
+            fila.get_nowait()
+        except queue.Empty:
+            return
+
+
+class BackendMemoria:
+    """Publica direto no canal deste processo."""
+
+    def __init__(self, canal):
+        self.canal = canal
+
+    def publicar(self, evento):
+        self.canal.entregar(evento)
+
+
+class BackendRedis:
+    """
+    Publica num canal pub/sub do Redis; uma thread por processo assina o
+    canal e repassa os eventos ao CanalLocal. Falhas de conexão não derrubam
+    a gravação: o evento se perde e fica no log.
+    """
+
+    def __init__(self, url, canal):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("EVENTOS_URL aponta para o Redis, mas o pacote 'redis' não está instalado (pip install redis).")
+        self._erros = redis.RedisError
+        self._cliente = redis.Redis.from_url(url)
+        self.canal = canal
+        self._ouvinte = None
+        self._trava = threading.Lock()
+
+    def publicar(self, evento):
+        try:
+            self._cliente.publish(CANAL_REDIS, json.dumps(evento))
+        except self._erros:
+            logger.warning('Redis indisponível: evento %s não publicado', evento['tipo'], exc_info=True)
+
+    def iniciar(self):
+        """Sobe a thread que assina o canal (uma vez por processo, na primeira conexão)."""
+        with self._trava:
+            if self._ouvinte is None:
+                self._ouvinte = threading.Thread(target=self._ouvir, name='eventos-redis', daemon=True)
+                self._ouvinte.start()
+
+    def _ouvir(self):
+        espera = 1
+        while True:
+            try:
+                assinatura = self._cliente.pubsub(ignore_subscribe_messages=True)
+                assinatura.subscribe(CANAL_REDIS)
+                espera = 1
+                for mensagem in assinatura.listen():
+                    self.canal.entregar(json.loads(mensagem['data']))
+            except self._erros:
+                logger.warning('Redis indisponível: eventos ao vivo parados; nova tentativa em %s s', espera, exc_info=True)
+                # As telas podem ter perdido eventos enquanto o Redis estava fora.
+                self.canal.entregar(_evento(TIPO_RECARREGAR, {}))
+                time.sleep(espera)
+                espera = min(espera * 2, 60)
+
+
+def criar_backend(url, canal):
+    """Escolhe a publicação pela URL (ver o início do módulo)."""
+    if not url or url.startswith('memoria://'):
+        return BackendMemoria(canal)
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return BackendRedis(url, canal)
+    raise ValueError(f'EVENTOS_URL não suportada: {url}')
+
+
+canal = CanalLocal(app.config['EVENTOS_CONEXOES_MAXIMAS'])
+backend = criar_backend(app.config['EVENTOS_URL'], canal)
+
+# Identifica os eventos deste processo: com o Redis, o mesmo id chega a todos
+# os processos, e o Last-Event-ID vale em qualquer um deles.
+_instancia = uuid.uuid4().hex[:8]
+_sequencia = iter(range(1, 2 ** 63))
+_trava_sequencia = threading.Lock()
+
+
+def _evento(tipo, dados):
+    with _trava_sequencia:
+        numero = next(_sequencia)
+    return {'id': f'{_instancia}-{numero}', 'tipo': tipo, 'dados': dados}
+
+
+# =======================================================================
+# PUBLICAÇÃO
+# =======================================================================
+
+def apos_commit(tipo, dados):
+    """Agenda o evento para ser publicado quando a transação atual for confirmada."""
+    db.session.info.setdefault(_PENDENTES, []).append((tipo, dados))
+
+
+@event.listens_for(SessaoRoteada, 'after_commit')
+def _publicar_pendentes(sessao):
+    for tipo, dados in sessao.info.pop(_PENDENTES, []):
+        try:
+            backend.publicar(_evento(tipo, dados))
+        except Exception:
+            logger.warning('Evento %s não publicado', tipo, exc_info=True)
+
+
+@event.listens_for(SessaoRoteada, 'after_rollback')
+def _descartar_pendentes(sessao):
+    sessao.info.pop(_PENDENTES, None)
+
+
+def item_estoque(id_produto, nome, quantidade, versao, min_produto, variacao):
+    """Um produto no evento 'estoque'."""
+    return {'id': id_produto, 'nome': nome, 'quantidade': quantidade, 'versao': versao,
+            'abaixo_minimo': quantidade <= (min_produto or 0), 'variacao': variacao}
+
+
+# =======================================================================
+# CONEXÕES
+# =======================================================================
+
+def _formatar(evento):
+    return f"id: {evento['id']}\nevent: {evento['tipo']}\ndata: {json.dumps(evento['dados'], ensure_ascii=False)}\n\n"
+
+
+def _fluxo(assinatura, perdidos):
+    try:
+        yield f'retry: {RECONEXAO_MS}\n\n'
+        for evento in perdidos:
+            yield _formatar(evento)
+        fim = time.monotonic() + app.config['EVENTOS_DURACAO_MAXIMA']
+        while time.monotonic() < fim:
+            try:
+                evento = assinatura.fila.get(timeout=min(PULSO_SEGUNDOS, max(fim - time.monotonic(), 0.1)))
+            except queue.Empty:
+                # Comentário: mantém a conexão viva em proxies com tempo limite de inatividade.
+                yield ': pulso\n\n'
+                continue
+            yield _formatar(evento)
+    finally:
+        canal.cancelar(assinatura)
+
+
+def resposta_sse(ultimo_id=None):
+    """Resposta em fluxo text/event-stream, ou None se o processo já está no limite de conexões."""
+    assinatura, perdidos = canal.assinar(ultimo_id)
+    if assinatura is None:
+        return None
+    if isinstance(backend, BackendRedis):
+        backend.iniciar()
+    resposta = app.response_class(_fluxo(assinatura, perdidos), mimetype='text/event-stream')
+    resposta.headers['Cache-Control'] = 'no-cache'
+    # O nginx não deve acumular o fluxo antes de repassar.
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    # Se a conexão cair antes do primeiro envio, o gerador nem começa e o 'finally' não roda.
+    resposta.call_on_close(lambda: canal.cancelar(assinatura))
+    return resposta
@@ -0,0 +1,226 @@
+"""
+Pipeline de exportação de relatórios em fluxo (streaming).
+
+As linhas são lidas do banco em lotes, projetando apenas as colunas
+necessárias, e escritas direto no arquivo de saída, sem montar listas de
+objetos ORM nem DataFrames em memória. O consumo de memória fica constante,
+não importa quantas linhas sejam exportadas.
+
+Formatos suportados:
+  - xlsx:   XlsxWriter em modo 'constant_memory', gravado num arquivo temporário
+            que é enviado em blocos e apagado ao fim do download.
+  - csv:    resposta HTTP em blocos (chunked), separada por ';' (padrão do Excel pt-BR).
+  - ndjson: resposta HTTP em blocos, um objeto JSON por linha.
+
+Nos formatos em fluxo, um erro depois do início do download fica no log e
+o arquivo termina com uma linha de erro (MARCADOR_ERRO_*).
+
+As mesmas funções gravam o relatório num arquivo (gravar_arquivo), para as
+exportações em segundo plano.
+"""
+import os, io, csv, json, logging, tempfile
+from decimal import Decimal
+from flask import Response, stream_with_context
+from sqlalchemy import or_, and_
+import xlsxwriter
+
+from app import db
+
+FORMATOS = ('xlsx', 'csv', 'ndjson')
+TAMANHO_LOTE = 1000
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+MIMETYPES = {'xlsx': MIMETYPE_XLSX, 'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+# Última linha de um download em fluxo que falhou no meio (ver _com_marcador_de_erro).
+MARCADOR_ERRO_CSV = 'ERRO: exportação interrompida - o arquivo está incompleto.\r\n'
+MARCADOR_ERRO_NDJSON = json.dumps({'erro': 'Exportação interrompida; o arquivo está incompleto.'}, ensure_ascii=False) + '\n'
+
+logger = logging.getLogger(__name__)
+
+
+def iterar_linhas(stmt, chaves, tamanho_lote=TAMANHO_LOTE):
+    """
+    Percorre o resultado de 'stmt' em lotes de 'tamanho_lote' linhas.
+
+    'chaves' são as colunas de ordenação (a última deve ser única, ex.: o id),
+    sempre em ordem decrescente. Quando o driver suporta cursores do lado do
+    servidor, usa uma única consulta com 'stream_results' + 'yield_per'; caso
+    contrário (ex.: mysql-connector), busca lote a lote por keyset, para que
+    o driver nunca carregue o resultado inteiro na memória.
+    """
+    stmt = stmt.order_by(*[c.desc() for c in chaves])
+
+    # O engine que vai executar a consulta: o da réplica, nas rotas de leitura (replica.py).
+    if db.session.get_bind(clause=stmt).dialect.supports_server_side_cursors:
+        resultado = db.session.execute(stmt.execution_options(stream_results=True, yield_per=tamanho_lote))
+        for lote in resultado.partitions():
+            yield from lote
+        return
+
+    ultimo = None
+    while True:
+        stmt_lote = stmt
+        if ultimo is not None:
+            stmt_lote = stmt.where(_apos(chaves, ultimo))
+        lote = db.session.execute(stmt_lote.limit(tamanho_lote)).all()
+        yield from lote
+        if len(lote) < tamanho_lote:
+            return
+        ultimo = [getattr(lote[-1], c.key) for c in chaves]
+
+
+def _apos(chaves, valores):
+    """Condição keyset '(c1, c2, ...) < (v1, v2, ...)' escrita de forma que use o índice."""
+    coluna, valor = chaves[0], valores[0]
+    if len(chaves) == 1:
+        return coluna < valor
+    return or_(coluna < valor, and_(coluna == valor, _apos(chaves[1:], valores[1:])))
+
+
+def _valor(linha, coluna):
+    """Extrai e formata o valor de uma coluna da especificação do relatório."""
+    valor = getattr(linha, coluna['chave'])
+    if valor is None:
+        return coluna.get('padrao')
+    if 'strftime' in coluna:
+        return valor.strftime(coluna['strftime'])
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def exportar(relatorio, stmt, chaves, formato='xlsx'):
+    """
+    Gera a resposta de download de um relatório.
+
+    'relatorio' é um dicionário com 'nome_arquivo', 'aba' e 'colunas'; cada
+    coluna tem 'titulo', 'chave' (rótulo na consulta) e, opcionalmente,
+    'largura', 'dinheiro', 'strftime' e 'padrao'.
+    """
+    if formato == 'csv':
+        return _exportar_csv(relatorio, stmt, chaves)
+    if formato == 'ndjson':
+        return _exportar_ndjson(relatorio, stmt, chaves)
+    return _exportar_xlsx(relatorio, stmt, chaves)
+
+
+def gravar_arquivo(relatorio, stmt, chaves, formato, caminho):
+    """
+    Grava o relatório direto em 'caminho' (usado pelas exportações em
+    segundo plano, ver tarefas.py). Devolve o número de linhas exportadas.
+    """
+    if formato == 'xlsx':
+        return _gravar_xlsx(relatorio, stmt, chaves, caminho)
+    gerador = _gerar_csv if formato == 'csv' else _gerar_ndjson
+    linhas = []
+    with open(caminho, 'w', encoding='utf-8', newline='') as arquivo:
+        for bloco in gerador(relatorio, stmt, chaves, linhas):
+            arquivo.write(bloco)
+    return linhas[0] if linhas else 0
+
+
+def _gravar_xlsx(relatorio, stmt, chaves, caminho):
+    workbook = xlsxwriter.Workbook(caminho, {'constant_memory': True})
+    worksheet = workbook.add_worksheet(relatorio['aba'])
+    negrito = workbook.add_format({'bold': True, 'border': 1})
+    money_format = workbook.add_format({'num_format': 'R$ #,##0.00'})
+    for indice, coluna in enumerate(relatorio['colunas']):
+        formato_coluna = money_format if coluna.get('dinheiro') else None
+        worksheet.set_column(indice, indice, coluna.get('largura', 15), formato_coluna)
+        worksheet.write(0, indice, coluna['titulo'], negrito)
+
+    numero_linha = 0
+    for numero_linha, linha in enumerate(iterar_linhas(stmt, chaves), start=1):
+        for indice, coluna in enumerate(relatorio['colunas']):
+            worksheet.write(numero_linha, indice, _valor(linha, coluna))
+    workbook.close()
+    return numero_linha
+
+
+def _exportar_xlsx(relatorio, stmt, chaves):
+    arquivo = tempfile.NamedTemporaryFile(prefix='rytek_export_', suffix='.xlsx', delete=False)
+    arquivo.close()
+    try:
+        _gravar_xlsx(relatorio, stmt, chaves, arquivo.name)
+    except Exception:
+        os.remove(arquivo.name)
+        raise
+
+    tamanho = os.path.getsize(arquivo.name)
+    response = _resposta_em_fluxo(_ler_e_remover(arquivo.name), f"{relatorio['nome_arquivo']}.xlsx", MIMETYPE_XLSX)
+    response.headers['Content-Length'] = str(tamanho)
+    return response
+
+
+def _ler_e_remover(caminho, tamanho_bloco=64 * 1024):
+    """Envia o arquivo em blocos e o apaga quando a resposta termina (ou é abortada)."""
+    try:
+        with open(caminho, 'rb') as f:
+            for bloco in iter(lambda: f.read(tamanho_bloco), b''):
+                yield bloco
+    finally:
+        os.remove(caminho)
+
+
+def _gerar_csv(relatorio, stmt, chaves, total=None):
+    """Gera o CSV em blocos de TAMANHO_LOTE linhas. Se 'total' (lista) for dado, recebe o nº de linhas no fim."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')  # BOM para o Excel reconhecer UTF-8
+    writer.writerow([c['titulo'] for c in relatorio['colunas']])
+    numero = 0
+    for numero, linha in enumerate(iterar_linhas(stmt, chaves), start=1):
+        writer.writerow([_valor(linha, c) for c in relatorio['colunas']])
+        if numero % TAMANHO_LOTE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+    if total is not None:
+        total.append(numero)
+
+
+def _gerar_ndjson(relatorio, stmt, chaves, total=None):
+    numero = 0
+    for numero, linha in enumerate(iterar_linhas(stmt, chaves), start=1):
+        registro = {c['titulo']: _valor(linha, c) for c in relatorio['colunas']}
+        yield json.dumps(registro, ensure_ascii=False, default=str) + '\n'
+    if total is not None:
+        total.append(numero)
+
+
+def _exportar_csv(relatorio, stmt, chaves):
+    gerador = _com_marcador_de_erro(_gerar_csv(relatorio, stmt, chaves), MARCADOR_ERRO_CSV, relatorio['nome_arquivo'])
+    return _resposta_em_fluxo(gerador, f"{relatorio['nome_arquivo']}.csv", MIMETYPES['csv'])
+
+
+def _exportar_ndjson(relatorio, stmt, chaves):
+    gerador = _com_marcador_de_erro(_gerar_ndjson(relatorio, stmt, chaves), MARCADOR_ERRO_NDJSON, relatorio['nome_arquivo'])
+    return _resposta_em_fluxo(gerador, f"{relatorio['nome_arquivo']}.ndjson", MIMETYPES['ndjson'])
+
+
+def _com_marcador_de_erro(gerador, marcador, nome):
+    """
+    Lê o primeiro bloco ainda na rota, para que um erro na consulta caia no
+    try/except dela (e vire mensagem para o usuário) em vez de um download
+    vazio. Um erro depois disso, com a resposta 200 já enviada, vai para o
+    log e termina o arquivo com 'marcador', para que quem abrir o arquivo
+    saiba que ele está incompleto.
+    """
+    primeiro = next(gerador, None)
+
+    def fluxo():
+        if primeiro is None:
+            return
+        yield primeiro
+        try:
+            yield from gerador
+        except Exception:
+            logger.exception('Exportação %s interrompida no meio do download', nome)
+            yield marcador
+    return fluxo()
+
+
+def _resposta_em_fluxo(gerador, nome_arquivo, mimetype):
+    response = Response(stream_with_context(gerador), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={nome_arquivo}'
+    return response
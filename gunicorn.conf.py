@@ -0,0 +1,43 @@
+"""
+Configuração do gunicorn para produção: gunicorn -c gunicorn.conf.py wsgi:app
+
+Processos e threads seguem a quantidade de CPUs e podem ser ajustados por
+WEB_PROCESSOS e WEB_THREADS. O app não é carregado antes do fork
+(preload_app = False): cada processo abre o seu próprio pool de conexões,
+em vez de herdar sockets do processo mestre.
+"""
+import os
+import logging
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_cpus = os.cpu_count() or 1
+
+bind = os.getenv('WEB_ENDERECO', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_PROCESSOS', str(_cpus + 1)))
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', '4'))
+preload_app = False
+timeout = int(os.getenv('WEB_TEMPO_LIMITE', '60'))
+graceful_timeout = 30
+keepalive = 5
+# Reinicia cada processo depois de tantas requisições (com variação, para
+# não reiniciarem todos juntos), contendo o crescimento de memória.
+max_requests = int(os.getenv('WEB_MAX_REQUISICOES', '2000'))
+max_requests_jitter = max_requests // 10
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    # Conexões por processo: as threads de requisição mais as do agendador (tarefas.py).
+    pool = int(os.getenv('DB_POOL_TAMANHO', '10')) + int(os.getenv('DB_POOL_EXTRA', '5'))
+    necessario = threads + int(os.getenv('TAREFAS_THREADS', '2'))
+    log = logging.getLogger('gunicorn.error')
+    log.info('%d processos x %d threads; até %d conexões no banco (%d por processo)',
+             workers, threads, workers * pool, pool)
+    if pool < necessario:
+        log.warning('DB_POOL_TAMANHO + DB_POOL_EXTRA (%d) é menor que as threads de cada processo (%d): '
+                    'requisições vão esperar por conexão no pico', pool, necessario)
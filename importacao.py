@@ -0,0 +1,449 @@
+"""
+Importação em massa de catálogos de produtos (comando 'flask import').
+
+O arquivo é lido em fluxo, registro a registro, e gravado em lotes: cada
+lote resolve fornecedores e categorias por dicionários em memória (carregados
+uma única vez), procura com uma única consulta os produtos que já existem
+(pelo nome), atualiza-os com um 'executemany' e insere os novos ESTOQUE e
+PRODUTO com inserções em lote. As quantidades alteradas ou inseridas entram
+no razão do estoque (movimentacoes.py) como ajuste ou saldo inicial. Há um
+commit por lote, então o consumo de memória não depende do tamanho do catálogo.
+
+Formatos suportados:
+  - json:   uma lista de produtos ou um objeto {"produtos": [...]}, lido de
+            forma incremental (sem carregar o arquivo inteiro).
+  - ndjson: um objeto JSON por linha.
+  - csv:    com cabeçalho, separado por ';' ou ','. Aceita o CSV gerado pela
+            exportação de produtos.
+  - sql:    script SQL executado pelo próprio driver (ex.: Script_base_de_dados_app.sql).
+"""
+import os, csv, json
+from decimal import Decimal, InvalidOperation
+
+from app import db
+import busca
+import consultas
+import movimentacoes
+from models import Categoria, Endereco, Fornecedor, Produto, Estoque, Indicador, MovimentacaoEstoque
+
+FORMATOS = ('json', 'ndjson', 'csv', 'sql')
+TAMANHO_LOTE = 5000
+TAMANHO_BLOCO = 64 * 1024
+CATEGORIA_PADRAO = 'Sem categoria'
+OBSERVACAO_IMPORTACAO = 'Importação de catálogo'
+MAX_ERROS_RELATORIO = 20
+# Valores tratados como campo ausente ('N/A' é o que a exportação grava sem fornecedor).
+VAZIOS = (None, '', 'N/A')
+
+# Nomes aceitos para cada campo no arquivo (sem acento, minúsculos). Inclui os
+# títulos de coluna da exportação de produtos, para que ela possa ser reimportada.
+CAMPOS = {
+    'nome': ('nome', 'name', 'produto'),
+    'descricao': ('descricao', 'description'),
+    'preco': ('preco', 'price', 'preco (r$)'),
+    'preco_promocional': ('preco_promocional', 'preco promocional'),
+    'quantidade': ('quantidade', 'quantidade_produto', 'quantidade em estoque', 'estoque'),
+    'min_produto': ('min_produto', 'estoque minimo'),
+    'categoria': ('categoria', 'nome_categoria'),
+    'fornecedor': ('fornecedor',),
+    'fornecedor_cnpj': ('fornecedor_cnpj', 'cnpj'),
+    'fornecedor_email': ('fornecedor_email',),
+}
+_ALIASES = {alias: campo for campo, aliases in CAMPOS.items() for alias in aliases}
+
+
+class RegistroInvalido(ValueError):
+    """Um registro do arquivo não pode ser importado (ex.: sem nome ou preço inválido)."""
+
+
+# =======================================================================
+# LEITURA EM FLUXO
+# =======================================================================
+
+def detectar_formato(caminho):
+    extensao = os.path.splitext(caminho)[1].lower().lstrip('.')
+    if extensao == 'jsonl':
+        return 'ndjson'
+    if extensao not in FORMATOS:
+        raise ValueError(f"Formato de '{caminho}' não reconhecido; use --formato ({', '.join(FORMATOS)}).")
+    return extensao
+
+
+def ler_registros(caminho, formato):
+    """Gera os registros do arquivo como dicionários, sem carregá-lo inteiro."""
+    with open(caminho, 'r', encoding='utf-8-sig', newline='') as arquivo:
+        if formato == 'json':
+            yield from _iterar_lista_json(arquivo)
+        elif formato == 'ndjson':
+            for numero, linha in enumerate(arquivo, start=1):
+                if linha.strip():
+                    try:
+                        yield json.loads(linha)
+                    except json.JSONDecodeError as e:
+                        raise ValueError(f'Linha {numero}: JSON inválido ({e.msg}).')
+        else:
+            cabecalho = arquivo.readline()
+            delimitador = ';' if cabecalho.count(';') >= cabecalho.count(',') else ','
+            yield from csv.DictReader(_encadear(cabecalho, arquivo), delimiter=delimitador)
+
+
+def _encadear(primeira, arquivo):
+    yield primeira
+    yield from arquivo
+
+
+def _iterar_lista_json(arquivo, tamanho_bloco=TAMANHO_BLOCO):
+    """
+    Parser incremental da lista de produtos de um JSON: lê o arquivo em blocos
+    e decodifica um elemento de cada vez com JSONDecoder.raw_decode, mantendo
+    em memória só o bloco atual.
+    """
+    decoder = json.JSONDecoder()
+    buffer, fim = '', False
+
+    def ler_mais():
+        nonlocal buffer, fim
+        bloco = arquivo.read(tamanho_bloco)
+        fim = not bloco
+        buffer += bloco
+
+    # Localiza o início da lista: '[' no topo ou o valor da chave "produtos".
+    while not fim and not buffer.lstrip():
+        ler_mais()
+    if buffer.lstrip().startswith('{'):
+        while '"produtos"' not in buffer and not fim:
+            ler_mais()
+        if '"produtos"' not in buffer:
+            raise ValueError('Objeto JSON sem a chave "produtos".')
+        buffer = buffer[buffer.index('"produtos"') + len('"produtos"'):]
+    while '[' not in buffer and not fim:
+        ler_mais()
+    if '[' not in buffer:
+        raise ValueError('O JSON deve conter uma lista de produtos.')
+    buffer = buffer[buffer.index('[') + 1:]
+
+    while True:
+        pos = 0
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+            pos += 1
+        buffer = buffer[pos:]
+        if not buffer:
+            if fim:
+                raise ValueError('JSON incompleto: lista de produtos não foi fechada.')
+            ler_mais()
+            continue
+        if buffer[0] == ']':
+            return
+        try:
+            item, pos = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            if fim:
+                raise ValueError(f'JSON inválido: {e.msg}.')
+            ler_mais()
+            continue
+        buffer = buffer[pos:]
+        yield item
+
+
+# =======================================================================
+# NORMALIZAÇÃO DOS REGISTROS
+# =======================================================================
+
+def _decimal(valor, campo):
+    """Aceita números e textos como '10.50', '10,50' ou '1.234,56'."""
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor))
+    texto = str(valor).strip().replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    try:
+        return Decimal(texto)
+    except InvalidOperation:
+        raise RegistroInvalido(f"{campo} inválido: {valor!r}")
+
+
+def _inteiro(valor, campo):
+    try:
+        return int(_decimal(valor, campo))
+    except (RegistroInvalido, ValueError):
+        raise RegistroInvalido(f"{campo} inválido: {valor!r}")
+
+
+def normalizar(registro):
+    """
+    Converte um registro do arquivo num dicionário com os campos de CAMPOS.
+    Campos ausentes (ou vazios) não aparecem no resultado, para que uma
+    atualização não apague dados que o arquivo não trouxe.
+    """
+    if not isinstance(registro, dict):
+        raise RegistroInvalido('registro não é um objeto')
+    dados = {}
+    for chave, valor in registro.items():
+        campo = _ALIASES.get(busca.sem_acento(str(chave)).strip().lower())
+        if campo and valor not in VAZIOS:
+            dados[campo] = valor.strip() if isinstance(valor, str) else valor
+    if not dados.get('nome'):
+        raise RegistroInvalido('registro sem nome')
+    dados['nome'] = str(dados['nome'])[:200]
+    for campo in ('preco', 'preco_promocional'):
+        if campo in dados:
+            dados[campo] = _decimal(dados[campo], campo)
+    for campo in ('quantidade', 'min_produto'):
+        if campo in dados:
+            dados[campo] = _inteiro(dados[campo], campo)
+    if dados.get('quantidade', 0) < 0:
+        raise RegistroInvalido('quantidade negativa')
+    return dados
+
+
+# =======================================================================
+# GRAVAÇÃO EM LOTES
+# =======================================================================
+
+def novo_relatorio():
+    return {
+        'lidos': 0, 'inseridos': 0, 'atualizados': 0, 'ignorados': 0, 'invalidos': 0,
+        'categorias_criadas': 0, 'fornecedores_criados': 0, 'sem_fornecedor': 0, 'erros': [],
+    }
+
+
+def importar(registros, tamanho_lote=TAMANHO_LOTE, atualizar=True, simular=False, progresso=None):
+    """
+    Importa os 'registros' (dicionários) em lotes de 'tamanho_lote', com um
+    commit por lote. Produtos que já existem (mesmo nome) são atualizados
+    com os campos presentes no arquivo, ou ignorados se 'atualizar' for
+    falso. Com 'simular', nada é gravado: o relatório mostra o que seria feito.
+
+    'progresso', se informado, é chamado com o relatório após cada lote.
+    Devolve o relatório (contadores e os primeiros erros encontrados).
+    """
+    relatorio = novo_relatorio()
+    contexto = {
+        'categorias': {c.nome_categoria: c.id_categoria for c in db.session.query(Categoria.id_categoria, Categoria.nome_categoria)},
+        'fornecedores': {f.nome: f.id_fornecedor for f in db.session.query(Fornecedor.id_fornecedor, Fornecedor.nome)},
+        'endereco': None,
+        'vistos': set(),  # nomes já importados nesta execução (só na simulação)
+    }
+    lote = {}
+    for numero, registro in enumerate(registros, start=1):
+        relatorio['lidos'] += 1
+        try:
+            dados = normalizar(registro)
+        except RegistroInvalido as e:
+            relatorio['invalidos'] += 1
+            if len(relatorio['erros']) < MAX_ERROS_RELATORIO:
+                relatorio['erros'].append(f'Registro {numero}: {e}')
+            continue
+        # Nomes repetidos no mesmo lote: vale o último.
+        lote[dados['nome']] = dados
+        if len(lote) >= tamanho_lote:
+            _gravar_lote(list(lote.values()), contexto, relatorio, atualizar, simular)
+            lote = {}
+            if progresso:
+                progresso(relatorio)
+    if lote:
+        _gravar_lote(list(lote.values()), contexto, relatorio, atualizar, simular)
+        if progresso:
+            progresso(relatorio)
+    return relatorio
+
+
+def _gravar_lote(itens, contexto, relatorio, atualizar, simular):
+    try:
+        _resolver_categorias(itens, contexto, relatorio, simular)
+        _resolver_fornecedores(itens, contexto, relatorio, simular)
+
+        nomes = [item['nome'] for item in itens]
+        existentes = {}
+        linhas = db.session.query(Produto.nome, Produto.id_produto, Produto.estoque_id, Estoque.quantidade_produto).join(
+            Estoque, Produto.estoque_id == Estoque.id_estoque
+        ).filter(Produto.nome.in_(nomes)).order_by(Produto.id_produto.desc())
+        for linha in linhas:
+            existentes[linha.nome] = linha  # se houver nomes repetidos no banco, fica o de menor id
+        if simular:
+            existentes.update({nome: None for nome in nomes if nome in contexto['vistos']})
+            contexto['vistos'].update(nomes)
+
+        novos = [item for item in itens if item['nome'] not in existentes]
+        repetidos = [item for item in itens if item['nome'] in existentes]
+        if not atualizar:
+            relatorio['ignorados'] += len(repetidos)
+            repetidos = []
+        if simular:
+            relatorio['inseridos'] += len(novos)
+            relatorio['atualizados'] += len(repetidos)
+            return
+
+        variacao_estoque = _atualizar_existentes(repetidos, existentes, contexto)
+        variacao_estoque += _inserir_novos(novos, contexto)
+        if variacao_estoque:
+            consultas.upsert_incremento(Indicador, {'chave': 'total_produtos_estoque'}, {'valor': variacao_estoque})
+        db.session.commit()
+        relatorio['inseridos'] += len(novos)
+        relatorio['atualizados'] += len(repetidos)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def _resolver_categorias(itens, contexto, relatorio, simular):
+    """Cria de uma vez as categorias do lote que ainda não existem."""
+    categorias = contexto['categorias']
+    faltantes = {item.get('categoria', CATEGORIA_PADRAO) for item in itens} - categorias.keys()
+    if not faltantes:
+        return
+    relatorio['categorias_criadas'] += len(faltantes)
+    if simular:
+        categorias.update({nome: None for nome in faltantes})
+        return
+    db.session.execute(db.insert(Categoria), [{'nome_categoria': nome} for nome in faltantes])
+    categorias.update(db.session.query(Categoria.nome_categoria, Categoria.id_categoria).filter(
+        Categoria.nome_categoria.in_(faltantes)).all())
+
+
+def _resolver_fornecedores(itens, contexto, relatorio, simular):
+    """
+    Cria de uma vez os fornecedores do lote que ainda não existem e têm CNPJ
+    no arquivo (o CNPJ é obrigatório no cadastro). Os demais produtos de
+    fornecedores desconhecidos ficam sem fornecedor e são contados no relatório.
+    """
+    fornecedores = contexto['fornecedores']
+    novos = {}
+    for item in itens:
+        nome = item.get('fornecedor')
+        if nome and nome not in fornecedores:
+            if item.get('fornecedor_cnpj'):
+                novos.setdefault(nome, item)
+            else:
+                relatorio['sem_fornecedor'] += 1
+    if not novos:
+        return
+    relatorio['fornecedores_criados'] += len(novos)
+    if simular:
+        fornecedores.update({nome: None for nome in novos})
+        return
+    if contexto['endereco'] is None:
+        endereco = Endereco(cep='00000-000', numero='S/N', complemento='Cadastrado pela importação')
+        db.session.add(endereco)
+        db.session.flush()
+        contexto['endereco'] = endereco.id_endereco
+    db.session.execute(db.insert(Fornecedor), [
+        {'nome': nome, 'cnpj': item['fornecedor_cnpj'], 'email': item.get('fornecedor_email'),
+         'id_endereco': contexto['endereco']}
+        for nome, item in novos.items()
+    ])
+    fornecedores.update(db.session.query(Fornecedor.nome, Fornecedor.id_fornecedor).filter(
+        Fornecedor.nome.in_(list(novos))).all())
+
+
+def _colunas_produto(item, contexto):
+    colunas = {campo: item[campo] for campo in ('descricao', 'preco', 'preco_promocional') if campo in item}
+    if 'categoria' in item:
+        colunas['id_categoria'] = contexto['categorias'][item['categoria']]
+    if item.get('fornecedor') in contexto['fornecedores']:
+        colunas['fornecedor_id'] = contexto['fornecedores'][item['fornecedor']]
+    return colunas
+
+
+def _atualizar_existentes(itens, existentes, contexto):
+    """
+    Atualiza produtos e estoques por chave primária (executemany), com uma
+    movimentação de ajuste no razão para cada quantidade alterada. Devolve a
+    variação do estoque total.
+    """
+    produtos, estoques, ajustes, variacao = [], [], [], 0
+    for item in itens:
+        atual = existentes[item['nome']]
+        colunas = _colunas_produto(item, contexto)
+        if colunas:
+            produtos.append({'id_produto': atual.id_produto, **colunas})
+        estoque = {}
+        if 'quantidade' in item:
+            estoque['quantidade_produto'] = item['quantidade']
+            diferenca = item['quantidade'] - (atual.quantidade_produto or 0)
+            variacao += diferenca
+            if diferenca:
+                ajustes.append({'id_produto': atual.id_produto, 'id_usuario': None, 'tipo': movimentacoes.TIPO_AJUSTE_IMPORTACAO,
+                                'quantidade': diferenca, 'observacao': OBSERVACAO_IMPORTACAO})
+        if 'min_produto' in item:
+            estoque['min_produto'] = item['min_produto']
+        if estoque:
+            estoques.append({'id_estoque': atual.estoque_id, **estoque})
+    if produtos:
+        db.session.execute(db.update(Produto), produtos)
+    if estoques:
+        db.session.execute(db.update(Estoque), estoques)
+        movimentacoes.incrementar_versoes([estoque['id_estoque'] for estoque in estoques])
+    if ajustes:
+        db.session.execute(db.insert(MovimentacaoEstoque), ajustes)
+    return variacao
+
+
+def _inserir_novos(itens, contexto):
+    """Insere em lote os ESTOQUE e PRODUTO dos itens novos. Devolve o estoque total inserido."""
+    if not itens:
+        return 0
+    estoques = [{'quantidade_produto': item.get('quantidade', 0), 'min_produto': item.get('min_produto', 1)} for item in itens]
+    ids_estoque = _inserir_estoques(estoques)
+    categoria_padrao = contexto['categorias'].get(CATEGORIA_PADRAO)
+    produtos = []
+    for item, id_estoque in zip(itens, ids_estoque):
+        produto = {'nome': item['nome'], 'nome_busca': busca.normalizar(item['nome']), 'descricao': None, 'preco': Decimal('0.00'), 'preco_promocional': None,
+                   'id_categoria': categoria_padrao, 'fornecedor_id': None, 'estoque_id': id_estoque}
+        produto.update(_colunas_produto(item, contexto))
+        produtos.append(produto)
+    db.session.execute(db.insert(Produto), produtos)
+    # Saldo inicial no razão, com um INSERT ... SELECT (os ids dos produtos não voltam do executemany).
+    db.session.execute(db.insert(MovimentacaoEstoque).from_select(
+        ['id_produto', 'tipo', 'quantidade', 'observacao'],
+        db.select(Produto.id_produto, db.literal(movimentacoes.TIPO_SALDO_INICIAL), Estoque.quantidade_produto, db.literal(OBSERVACAO_IMPORTACAO))
+        .join(Estoque, Produto.estoque_id == Estoque.id_estoque)
+        .where(Estoque.id_estoque.in_(ids_estoque), Estoque.quantidade_produto != 0)
+    ))
+    return sum(e['quantidade_produto'] for e in estoques)
+
+
+def _inserir_estoques(estoques):
+    """
+    Insere as linhas de ESTOQUE e devolve seus ids, na mesma ordem. Usa
+    INSERT ... RETURNING em lote quando o banco permite (ex.: SQLite); no
+    MySQL, usa um único INSERT com várias linhas, para o qual o InnoDB
+    reserva ids consecutivos a partir do LAST_INSERT_ID().
+    """
+    dialeto = db.session.get_bind().dialect
+    if dialeto.insert_executemany_returning_sort_by_parameter_order:
+        stmt = db.insert(Estoque).returning(Estoque.id_estoque, sort_by_parameter_order=True)
+        return db.session.scalars(stmt, estoques).all()
+    resultado = db.session.execute(db.insert(Estoque).values(estoques))
+    primeiro = resultado.lastrowid
+    return list(range(primeiro, primeiro + len(estoques)))
+
+
+# =======================================================================
+# SCRIPTS SQL
+# =======================================================================
+
+def executar_script_sql(caminho):
+    """
+    Executa um script SQL inteiro com o suporte a múltiplas instruções do
+    próprio driver, que entende comentários, strings e ';' dentro de valores
+    (em vez de quebrar o texto em ';'). Para na primeira instrução com erro.
+    """
+    with open(caminho, 'r', encoding='utf-8-sig') as arquivo:
+        script = arquivo.read()
+    dialeto = db.engine.dialect.name
+    conexao = db.engine.raw_connection()
+    try:
+        if dialeto == 'sqlite':
+            conexao.driver_connection.executescript(script)
+        elif dialeto == 'mysql':
+            cursor = conexao.cursor()
+            for resultado in cursor.execute(script, multi=True):
+                if resultado.with_rows:
+                    resultado.fetchall()
+            cursor.close()
+        else:
+            raise ValueError(f'Execução de scripts SQL não suportada para o banco {dialeto}.')
+        conexao.commit()
+    finally:
+        conexao.close()
@@ -0,0 +1,220 @@
+"""
+Métricas de desempenho por rota, expostas em texto do Prometheus (/metrics).
+
+Para cada requisição são medidos o tempo total, o número de instruções SQL,
+o tempo gasto no banco e as linhas devolvidas/afetadas, agrupados pelo
+endpoint do Flask em histogramas. As instruções SQL são medidas pelos
+eventos before/after_cursor_execute de todos os engines (inclusive fora de
+requisições, como nas tarefas em segundo plano, que entram só no log de
+consultas lentas).
+
+  - Linhas: o que o driver informa em cursor.rowcount. No MySQL (cursores
+    com buffer) é o número de linhas do SELECT; no SQLite, só INSERT/UPDATE/
+    DELETE informam linhas.
+  - Consultas lentas: instruções acima de SQL_LENTA_MS vão para o logger
+    'rytekshop.sql_lenta', com os parâmetros.
+  - Perfil: com PERFIL_ATIVO=1, um gerente pode acrescentar '?perfil=1' a
+    qualquer URL para receber, no lugar da página, o relatório do cProfile
+    daquela requisição.
+  - Identificação: o tempo para descobrir o usuário da requisição
+    (autenticacao.usuario_atual), separado pela origem da identidade.
+  - Rotas que respondem em fluxo (exportações) são medidas até o início da
+    resposta.
+
+Os valores são deste processo: com vários workers, cada um expõe os seus, e
+o Prometheus os soma pela label 'instance' ou pela agregação da consulta.
+"""
+import io
+import time
+import pstats
+import logging
+import cProfile
+import threading
+from collections import defaultdict
+from flask import g, request, session, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import app
+import cache
+import servidor
+
+PREFIXO = 'rytekshop'
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKETS_INSTRUCOES = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BUCKETS_LINHAS = (0, 1, 10, 100, 1000, 10000, 100000)
+BUCKETS_IDENTIFICACAO = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+LINHAS_PERFIL = 40
+
+logger_sql_lenta = logging.getLogger('rytekshop.sql_lenta')
+
+
+class Histograma:
+    """Histograma cumulativo no formato do Prometheus, com uma série por conjunto de labels."""
+
+    def __init__(self, nome, ajuda, buckets):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.buckets = buckets
+        self._series = defaultdict(lambda: [[0] * len(buckets), 0, 0.0])  # contagens, total, soma
+        self._trava = threading.Lock()
+
+    def observar(self, labels, valor):
+        with self._trava:
+            contagens, _, _ = serie = self._series[labels]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    contagens[i] += 1
+            serie[1] += 1
+            serie[2] += valor
+
+    def exposicao(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} histogram']
+        with self._trava:
+            for labels, (contagens, total, soma) in sorted(self._series.items()):
+                for limite, contagem in zip(self.buckets, contagens):
+                    linhas.append(f'{self.nome}_bucket{_labels(labels, le=limite)} {contagem}')
+                linhas.append(f'{self.nome}_bucket{_labels(labels, le="+Inf")} {total}')
+                linhas.append(f'{self.nome}_sum{_labels(labels)} {soma}')
+                linhas.append(f'{self.nome}_count{_labels(labels)} {total}')
+        return linhas
+
+
+class Contador:
+    def __init__(self, nome, ajuda):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores = defaultdict(int)
+        self._trava = threading.Lock()
+
+    def incrementar(self, labels, valor=1):
+        with self._trava:
+            self._valores[labels] += valor
+
+    def exposicao(self):
+        linhas = [f'# HELP {self.nome} {self.ajuda}', f'# TYPE {self.nome} counter']
+        with self._trava:
+            linhas += [f'{self.nome}{_labels(labels)} {valor}' for labels, valor in sorted(self._valores.items())]
+        return linhas
+
+
+def _labels(labels, **extra):
+    """(('endpoint', 'estoque'),) -> '{endpoint="estoque"}', com o escape do formato de texto."""
+    pares = list(labels) + list(extra.items())
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{chave}="{_escapar(valor)}"' for chave, valor in pares) + '}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+requisicao_segundos = Histograma(f'{PREFIXO}_requisicao_segundos', 'Tempo total da requisição, por endpoint.', BUCKETS_SEGUNDOS)
+sql_instrucoes = Histograma(f'{PREFIXO}_requisicao_sql_instrucoes', 'Instruções SQL por requisição.', BUCKETS_INSTRUCOES)
+sql_segundos = Histograma(f'{PREFIXO}_requisicao_sql_segundos', 'Tempo no banco por requisição.', BUCKETS_SEGUNDOS)
+sql_linhas = Histograma(f'{PREFIXO}_requisicao_sql_linhas', 'Linhas devolvidas/afetadas informadas pelo driver, por requisição.', BUCKETS_LINHAS)
+requisicoes = Contador(f'{PREFIXO}_requisicoes_total', 'Requisições atendidas, por endpoint, método e status.')
+consultas_lentas = Contador(f'{PREFIXO}_sql_lentas_total', 'Instruções SQL acima de SQL_LENTA_MS, por endpoint.')
+identificacao_segundos = Histograma(f'{PREFIXO}_identificacao_segundos', 'Tempo para identificar o usuário da requisição, por origem (cache, banco, anonimo, encerrada).', BUCKETS_IDENTIFICACAO)
+
+
+# =======================================================================
+# MEDIÇÃO DAS REQUISIÇÕES
+# =======================================================================
+
+@app.before_request
+def _iniciar_medicao():
+    g.metricas = {'inicio': time.perf_counter(), 'instrucoes': 0, 'sql_segundos': 0.0, 'linhas': 0}
+    if app.config['PERFIL_ATIVO'] and request.args.get('perfil') == '1' and session.get('cargo') == 'GERENTE':
+        g.perfil = cProfile.Profile()
+        g.perfil.enable()
+
+
+@app.after_request
+def _registrar_medicao(resposta):
+    medicao = g.pop('metricas', None)
+    if medicao is None:
+        return resposta
+    endpoint = request.endpoint or 'sem_rota'
+    duracao = time.perf_counter() - medicao['inicio']
+    labels = (('endpoint', endpoint),)
+    requisicao_segundos.observar(labels, duracao)
+    sql_instrucoes.observar(labels, medicao['instrucoes'])
+    sql_segundos.observar(labels, medicao['sql_segundos'])
+    sql_linhas.observar(labels, medicao['linhas'])
+    requisicoes.incrementar((('endpoint', endpoint), ('metodo', request.method), ('status', resposta.status_code)))
+    resposta.headers['Server-Timing'] = (f"app;dur={duracao * 1000:.1f}, "
+                                         f"db;dur={medicao['sql_segundos'] * 1000:.1f};desc=\"{medicao['instrucoes']} SQL\"")
+
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil.disable()
+        saida = io.StringIO()
+        pstats.Stats(perfil, stream=saida).sort_stats('cumulative').print_stats(LINHAS_PERFIL)
+        cabecalho = (f"{request.method} {request.full_path} -> {resposta.status_code} em {duracao * 1000:.1f} ms; "
+                     f"{medicao['instrucoes']} instruções SQL, {medicao['sql_segundos'] * 1000:.1f} ms no banco\n\n")
+        return app.response_class(cabecalho + saida.getvalue(), mimetype='text/plain')
+    return resposta
+
+
+# =======================================================================
+# MEDIÇÃO DAS INSTRUÇÕES SQL
+# =======================================================================
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_da_instrucao(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metricas_inicio', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_da_instrucao(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('metricas_inicio')
+    if not inicios:
+        return
+    duracao = time.perf_counter() - inicios.pop()
+    em_requisicao = has_request_context() and 'metricas' in g
+    if em_requisicao:
+        medicao = g.metricas
+        medicao['instrucoes'] += 1
+        medicao['sql_segundos'] += duracao
+        medicao['linhas'] += max(cursor.rowcount, 0)
+    if duracao * 1000 >= app.config['SQL_LENTA_MS']:
+        endpoint = (request.endpoint or 'sem_rota') if has_request_context() else 'tarefa'
+        consultas_lentas.incrementar((('endpoint', endpoint),))
+        logger_sql_lenta.warning('SQL lenta (%.1f ms) em %s: %s | parâmetros: %.500r',
+                                 duracao * 1000, endpoint, ' '.join(statement.split()), parameters)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _erro_na_instrucao(contexto):
+    # Instrução que falhou: não passa pelo after_cursor_execute.
+    if contexto.connection is not None and contexto.connection.info.get('metricas_inicio'):
+        contexto.connection.info['metricas_inicio'].pop()
+
+
+# =======================================================================
+# EXPOSIÇÃO
+# =======================================================================
+
+def exposicao():
+    """Todas as métricas no formato de texto do Prometheus (versão 0.0.4)."""
+    linhas = []
+    for metrica in (requisicao_segundos, sql_instrucoes, sql_segundos, sql_linhas, requisicoes, consultas_lentas,
+                    identificacao_segundos):
+        linhas += metrica.exposicao()
+    pool = servidor.estado_pool()
+    if pool['tamanho'] is not None:
+        linhas += [f'# HELP {PREFIXO}_pool_conexoes Conexões do pool do banco neste processo, por estado.',
+                   f'# TYPE {PREFIXO}_pool_conexoes gauge']
+        linhas += [f'{PREFIXO}_pool_conexoes{_labels((("estado", estado),))} {pool[estado]}'
+                   for estado in ('em_uso', 'livres')]
+        linhas += [f'# HELP {PREFIXO}_pool_saturacao Fração do pool (tamanho + extra) em uso.',
+                   f'# TYPE {PREFIXO}_pool_saturacao gauge', f"{PREFIXO}_pool_saturacao {pool['saturacao'] or 0}"]
+    estatisticas = cache.dados.estatisticas()
+    for nome, chave, ajuda in (('acertos', 'acertos', 'Acertos do cache de leitura, por região.'),
+                               ('faltas', 'faltas', 'Faltas do cache de leitura, por região.')):
+        linhas += [f'# HELP {PREFIXO}_cache_{nome}_total {ajuda}', f'# TYPE {PREFIXO}_cache_{nome}_total counter']
+        linhas += [f'{PREFIXO}_cache_{nome}_total{_labels((("regiao", regiao),))} {valores[chave]}'
+                   for regiao, valores in estatisticas.items()]
+    return '\n'.join(linhas) + '\n'
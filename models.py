@@ -39,6 +39,8 @@ class Cliente(db.Model):
     __tablename__ = 'CLIENTE'
     id_cliente = db.Column(db.Integer, primary_key=True, autoincrement=True)
     nome = db.Column(db.String(100), nullable=False)
+    # Nome em minúsculas, sem acentos e sem pontuação (busca.normalizar).
+    nome_busca = db.Column(db.String(100), nullable=True, index=True)
     cpf = db.Column(db.String(14), nullable=False, unique=True)
     telefone = db.Column(db.String(20), nullable=True) # Corrigido: Campo adicionado
     id_endereco = db.Column(db.Integer, db.ForeignKey('ENDERECO.id_endereco'), nullable=False)
@@ -50,24 +52,48 @@ class Estoque(db.Model):
     id_estoque = db.Column(db.Integer, primary_key=True, autoincrement=True)
     quantidade_produto = db.Column(db.Integer, default=0)
     min_produto = db.Column(db.Integer, default=1)
+    # Calculada pelo banco a cada escrita em quantidade_produto/min_produto
+    # (coluna gerada e gravada), por isso vale para qualquer caminho que mexa
+    # no estoque. Indexada: a lista de estoque baixo lê só as linhas marcadas.
+    abaixo_minimo = db.Column(db.Boolean, db.Computed('quantidade_produto <= min_produto', persisted=True), index=True)
+    # Incrementada a cada escrita em quantidade_produto. A contagem de estoque
+    # (movimentacoes.ajustar_quantidades) só grava se a versão ainda for a que
+    # o usuário viu na tela, em vez de sobrescrever a alteração de outra pessoa.
+    versao = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     last_alert = db.Column(db.DateTime, nullable=True)
 
 class Produto(db.Model):
     __tablename__ = 'PRODUTO'
+    __table_args__ = (
+        # Busca por palavras (busca.py). No SQLite o índice de texto é a
+        # tabela FTS5 PRODUTO_BUSCA, criada junto com esta tabela.
+        db.Index('ft_produto_nome_busca', 'nome_busca', mysql_prefix='FULLTEXT').ddl_if(dialect='mysql'),
+    )
     id_produto = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    nome = db.Column(db.String(200), nullable=False)
+    nome = db.Column(db.String(200), nullable=False, index=True)
+    # Nome em minúsculas, sem acentos e sem pontuação (busca.normalizar).
+    nome_busca = db.Column(db.String(200), nullable=True, index=True)
     descricao = db.Column(db.Text)
     preco = db.Column(db.Numeric(10, 2), default=0.00)
     preco_promocional = db.Column(db.Numeric(10, 2), nullable=True)
     id_categoria = db.Column(db.Integer, db.ForeignKey('CATEGORIA.id_categoria'), nullable=False)
     fornecedor_id = db.Column(db.Integer, db.ForeignKey('FORNECEDOR.id_fornecedor'))
-    estoque_id = db.Column(db.Integer, db.ForeignKey('ESTOQUE.id_estoque'), nullable=False)
+    estoque_id = db.Column(db.Integer, db.ForeignKey('ESTOQUE.id_estoque'), nullable=False, index=True)
+    ultima_venda = db.Column(db.DateTime, nullable=True, index=True)
     categoria = db.relationship('Categoria')
     fornecedor = db.relationship('Fornecedor')
     estoque = db.relationship('Estoque', uselist=False)
 
+class Indicador(db.Model):
+    # Contadores acumulados do dashboard (ex.: 'total_vendas'), atualizados
+    # a cada escrita e recalculados por 'flask reconciliar-indicadores'.
+    __tablename__ = 'INDICADOR'
+    chave = db.Column(db.String(50), primary_key=True)
+    valor = db.Column(db.Numeric(16, 2), nullable=False, default=0)
+
 class Venda(db.Model):
     __tablename__ = 'VENDA'
+    __table_args__ = (db.Index('ix_venda_data_compra', 'data_compra', 'id_venda'),)
     id_venda = db.Column(db.Integer, primary_key=True, autoincrement=True)
     data_compra = db.Column(db.DateTime, nullable=False)
     valor_total = db.Column(db.Numeric(12, 2), default=0.00)
@@ -77,10 +103,21 @@ class Venda(db.Model):
     pagamento = db.relationship('Pagamento')
     itens = db.relationship('ProdutoVenda', back_populates='venda')
 
+class VendaMensal(db.Model):
+    # Total de vendas pré-agregado por mês, mantido por nova_venda e
+    # reconstruído por 'flask reconstruir-vendas-mensais'.
+    __tablename__ = 'VENDAS_MENSAIS'
+    ano = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    mes = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    valor_total = db.Column(db.Numeric(14, 2), nullable=False, default=0.00)
+    quantidade_vendas = db.Column(db.Integer, nullable=False, default=0)
+
 class ProdutoVenda(db.Model):
     __tablename__ = 'PRODUTO_VENDA'
     id_produto = db.Column(db.Integer, db.ForeignKey('PRODUTO.id_produto'), primary_key=True)
-    id_venda = db.Column(db.Integer, db.ForeignKey('VENDA.id_venda'), primary_key=True)
+    # Indexada à parte: a chave primária começa por id_produto e não serve
+    # para buscar os itens de uma venda.
+    id_venda = db.Column(db.Integer, db.ForeignKey('VENDA.id_venda'), primary_key=True, index=True)
     quantidade = db.Column(db.Integer, default=1)
     preco_unitario = db.Column(db.Numeric(10, 2), nullable=False)
     produto = db.relationship('Produto')
@@ -88,9 +125,14 @@ class ProdutoVenda(db.Model):
 
 class PedidoFornecedor(db.Model):
     __tablename__ = 'PEDIDO_FORNECEDOR'
+    __table_args__ = (db.Index('ix_pedido_fornecedor_data_pedido', 'data_pedido', 'id_pedido'),)
     id_pedido = db.Column(db.Integer, primary_key=True, autoincrement=True)
     id_fornecedor = db.Column(db.Integer, db.ForeignKey('FORNECEDOR.id_fornecedor'), nullable=False)
-    data_pedido = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Obrigatória: a paginação por cursor (data, id) não alcança linhas sem data.
+    # Bancos antigos: UPDATE PEDIDO_FORNECEDOR SET data_pedido = '1970-01-01' WHERE data_pedido IS NULL,
+    # e ALTER TABLE PEDIDO_FORNECEDOR MODIFY data_pedido DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP.
+    data_pedido = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp(),
+                            server_default=db.func.current_timestamp())
     status = db.Column(db.String(50), default='Pendente')
     fornecedor = db.relationship('Fornecedor')
     itens = db.relationship('PedidoProduto', back_populates='pedido')
@@ -106,21 +148,43 @@ class PedidoProduto(db.Model):
 
 class Mensagem(db.Model):
     __tablename__ = 'MENSAGEM'
+    __table_args__ = (db.Index('ix_mensagem_data_envio', 'data_envio', 'id'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     fornecedor_id = db.Column(db.Integer, db.ForeignKey('FORNECEDOR.id_fornecedor'))
     produto_id = db.Column(db.Integer, db.ForeignKey('PRODUTO.id_produto'))
     conteudo = db.Column(db.String(2000))
-    data_envio = db.Column(db.DateTime, default=db.func.current_timestamp())
+    # Obrigatória, como PedidoFornecedor.data_pedido (mesma migração para bancos antigos).
+    data_envio = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp(),
+                           server_default=db.func.current_timestamp())
     status = db.Column(db.String(50), default='pendente')
+    fornecedor = db.relationship('Fornecedor')
+    produto = db.relationship('Produto')
 
 class MovimentacaoEstoque(db.Model):
+    """
+    Razão do estoque: só recebe inserções (ver movimentacoes.py). A quantidade
+    é positiva em ENTRADA e SAÍDA (o tipo dá o sinal) e com sinal nos ajustes.
+    """
     __tablename__ = 'MOVIMENTACAO_ESTOQUE'
+    __table_args__ = (
+        db.Index('ix_movimentacao_estoque_data', 'data_movimentacao', 'id_mov'),
+        # Saldo de um produto numa data: a partir do último snapshot, só as
+        # movimentações do produto depois dele.
+        db.Index('ix_movimentacao_estoque_produto_data', 'id_produto', 'data_movimentacao'),
+    )
     id_mov = db.Column(db.Integer, primary_key=True, autoincrement=True)
     id_produto = db.Column(db.Integer, db.ForeignKey('PRODUTO.id_produto'), nullable=False)
     id_usuario = db.Column(db.Integer, db.ForeignKey('CONTA.id_conta'))
     tipo = db.Column(db.String(50), nullable=False)
     quantidade = db.Column(db.Integer, nullable=False)
-    data_movimentacao = db.Column(db.DateTime, default=db.func.current_timestamp())
+    data_movimentacao = db.Column(db.DateTime, nullable=False, default=db.func.current_timestamp())
     observacao = db.Column(db.String(255))
     produto = db.relationship('Produto')
-    usuario = db.relationship('Usuario')
\ No newline at end of file
+    usuario = db.relationship('Usuario')
+
+class EstoqueSnapshot(db.Model):
+    """Quantidade de cada produto numa data de corte, calculada a partir do razão (MOVIMENTACAO_ESTOQUE)."""
+    __tablename__ = 'ESTOQUE_SNAPSHOT'
+    data_snapshot = db.Column(db.DateTime, primary_key=True)
+    id_produto = db.Column(db.Integer, db.ForeignKey('PRODUTO.id_produto'), primary_key=True)
+    quantidade = db.Column(db.Integer, nullable=False)
\ No newline at end of file
@@ -0,0 +1,290 @@
+"""
+Razão do estoque: MOVIMENTACAO_ESTOQUE como fonte da verdade.
+
+Toda alteração de quantidade em ESTOQUE é acompanhada, na mesma transação,
+de uma movimentação (venda, recebimento, ajuste manual, cadastro e
+importação de produtos). As movimentações só são inseridas, nunca alteradas
+ou apagadas; um erro se corrige com outra movimentação de ajuste.
+ESTOQUE.quantidade_produto é o saldo atual já somado, mantido para as
+consultas do dia a dia.
+
+  - Sinal: SAÍDA subtrai a quantidade; os demais tipos somam (ENTRADA e
+    SALDO INICIAL são positivos, os ajustes têm sinal).
+  - Snapshots: ESTOQUE_SNAPSHOT guarda o saldo de cada produto no início de
+    cada mês (gerar_snapshot, pelo agendador ou por 'flask
+    gerar-snapshot-estoque'). O saldo numa data é o do último snapshot
+    anterior a ela mais as movimentações entre os dois, lidas pelo índice
+    (id_produto, data_movimentacao), sem percorrer o razão inteiro.
+  - Verificação: 'flask verificar-estoque' compara ESTOQUE com o razão.
+  - Contagem: ajustar_quantidades grava as quantidades contadas de vários
+    produtos de uma vez, com controle de concorrência otimista pela coluna
+    ESTOQUE.versao, que toda escrita em quantidade_produto incrementa.
+  - Particionamento (opcional, MySQL): 'flask particionar-movimentacoes'
+    particiona MOVIMENTACAO_ESTOQUE por mês e cria as partições dos próximos
+    meses. Tabelas particionadas do InnoDB não aceitam chaves estrangeiras,
+    então as da tabela são removidas.
+
+As datas de corte seguem o relógio do banco, o mesmo que preenche
+data_movimentacao.
+"""
+from datetime import datetime, timedelta
+from sqlalchemy import func, and_, literal, text
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import Produto, Estoque, MovimentacaoEstoque, EstoqueSnapshot
+import eventos
+
+TIPO_SALDO_INICIAL = 'SALDO INICIAL'
+TIPO_AJUSTE_IMPORTACAO = 'AJUSTE IMPORTAÇÃO'
+TIPO_AJUSTE_RECONCILIACAO = 'AJUSTE RECONCILIAÇÃO'
+TIPO_AJUSTE_MANUAL = 'AJUSTE MANUAL'
+TIPOS_SAIDA = ('SAÍDA',)
+# Um snapshot só é gerado depois desta folga após o corte, para não deixar
+# de fora movimentações de transações que ainda estavam abertas no corte.
+FOLGA_SNAPSHOT = timedelta(minutes=10)
+PARTICAO_FUTURA = 'pfuturo'
+
+
+def variacao():
+    """Quantidade com sinal de cada movimentação (expressão SQL)."""
+    return db.case(
+        (MovimentacaoEstoque.tipo.in_(TIPOS_SAIDA), -MovimentacaoEstoque.quantidade),
+        else_=MovimentacaoEstoque.quantidade,
+    )
+
+
+def agora_no_banco():
+    return db.session.scalar(db.select(func.current_timestamp()))
+
+
+def inicio_do_mes(data):
+    return datetime(data.year, data.month, 1)
+
+
+def ultimo_snapshot(ate=None):
+    """Data do snapshot mais recente (até 'ate', inclusive), ou None."""
+    stmt = db.select(func.max(EstoqueSnapshot.data_snapshot))
+    if ate is not None:
+        stmt = stmt.where(EstoqueSnapshot.data_snapshot <= ate)
+    return db.session.scalar(stmt)
+
+
+def consulta_saldos(ate=None, usar_snapshot=True):
+    """
+    SELECT (id_produto, quantidade) com o saldo de cada produto em 'ate'
+    (None = agora). Com usar_snapshot=False, soma o razão inteiro.
+    """
+    corte = ultimo_snapshot(ate) if usar_snapshot else None
+    deltas = db.select(
+        MovimentacaoEstoque.id_produto, func.sum(variacao()).label('delta')
+    ).group_by(MovimentacaoEstoque.id_produto)
+    if corte is not None:
+        deltas = deltas.where(MovimentacaoEstoque.data_movimentacao > corte)
+    if ate is not None:
+        deltas = deltas.where(MovimentacaoEstoque.data_movimentacao <= ate)
+    deltas = deltas.subquery()
+
+    stmt = db.select(Produto.id_produto).outerjoin(deltas, deltas.c.id_produto == Produto.id_produto)
+    if corte is None:
+        return stmt.add_columns(func.coalesce(deltas.c.delta, 0).label('quantidade'))
+    return stmt.outerjoin(EstoqueSnapshot, and_(
+        EstoqueSnapshot.id_produto == Produto.id_produto, EstoqueSnapshot.data_snapshot == corte
+    )).add_columns(
+        (func.coalesce(EstoqueSnapshot.quantidade, 0) + func.coalesce(deltas.c.delta, 0)).label('quantidade')
+    )
+
+
+def estoque_em(data, ids_produto=None):
+    """{id_produto: quantidade} em 'data', pelo razão."""
+    stmt = consulta_saldos(data)
+    if ids_produto is not None:
+        stmt = stmt.where(Produto.id_produto.in_(list(ids_produto)))
+    return {id_produto: int(quantidade) for id_produto, quantidade in db.session.execute(stmt)}
+
+
+def gerar_snapshot(corte=None):
+    """
+    Grava o saldo de todos os produtos em 'corte' (padrão: início do mês
+    corrente), com um único INSERT ... SELECT a partir do snapshot anterior.
+    Devolve o número de linhas gravadas, ou 0 se o snapshot já existia ou o
+    corte ainda está dentro da folga. Não faz commit.
+    """
+    agora = agora_no_banco()
+    corte = corte or inicio_do_mes(agora)
+    if corte > agora - FOLGA_SNAPSHOT:
+        return 0
+    if db.session.scalar(db.select(EstoqueSnapshot.data_snapshot).where(EstoqueSnapshot.data_snapshot == corte).limit(1)):
+        return 0
+    saldos = consulta_saldos(corte).subquery()
+    try:
+        with db.session.begin_nested():
+            resultado = db.session.execute(db.insert(EstoqueSnapshot).from_select(
+                ['data_snapshot', 'id_produto', 'quantidade'],
+                db.select(literal(corte, EstoqueSnapshot.data_snapshot.type), saldos.c.id_produto, saldos.c.quantidade)
+            ))
+    except IntegrityError:
+        # Outro processo gerou o mesmo snapshot ao mesmo tempo.
+        return 0
+    return resultado.rowcount
+
+
+def divergencias(usar_snapshot=True):
+    """Produtos cujo ESTOQUE.quantidade_produto difere do saldo do razão: [(id_produto, nome, id_estoque, estoque, razao)]."""
+    saldos = consulta_saldos(usar_snapshot=usar_snapshot).subquery()
+    estoque = func.coalesce(Estoque.quantidade_produto, 0)
+    return db.session.execute(
+        db.select(Produto.id_produto, Produto.nome, Estoque.id_estoque, estoque.label('estoque'), saldos.c.quantidade.label('razao'))
+        .join(Estoque, Produto.estoque_id == Estoque.id_estoque)
+        .join(saldos, saldos.c.id_produto == Produto.id_produto)
+        .where(estoque != saldos.c.quantidade)
+        .order_by(Produto.id_produto)
+    ).all()
+
+
+def ajustar_movimentacoes(linhas, tipo=TIPO_AJUSTE_RECONCILIACAO, observacao='Ajuste do razão ao estoque'):
+    """Insere, para cada divergência, a movimentação que leva o razão à quantidade de ESTOQUE. Não faz commit."""
+    movimentacoes = [
+        {'id_produto': linha.id_produto, 'id_usuario': None, 'tipo': tipo,
+         'quantidade': linha.estoque - linha.razao, 'observacao': observacao}
+        for linha in linhas
+    ]
+    if movimentacoes:
+        db.session.execute(db.insert(MovimentacaoEstoque), movimentacoes)
+
+
+def ajustar_estoque(linhas):
+    """Grava em ESTOQUE o saldo do razão de cada divergência. Devolve a variação do estoque total. Não faz commit."""
+    if linhas:
+        db.session.execute(
+            db.update(Estoque).where(Estoque.id_estoque.in_([linha.id_estoque for linha in linhas]))
+            .values(quantidade_produto=db.case({linha.id_estoque: linha.razao for linha in linhas}, value=Estoque.id_estoque),
+                    versao=Estoque.versao + 1)
+            .execution_options(synchronize_session=False)
+        )
+    return sum(linha.razao - linha.estoque for linha in linhas)
+
+
+def incrementar_versoes(ids_estoque):
+    """ESTOQUE.versao + 1 nos estoques informados, para escritas por chave primária (executemany). Não faz commit."""
+    if ids_estoque:
+        db.session.execute(
+            db.update(Estoque).where(Estoque.id_estoque.in_(list(ids_estoque)))
+            .values(versao=Estoque.versao + 1).execution_options(synchronize_session=False)
+        )
+
+
+class ConflitoDeVersao(RuntimeError):
+    """Um estoque mudou de versão entre a leitura e o UPDATE da contagem; a transação deve ser desfeita."""
+
+
+def ajustar_quantidades(itens, id_usuario, observacao):
+    """
+    Grava as quantidades contadas de vários produtos na mesma transação.
+    'itens' é {id_produto: (quantidade, versão esperada)}; com versão None, a
+    quantidade é gravada qualquer que seja a versão atual.
+
+    Os estoques são lidos e travados (FOR UPDATE) numa só consulta; os que
+    ainda estão na versão esperada são gravados com um único UPDATE ... CASE,
+    que também confere a versão, e as movimentações de ajuste vão num só
+    INSERT. Devolve ({id_produto: {'status', 'quantidade', 'versao'}},
+    variação do estoque total), com status 'ok', 'conflito' (a versão atual
+    e a quantidade atual vão na resposta) ou 'nao_encontrado'. Não faz commit.
+    """
+    atuais = db.session.execute(
+        db.select(Produto.id_produto, Produto.nome, Estoque.id_estoque, Estoque.quantidade_produto, Estoque.versao,
+                  Estoque.min_produto)
+        .join(Estoque, Produto.estoque_id == Estoque.id_estoque)
+        .where(Produto.id_produto.in_(list(itens)))
+        .order_by(Estoque.id_estoque).with_for_update()
+    ).all()
+
+    resultados, novas, versoes, ajustes, alterados = {}, {}, {}, [], []
+    for linha in atuais:
+        quantidade, versao_esperada = itens[linha.id_produto]
+        atual = linha.quantidade_produto or 0
+        if (versao_esperada is not None and versao_esperada != linha.versao) or linha.id_estoque in novas:
+            resultados[linha.id_produto] = {'status': 'conflito', 'quantidade': atual, 'versao': linha.versao}
+        elif quantidade == atual:
+            resultados[linha.id_produto] = {'status': 'ok', 'quantidade': atual, 'versao': linha.versao}
+        else:
+            novas[linha.id_estoque] = quantidade
+            versoes[linha.id_estoque] = linha.versao
+            resultados[linha.id_produto] = {'status': 'ok', 'quantidade': quantidade, 'versao': linha.versao + 1}
+            ajustes.append({'id_produto': linha.id_produto, 'id_usuario': id_usuario, 'tipo': TIPO_AJUSTE_MANUAL,
+                            'quantidade': quantidade - atual, 'observacao': observacao})
+            alterados.append(eventos.item_estoque(linha.id_produto, linha.nome, quantidade, linha.versao + 1,
+                                                  linha.min_produto, quantidade - atual))
+    for id_produto in itens.keys() - resultados.keys():
+        resultados[id_produto] = {'status': 'nao_encontrado', 'quantidade': None, 'versao': None}
+
+    if novas:
+        resultado = db.session.execute(
+            db.update(Estoque).where(
+                Estoque.id_estoque.in_(list(novas)), Estoque.versao == db.case(versoes, value=Estoque.id_estoque)
+            ).values(quantidade_produto=db.case(novas, value=Estoque.id_estoque), versao=Estoque.versao + 1)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount != len(novas):
+            # Só acontece em bancos sem FOR UPDATE (SQLite): outra escrita entre a leitura e o UPDATE.
+            raise ConflitoDeVersao('O estoque foi alterado durante a gravação.')
+        db.session.execute(db.insert(MovimentacaoEstoque), ajustes)
+        eventos.apos_commit(eventos.TIPO_ESTOQUE, {'itens': alterados})
+    return resultados, sum(ajuste['quantidade'] for ajuste in ajustes)
+
+
+# =======================================================================
+# PARTICIONAMENTO (MySQL)
+# =======================================================================
+
+def _particao(mes):
+    return f'p{mes:%Y%m}', f"VALUES LESS THAN ('{_proximo_mes(mes):%Y-%m-%d}')"
+
+
+def _proximo_mes(mes):
+    return (mes.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def ddl_particionamento(meses_a_frente=3):
+    """
+    Instruções para particionar MOVIMENTACAO_ESTOQUE por mês, do mês da
+    movimentação mais antiga até 'meses_a_frente' meses depois do atual, ou,
+    se a tabela já estiver particionada, para criar as partições que faltam.
+    """
+    tabela = MovimentacaoEstoque.__tablename__
+    existentes = set(db.session.scalars(text(
+        "SELECT PARTITION_NAME FROM information_schema.PARTITIONS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabela AND PARTITION_NAME IS NOT NULL"
+    ), {'tabela': tabela}))
+
+    agora = agora_no_banco()
+    primeiro = inicio_do_mes(db.session.scalar(db.select(func.min(MovimentacaoEstoque.data_movimentacao))) or agora)
+    ultimo = inicio_do_mes(agora)
+    for _ in range(meses_a_frente):
+        ultimo = _proximo_mes(ultimo)
+    meses, mes = [], primeiro
+    while mes <= ultimo:
+        meses.append(mes)
+        mes = _proximo_mes(mes)
+
+    futura = f'PARTITION {PARTICAO_FUTURA} VALUES LESS THAN (MAXVALUE)'
+    if existentes:
+        ultima = max((datetime.strptime(nome[1:], '%Y%m') for nome in existentes if nome != PARTICAO_FUTURA),
+                     default=datetime.min)
+        novas = [_particao(mes) for mes in meses if mes > ultima]
+        if not novas:
+            return []
+        return [f"ALTER TABLE {tabela} REORGANIZE PARTITION {PARTICAO_FUTURA} INTO ("
+                + ', '.join([f'PARTITION {nome} {limite}' for nome, limite in novas] + [futura]) + ')']
+
+    chaves = db.session.scalars(text(
+        "SELECT CONSTRAINT_NAME FROM information_schema.TABLE_CONSTRAINTS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :tabela AND CONSTRAINT_TYPE = 'FOREIGN KEY'"
+    ), {'tabela': tabela}).all()
+    return (
+        [f'ALTER TABLE {tabela} DROP FOREIGN KEY {chave}' for chave in chaves]
+        # A coluna de partição precisa fazer parte da chave primária.
+        + [f'ALTER TABLE {tabela} DROP PRIMARY KEY, ADD PRIMARY KEY (id_mov, data_movimentacao)',
+           f"ALTER TABLE {tabela} PARTITION BY RANGE COLUMNS (data_movimentacao) ("
+           + ', '.join([f'PARTITION {nome} {limite}' for nome, limite in map(_particao, meses)] + [futura]) + ')']
+    )
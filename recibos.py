@@ -0,0 +1,145 @@
+"""
+Recibos das vendas, gerados uma vez e servidos do disco.
+
+Uma venda não muda depois do commit de nova_venda. Na primeira vez que o
+detalhe ou o recibo de uma venda é aberto, os dados dela (cliente, itens e
+preços cobrados) são lidos do banco e gravados em RECIBOS_DIR/<id_venda>.json,
+junto com o recibo para impressão já renderizado (<id_venda>.html). Daí em
+diante:
+
+  - o detalhe e o recibo são montados a partir desse arquivo, sem consultar
+    o banco (e, no mesmo processo, sem ler o disco: os últimos
+    RECIBOS_EM_MEMORIA recibos ficam em memória);
+  - o ETag das respostas é o hash do conteúdo, então reabrir ou reimprimir
+    um recibo no mesmo navegador custa um 304, sem renderizar a página;
+  - o recibo para impressão é um arquivo estático, enviado do disco em
+    fluxo, com Cache-Control immutable. Para PDF, use "Salvar como PDF" na
+    janela de impressão do navegador.
+
+O recibo mostra o nome do produto e do cliente como estavam na primeira
+leitura, como um recibo impresso. Apagar RECIBOS_DIR só faz os recibos serem
+gerados de novo.
+"""
+import os
+import json
+import hashlib
+import logging
+from decimal import Decimal
+from datetime import datetime
+from flask import g, request, render_template, send_file
+
+from app import app, db
+from models import Venda
+import cache
+import consultas
+
+RECIBOS_EM_MEMORIA = 512
+# Um ano: o conteúdo do arquivo para impressão nunca muda.
+MAX_AGE_IMPRESSAO = 365 * 24 * 3600
+
+logger = logging.getLogger(__name__)
+
+_memoria = cache.CacheLRU(tamanho_maximo=RECIBOS_EM_MEMORIA, ttl=24 * 3600)
+
+
+def _caminho(id_venda, extensao):
+    return os.path.join(app.config['RECIBOS_DIR'], f'{int(id_venda)}.{extensao}')
+
+
+def _gravar(caminho, conteudo):
+    """Grava por um arquivo temporário e os.replace, para que um leitor nunca veja um arquivo pela metade."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f'{caminho}.{os.getpid()}.tmp'
+    with open(temporario, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, caminho)
+
+
+def _ler_do_banco(id_venda):
+    venda = db.session.get(Venda, id_venda, options=consultas.DETALHE_VENDA)
+    if venda is None:
+        return None
+    return {
+        'id_venda': venda.id_venda,
+        'data_compra': venda.data_compra.isoformat(),
+        'valor_total': str(venda.valor_total),
+        'cliente': {'nome': venda.cliente.nome, 'cpf': venda.cliente.cpf},
+        'itens': [{'produto': {'nome': item.produto.nome}, 'quantidade': item.quantidade,
+                   'preco_unitario': str(item.preco_unitario)} for item in venda.itens],
+    }
+
+
+def _para_template(dados):
+    """Os dados gravados, com datas e valores de volta aos tipos que os templates usam."""
+    venda = dict(dados, data_compra=datetime.fromisoformat(dados['data_compra']), valor_total=Decimal(dados['valor_total']))
+    venda['itens'] = [dict(item, preco_unitario=Decimal(item['preco_unitario'])) for item in dados['itens']]
+    return venda
+
+
+def obter(id_venda):
+    """{'venda': dados para os templates, 'etag': hash do conteúdo} da venda, ou None se ela não existe."""
+    recibo = _memoria.obter(id_venda)
+    if recibo is not None:
+        return recibo
+    caminho = _caminho(id_venda, 'json')
+    try:
+        with open(caminho, 'rb') as arquivo:
+            conteudo = arquivo.read()
+    except FileNotFoundError:
+        dados = _ler_do_banco(id_venda)
+        if dados is None:
+            return None
+        conteudo = json.dumps(dados, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        venda = _para_template(dados)
+        impressao = render_template('recibo_impressao.html', venda=venda).encode('utf-8')
+        try:
+            # O HTML antes do JSON: quem acha o JSON já acha o arquivo para impressão.
+            _gravar(_caminho(id_venda, 'html'), impressao)
+            _gravar(caminho, conteudo)
+        except OSError:
+            logger.warning('Não foi possível gravar o recibo da venda %s em %s', id_venda, app.config['RECIBOS_DIR'], exc_info=True)
+    else:
+        venda = _para_template(json.loads(conteudo))
+    recibo = {'venda': venda, 'etag': hashlib.blake2b(conteudo, digest_size=12).hexdigest()}
+    _memoria.gravar(id_venda, recibo)
+    return recibo
+
+
+def pagina(id_venda, template):
+    """
+    Página (detalhe ou recibo) da venda, ou None se ela não existe. Responde
+    304 sem renderizar quando o navegador já tem a página. O ETag inclui o
+    usuário, porque a barra de navegação mostra o login dele.
+    """
+    recibo = obter(id_venda)
+    if recibo is None:
+        return None
+    etag = f"{recibo['etag']}-{g.usuario.id_conta}"
+    if request.if_none_match.contains_weak(etag):
+        resposta = app.response_class(status=304)
+    else:
+        resposta = app.response_class(render_template(template, venda=recibo['venda']))
+    # Fraco: o conteúdo é o mesmo, mas o HTML em volta muda com o template.
+    resposta.set_etag(etag, weak=True)
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
+
+
+def arquivo_para_impressao(id_venda):
+    """Resposta com o recibo para impressão, enviado do disco, ou None se a venda não existe."""
+    recibo = obter(id_venda)
+    if recibo is None:
+        return None
+    caminho = _caminho(id_venda, 'html')
+    if not os.path.exists(caminho):
+        # Sem disco gravável: renderiza a partir dos dados em memória.
+        resposta = app.response_class(render_template('recibo_impressao.html', venda=recibo['venda']))
+        resposta.cache_control.private = True
+        resposta.cache_control.no_cache = True
+        return resposta
+    resposta = send_file(caminho, mimetype='text/html', conditional=True, etag=recibo['etag'], max_age=MAX_AGE_IMPRESSAO)
+    resposta.cache_control.private = True
+    resposta.cache_control.public = False
+    resposta.cache_control.immutable = True
+    return resposta
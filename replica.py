@@ -0,0 +1,156 @@
+"""
+Réplica de leitura para relatórios e listagens.
+
+Com REPLICA_DATABASE_URL definida, as rotas marcadas com @leitura_na_replica
+(dashboard, /api/relatorios/*, /vendas, /historico, /export/*) e as
+exportações em segundo plano leem da réplica, tirando as varreduras pesadas
+do banco principal, onde o caixa grava as vendas. O resto continua no
+principal.
+
+  - Só SELECTs vão para a réplica; flush, INSERT/UPDATE/DELETE e SELECT ...
+    FOR UPDATE vão sempre para o principal, mesmo dentro dessas rotas.
+  - Atraso: a cada REPLICA_VERIFICAR_SEGUNDOS o atraso da réplica é medido
+    (no MySQL, Seconds_Behind_Source de SHOW REPLICA STATUS), por uma thread
+    de cada vez, com a conexão limitada a REPLICA_CONEXAO_SEGUNDOS. Acima de
+    REPLICA_ATRASO_MAXIMO segundos, com a replicação parada ou com a réplica
+    fora do ar, as leituras voltam para o principal até ela se recuperar.
+    Bancos sem status de replicação (ex.: duas bases SQLite locais) são
+    considerados em dia.
+  - Ler o que acabou de gravar: a requisição que grava no principal fixa o
+    usuário no principal por REPLICA_ATRASO_MAXIMO segundos (na sessão do
+    Flask), então a lista de vendas logo depois de uma venda já mostra a
+    venda, mesmo que a réplica ainda não a tenha recebido. O recibo, para
+    onde a venda redireciona, não é marcado e lê sempre do principal.
+
+Os gráficos do dashboard passam pelo cache (cache.py): um valor lido da
+réplica pode ficar até REPLICA_ATRASO_MAXIMO + CACHE_TTL segundos atrás do
+principal.
+"""
+import time
+import logging
+import threading
+from functools import wraps
+from flask import g, session, has_app_context, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import Select, text, make_url
+from sqlalchemy.sql.dml import UpdateBase
+
+from app import app
+
+BIND_REPLICA = 'replica'
+
+logger = logging.getLogger(__name__)
+
+_trava = threading.Lock()
+_ultima_verificacao = {'em': None, 'atraso': None, 'medindo': False}
+
+
+class SessaoRoteada(Session):
+    """Sessão do Flask-SQLAlchemy que manda os SELECTs para a réplica quando g.usar_replica está ligado."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and has_app_context() and g.get('usar_replica') and not self._flushing
+                and isinstance(clause, Select) and clause._for_update_arg is None):
+            return self._db.engines[BIND_REPLICA]
+        if has_request_context() and (self._flushing or isinstance(clause, UpdateBase)):
+            g.escreveu_no_primario = True
+        return super().get_bind(mapper, clause, bind, **kwargs)
+
+
+# Nome do parâmetro de tempo limite de conexão em cada driver.
+_TEMPO_LIMITE_CONEXAO = {
+    'mysqlconnector': 'connection_timeout',
+    'pymysql': 'connect_timeout',
+    'mysqldb': 'connect_timeout',
+    'psycopg2': 'connect_timeout',
+}
+
+
+def opcoes_de_conexao(url, segundos):
+    """connect_args do engine da réplica com o tempo limite de conexão do driver de 'url'."""
+    parametro = _TEMPO_LIMITE_CONEXAO.get(make_url(url).get_driver_name())
+    return {parametro: segundos} if parametro and segundos > 0 else {}
+
+
+def configurada():
+    return bool(app.config['REPLICA_DATABASE_URL'])
+
+
+def _medir_atraso():
+    """Atraso da réplica em segundos; None se a replicação estiver parada ou a réplica fora do ar."""
+    motor = app.extensions['sqlalchemy'].engines[BIND_REPLICA]
+    try:
+        with motor.connect() as conexao:
+            if motor.dialect.name != 'mysql':
+                conexao.execute(text('SELECT 1'))
+                return 0.0
+            try:
+                status = conexao.execute(text('SHOW REPLICA STATUS')).mappings().first()
+            except Exception:
+                # Antes do MySQL 8.0.22 (e no MariaDB) o comando tem o nome antigo.
+                status = conexao.execute(text('SHOW SLAVE STATUS')).mappings().first()
+    except Exception:
+        logger.warning('Réplica de leitura indisponível; lendo do banco principal', exc_info=True)
+        return None
+    if status is None:
+        return 0.0
+    atraso = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if atraso is None else float(atraso)
+
+
+def atraso():
+    """
+    Último atraso medido (ver _medir_atraso), medido de novo a cada
+    REPLICA_VERIFICAR_SEGUNDOS. A medição roda fora da trava, numa só thread
+    por vez: as demais seguem com o valor anterior em vez de esperar a
+    conexão com uma réplica lenta ou fora do ar.
+    """
+    with _trava:
+        agora = time.monotonic()
+        vencida = (_ultima_verificacao['em'] is None
+                   or agora - _ultima_verificacao['em'] >= app.config['REPLICA_VERIFICAR_SEGUNDOS'])
+        if not vencida or _ultima_verificacao['medindo']:
+            return _ultima_verificacao['atraso']
+        _ultima_verificacao['medindo'] = True
+    medido = None
+    try:
+        medido = _medir_atraso()
+    finally:
+        with _trava:
+            _ultima_verificacao.update(em=time.monotonic(), atraso=medido, medindo=False)
+    return medido
+
+
+def utilizavel():
+    """Se as leituras desta requisição (ou tarefa) podem ir para a réplica."""
+    if not configurada():
+        return False
+    if has_request_context() and session.get('primario_ate', 0) > time.time():
+        return False
+    atraso_atual = atraso()
+    return atraso_atual is not None and atraso_atual <= app.config['REPLICA_ATRASO_MAXIMO']
+
+
+def leitura_na_replica(rota):
+    """Marca uma rota somente leitura para ler da réplica, quando ela estiver em dia."""
+    @wraps(rota)
+    def rota_na_replica(*args, **kwargs):
+        g.usar_replica = utilizavel()
+        return rota(*args, **kwargs)
+    return rota_na_replica
+
+
+def estado():
+    """{'configurada', 'atraso', 'em_uso'} para a verificação de saúde."""
+    if not configurada():
+        return {'configurada': False, 'atraso': None, 'em_uso': False}
+    atraso_atual = atraso()
+    return {'configurada': True, 'atraso': atraso_atual,
+            'em_uso': atraso_atual is not None and atraso_atual <= app.config['REPLICA_ATRASO_MAXIMO']}
+
+
+@app.after_request
+def _fixar_no_primario(resposta):
+    if g.pop('escreveu_no_primario', False) and configurada():
+        session['primario_ate'] = time.time() + app.config['REPLICA_ATRASO_MAXIMO']
+    return resposta
@@ -0,0 +1,80 @@
+"""
+Respostas JSON das APIs do dashboard, com validação condicional e compressão.
+
+json_em_cache() guarda no cache de leitura (cache.py) o corpo já serializado
+em JSON compacto, a versão comprimida com gzip e um ETag calculado sobre o
+conteúdo. Enquanto a entrada estiver no cache:
+
+  - o banco não é consultado;
+  - um navegador que já tem os dados (If-None-Match / If-Modified-Since)
+    recebe 304, sem corpo;
+  - quem aceita gzip recebe o corpo comprimido, sem comprimir de novo.
+
+Quem grava no banco já invalida as regiões afetadas; a próxima leitura
+recalcula o corpo e, se o conteúdo mudou, o ETag muda junto. Com CACHE_URL
+compartilhada (Redis), todos os processos respondem o mesmo ETag.
+
+Os validadores vêm da entrada do cache, e não de um contador de versão dos
+dados:
+
+  - o ETag é o hash do corpo. Quando a entrada expira (CACHE_TTL) ou é
+    invalidada, a consulta roda de novo mesmo que nada tenha mudado; se o
+    resultado for o mesmo, o ETag também é, e o navegador continua
+    recebendo 304. O custo é uma consulta por região a cada CACHE_TTL, e
+    não uma por requisição;
+  - o Last-Modified é o instante em que o corpo foi gerado, não o da última
+    alteração dos dados. Ele só serve para If-Modified-Since; quem decide é
+    o ETag, que o navegador envia junto.
+
+Um contador gravado no banco a cada invalidação (ex.: uma linha de
+INDICADOR por região) evitaria essa consulta, mas custaria uma leitura do
+contador em toda requisição e uma escrita a mais em cada gravação. Também
+não perceberia alterações feitas fora da aplicação (script SQL, 'flask
+import .sql'), que o TTL acaba corrigindo.
+
+max_age > 0 deixa o navegador reaproveitar a resposta sem perguntar ao
+servidor, para dados que não mudam mais (ex.: vendas de anos fechados); sem
+max_age, o navegador sempre revalida (no-cache), o que custa um 304.
+"""
+import gzip
+import json
+import hashlib
+from datetime import datetime, timezone
+from flask import request
+
+from app import app
+import cache
+
+# Abaixo disso a compressão não compensa o custo.
+MINIMO_COMPRESSAO = 1024
+
+
+def _preparar(valor):
+    corpo = json.dumps(valor, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return {
+        'corpo': corpo,
+        'gzip': gzip.compress(corpo, compresslevel=6) if len(corpo) >= MINIMO_COMPRESSAO else None,
+        'etag': hashlib.blake2b(corpo, digest_size=12).hexdigest(),
+        'gerado_em': datetime.now(timezone.utc).replace(microsecond=0),
+    }
+
+
+def json_em_cache(regiao, chave, calcular, ttl=None, max_age=0):
+    """Resposta JSON de calcular(), guardada em cache na região/chave e servida com ETag, 304 e gzip."""
+    pronto = cache.dados.obter_ou_calcular(regiao, ('json', chave), lambda: _preparar(calcular()), ttl)
+    resposta = app.response_class(pronto['corpo'], mimetype='application/json')
+    etag = pronto['etag']
+    if pronto['gzip'] is not None and request.accept_encodings['gzip']:
+        resposta.set_data(pronto['gzip'])
+        resposta.headers['Content-Encoding'] = 'gzip'
+        # Cada codificação tem o seu ETag forte.
+        etag += '-gz'
+    resposta.vary.add('Accept-Encoding')
+    resposta.set_etag(etag)
+    resposta.last_modified = pronto['gerado_em']
+    resposta.cache_control.private = True
+    if max_age:
+        resposta.cache_control.max_age = max_age
+    else:
+        resposta.cache_control.no_cache = True
+    return resposta.make_conditional(request)
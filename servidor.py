@@ -0,0 +1,111 @@
+"""
+Execução em produção: pool de conexões do banco e verificação de saúde.
+
+  - O pool é configurado pelas variáveis DB_* (ver app.py); pool_pre_ping
+    testa a conexão antes de entregá-la, então uma conexão derrubada pelo
+    MySQL é trocada em vez de virar erro na requisição.
+  - aquecer_pool() abre DB_AQUECER conexões na subida do processo (wsgi.py),
+    para que as primeiras vendas do dia não paguem a abertura de conexões.
+  - estado_pool() informa as conexões em uso e a saturação do pool, usadas
+    por /saude (503 quando saturado ou sem banco, para o balanceador tirar o
+    processo da rotação) e por /metrics. /saude também mostra o atraso da
+    réplica de leitura (replica.py), sem afetar o status.
+
+O pool é por processo: com gunicorn, o total de conexões no MySQL chega a
+processos x (DB_POOL_TAMANHO + DB_POOL_EXTRA), que precisa caber no
+max_connections do servidor (ver gunicorn.conf.py).
+"""
+import logging
+from sqlalchemy import event, text
+from sqlalchemy.pool import QueuePool
+
+from app import app, db
+import replica
+
+# Conexões extras do QueuePool quando DB_POOL_EXTRA não se aplica (ex.: SQLite em arquivo).
+MAX_OVERFLOW_PADRAO = 10
+
+logger = logging.getLogger(__name__)
+
+
+def _motor():
+    with app.app_context():
+        return db.engine
+
+
+def _configurar_conexao(conexao_dbapi, registro):
+    if app.config['DB_TEMPO_LIMITE_MS']:
+        cursor = conexao_dbapi.cursor()
+        cursor.execute(f"SET SESSION max_execution_time = {int(app.config['DB_TEMPO_LIMITE_MS'])}")
+        cursor.close()
+
+
+# Em todos os engines, inclusive o da réplica, que recebe as leituras
+# pesadas. max_execution_time vale só para SELECTs, e só existe no MySQL.
+with app.app_context():
+    for _engine in db.engines.values():
+        if _engine.dialect.name == 'mysql':
+            event.listen(_engine, 'connect', _configurar_conexao)
+
+
+def aquecer_pool(quantidade=None):
+    """Abre 'quantidade' conexões (padrão DB_AQUECER) e as devolve ao pool. Devolve quantas abriu."""
+    motor = _motor()
+    quantidade = app.config['DB_AQUECER'] if quantidade is None else quantidade
+    if isinstance(motor.pool, QueuePool):
+        quantidade = min(quantidade, motor.pool.size())
+    conexoes = []
+    try:
+        for _ in range(quantidade):
+            conexao = motor.connect()
+            conexoes.append(conexao)
+            conexao.execute(text('SELECT 1'))
+    except Exception:
+        # Sem banco na subida o processo sobe assim mesmo; /saude mostra o problema.
+        logger.warning('Não foi possível aquecer o pool de conexões', exc_info=True)
+    finally:
+        for conexao in conexoes:
+            conexao.close()
+    return len(conexoes)
+
+
+def estado_pool():
+    """
+    {'tipo', 'tamanho', 'extra', 'em_uso', 'livres', 'saturacao'} do pool
+    deste processo; saturacao é a fração de tamanho + extra em uso (None para
+    pools sem limite, como o do SQLite em memória).
+    """
+    pool = _motor().pool
+    if not isinstance(pool, QueuePool):
+        return {'tipo': type(pool).__name__, 'tamanho': None, 'extra': None,
+                'em_uso': None, 'livres': None, 'saturacao': None}
+    extra = app.config['SQLALCHEMY_ENGINE_OPTIONS'].get('max_overflow', MAX_OVERFLOW_PADRAO)
+    em_uso = pool.checkedout()
+    return {
+        'tipo': type(pool).__name__,
+        'tamanho': pool.size(),
+        'extra': extra,
+        'em_uso': em_uso,
+        'livres': pool.checkedin(),
+        'saturacao': round(em_uso / (pool.size() + extra), 4) if extra >= 0 else None,
+    }
+
+
+def saude():
+    """(corpo, status HTTP) da verificação de saúde: 200 pronto, 503 saturado ou sem banco."""
+    pool = estado_pool()
+    # A réplica só informa: sem ela, as leituras vão para o principal.
+    corpo = {'status': 'ok', 'banco': None, 'pool': pool, 'replica': replica.estado()}
+    if pool['saturacao'] is not None and pool['saturacao'] >= app.config['SAUDE_SATURACAO_MAXIMA']:
+        # Não pega outra conexão: com o pool cheio, o SELECT esperaria DB_POOL_ESPERA.
+        corpo['status'] = 'saturado'
+        return corpo, 503
+    try:
+        with _motor().connect() as conexao:
+            conexao.execute(text('SELECT 1'))
+        corpo['banco'] = 'ok'
+    except Exception as e:
+        logger.warning('Verificação de saúde: banco indisponível', exc_info=True)
+        corpo.update(status='sem_banco', banco=type(e).__name__)
+        return corpo, 503
+    return corpo, 200
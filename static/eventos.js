@@ -0,0 +1,27 @@
+// Eventos ao vivo (/eventos, ver eventos.py). Uso:
+//   conectarEventos({ venda: dados => ..., estoque: dados => ..., recarregar: () => ... });
+// O navegador reconecta sozinho quando a conexão cai. Se o servidor recusar a
+// conexão (503, limite de conexões), tenta de novo depois de um tempo; até
+// lá a página só não se atualiza sozinha.
+function conectarEventos(tratadores) {
+    const ESPERA_APOS_RECUSA_MS = 60000;
+    const fonte = new EventSource('/eventos');
+    Object.entries(tratadores).forEach(([tipo, tratador]) => {
+        fonte.addEventListener(tipo, e => tratador(e.data ? JSON.parse(e.data) : {}));
+    });
+    fonte.onerror = () => {
+        if (fonte.readyState === EventSource.CLOSED) {
+            setTimeout(() => conectarEventos(tratadores), ESPERA_APOS_RECUSA_MS);
+        }
+    };
+    return fonte;
+}
+
+// Junta chamadas seguidas numa só, 'espera' ms depois da última (ex.: várias vendas em sequência).
+function agrupar(funcao, espera) {
+    let temporizador = null;
+    return (...args) => {
+        clearTimeout(temporizador);
+        temporizador = setTimeout(() => funcao(...args), espera);
+    };
+}
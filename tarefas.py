@@ -0,0 +1,277 @@
+"""
+Tarefas em segundo plano, executadas pelo APScheduler num pool de threads,
+fora das threads que atendem as requisições.
+
+  - Exportações assíncronas: o relatório é gravado na área de downloads
+    (EXPORTACOES_DIR) e o andamento fica num arquivo '<id>.json' ao lado
+    dele, consultado pela rota de status. Como o status fica em disco,
+    qualquer processo da aplicação na mesma máquina consegue consultá-lo.
+  - Varredura de estoque baixo: a cada ALERTA_ESTOQUE_MINUTOS, os itens com
+    quantidade_produto <= min_produto ainda não alertados geram um pedido em
+    rascunho e uma mensagem por fornecedor, e recebem ESTOQUE.last_alert, para
+    não serem alertados de novo. Quando o estoque volta acima do mínimo, o
+    last_alert é limpo e o item pode ser alertado outra vez.
+  - Limpeza da área de downloads, de hora em hora.
+  - Snapshot do razão do estoque (movimentacoes.py): a cada
+    ESTOQUE_SNAPSHOT_HORAS, grava o saldo do início do mês se ainda não
+    existir. Com vários processos, só um consegue gravá-lo.
+  - Snapshots das análises (analises.py): a cada ANALISES_HORAS, acrescenta
+    os totais diários dos dias fechados desde o último corte. Com vários
+    processos na mesma máquina, todos gravam os mesmos arquivos, por troca
+    atômica; para atualizar em um só, use ANALISES_HORAS=0 nos demais.
+
+O agendador é iniciado no primeiro request de cada processo (ver app.py), e
+não nos comandos 'flask ...'. Com vários processos (ex.: gunicorn), todos
+varrem o estoque; o SELECT ... FOR UPDATE e o last_alert impedem alertas
+duplicados, mas é possível deixar a varredura em um só processo definindo
+ALERTA_ESTOQUE_MINUTOS=0 nos demais (ou usar 'flask varrer-estoque-baixo' no cron).
+"""
+import os, json, uuid, threading
+from datetime import datetime, timezone
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from flask import g
+
+from app import app, db
+import exportacao
+import replica
+import movimentacoes
+import analises
+from models import Produto, Estoque, PedidoFornecedor, PedidoProduto, Mensagem
+
+STATUS_NA_FILA = 'na_fila'
+STATUS_GERANDO = 'gerando'
+STATUS_CONCLUIDA = 'concluida'
+STATUS_ERRO = 'erro'
+
+PEDIDO_RASCUNHO = 'Rascunho'
+MENSAGEM_ALERTA = 'Alerta de Estoque'
+# O rascunho sugere repor até FATOR_REPOSICAO vezes o estoque mínimo.
+FATOR_REPOSICAO = 2
+
+agendador = None
+_trava = threading.Lock()
+
+
+class TarefasDesativadas(RuntimeError):
+    """O agendador não está rodando neste processo (TAREFAS_ATIVO=0)."""
+
+
+def iniciar():
+    """Inicia o agendador deste processo, uma única vez. Não faz nada se TAREFAS_ATIVO=0."""
+    global agendador
+    if agendador is not None or not app.config['TAREFAS_ATIVO']:
+        return
+    with _trava:
+        if agendador is not None:
+            return
+        novo = BackgroundScheduler(
+            executors={'default': ThreadPoolExecutor(app.config['TAREFAS_THREADS'])},
+            job_defaults={'coalesce': True, 'max_instances': 1, 'misfire_grace_time': 300},
+            timezone=timezone.utc,
+        )
+        minutos = app.config['ALERTA_ESTOQUE_MINUTOS']
+        if minutos > 0:
+            novo.add_job(_com_contexto, 'interval', args=[varrer_estoque_baixo], minutes=minutos,
+                         id='varredura-estoque-baixo')
+        novo.add_job(_com_contexto, 'interval', args=[limpar_exportacoes_antigas], hours=1,
+                     id='limpeza-exportacoes')
+        horas = app.config['ESTOQUE_SNAPSHOT_HORAS']
+        if horas > 0:
+            # Roda também na subida, para o snapshot do mês sair logo após a virada.
+            novo.add_job(_com_contexto, 'interval', args=[gerar_snapshot_estoque], hours=horas,
+                         id='snapshot-estoque', next_run_time=datetime.now(timezone.utc))
+        horas = app.config['ANALISES_HORAS']
+        if horas > 0:
+            novo.add_job(_com_contexto, 'interval', args=[atualizar_analises], hours=horas,
+                         id='snapshot-analises', next_run_time=datetime.now(timezone.utc))
+        novo.start()
+        agendador = novo
+
+
+def _com_contexto(funcao, *args):
+    with app.app_context():
+        try:
+            return funcao(*args)
+        except Exception:
+            app.logger.exception('Erro na tarefa %s', funcao.__name__)
+
+
+# =======================================================================
+# EXPORTAÇÕES ASSÍNCRONAS
+# =======================================================================
+
+def _diretorio():
+    diretorio = app.config['EXPORTACOES_DIR']
+    os.makedirs(diretorio, exist_ok=True)
+    return diretorio
+
+
+def _caminho_status(id_exportacao):
+    return os.path.join(_diretorio(), f'{id_exportacao}.json')
+
+
+def caminho_arquivo(status):
+    return os.path.join(_diretorio(), f"{status['id']}.{status['formato']}")
+
+
+def _gravar_status(status):
+    caminho = _caminho_status(status['id'])
+    with open(caminho + '.tmp', 'w', encoding='utf-8') as arquivo:
+        json.dump(status, arquivo, ensure_ascii=False)
+    os.replace(caminho + '.tmp', caminho)
+
+
+def ler_status(id_exportacao):
+    """Devolve o status da exportação, ou None se o id não existir (ou já tiver sido apagado)."""
+    try:
+        uuid.UUID(hex=id_exportacao)
+    except ValueError:
+        return None
+    try:
+        with open(_caminho_status(id_exportacao), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        return None
+
+
+def agendar_exportacao(nome, relatorio, consulta, formato, de, ate, id_usuario):
+    """
+    Coloca na fila a exportação do relatório 'nome'. 'consulta(de, ate)' deve
+    devolver (stmt, chaves), como em exportacao.exportar. Devolve o status inicial.
+    """
+    if agendador is None:
+        raise TarefasDesativadas('As tarefas em segundo plano estão desativadas neste servidor.')
+    status = {
+        'id': uuid.uuid4().hex, 'relatorio': nome, 'formato': formato,
+        'nome_arquivo': f"{relatorio['nome_arquivo']}.{formato}",
+        'de': de.date().isoformat() if de else None, 'ate': ate.date().isoformat() if ate else None,
+        'id_usuario': id_usuario, 'status': STATUS_NA_FILA, 'criado_em': datetime.utcnow().isoformat(),
+        'linhas': None, 'tamanho': None, 'erro': None,
+    }
+    _gravar_status(status)
+    agendador.add_job(_com_contexto, args=[_executar_exportacao, status, relatorio, consulta, de, ate],
+                      id=f"exportacao-{status['id']}")
+    return status
+
+
+def _executar_exportacao(status, relatorio, consulta, de, ate):
+    status.update(status=STATUS_GERANDO, iniciado_em=datetime.utcnow().isoformat())
+    _gravar_status(status)
+    destino = caminho_arquivo(status)
+    parcial = destino + '.parcial'
+    try:
+        # Como as rotas /export/*, a exportação lê da réplica quando ela está em dia.
+        g.usar_replica = replica.utilizavel()
+        stmt, chaves = consulta(de, ate)
+        linhas = exportacao.gravar_arquivo(relatorio, stmt, chaves, status['formato'], parcial)
+        os.replace(parcial, destino)
+        status.update(status=STATUS_CONCLUIDA, linhas=linhas, tamanho=os.path.getsize(destino))
+    except Exception as e:
+        app.logger.exception('Erro na exportação %s', status['id'])
+        if os.path.exists(parcial):
+            os.remove(parcial)
+        status.update(status=STATUS_ERRO, erro=str(e))
+    status['concluido_em'] = datetime.utcnow().isoformat()
+    _gravar_status(status)
+
+
+def limpar_exportacoes_antigas():
+    """Apaga da área de downloads os arquivos com mais de EXPORTACOES_HORAS horas."""
+    limite = datetime.now().timestamp() - app.config['EXPORTACOES_HORAS'] * 3600
+    removidos = 0
+    for entrada in os.scandir(_diretorio()):
+        if entrada.is_file() and entrada.stat().st_mtime < limite:
+            os.remove(entrada.path)
+            removidos += 1
+    return removidos
+
+
+# =======================================================================
+# VARREDURA DE ESTOQUE BAIXO
+# =======================================================================
+
+def varrer_estoque_baixo():
+    """
+    Gera os alertas de estoque baixo pendentes e faz o commit. Devolve um
+    resumo: itens alertados, rascunhos de pedido criados e itens rearmados
+    (que voltaram acima do mínimo).
+    """
+    agora = datetime.utcnow()
+    try:
+        rearmados = db.session.execute(
+            Estoque.__table__.update().where(
+                Estoque.last_alert.isnot(None), Estoque.abaixo_minimo == False
+            ).values(last_alert=None)
+        ).rowcount
+
+        # FOR UPDATE: uma varredura simultânea em outro processo espera esta
+        # terminar e então já encontra last_alert preenchido.
+        itens = db.session.query(
+            Produto.id_produto, Produto.nome, Produto.fornecedor_id,
+            Estoque.id_estoque, Estoque.quantidade_produto, Estoque.min_produto
+        ).join(Estoque, Produto.estoque_id == Estoque.id_estoque).filter(
+            Estoque.abaixo_minimo == True, Estoque.last_alert.is_(None)
+        ).order_by(Estoque.id_estoque).with_for_update(of=Estoque).all()
+
+        por_fornecedor = {}
+        for item in itens:
+            por_fornecedor.setdefault(item.fornecedor_id, []).append(item)
+
+        rascunhos = 0
+        for id_fornecedor, itens_fornecedor in por_fornecedor.items():
+            descricao = ', '.join(f"{i.nome} ({i.quantidade_produto}/{i.min_produto} un)" for i in itens_fornecedor)
+            if id_fornecedor is None:
+                conteudo = f"Estoque baixo em produtos sem fornecedor cadastrado: {descricao}."
+            else:
+                pedido = PedidoFornecedor(id_fornecedor=id_fornecedor, status=PEDIDO_RASCUNHO)
+                db.session.add(pedido)
+                db.session.flush()
+                db.session.execute(db.insert(PedidoProduto), [
+                    {'id_pedido': pedido.id_pedido, 'id_produto': i.id_produto,
+                     'quantidade_pedida': max(FATOR_REPOSICAO * i.min_produto - i.quantidade_produto, 1)}
+                    for i in itens_fornecedor
+                ])
+                rascunhos += 1
+                conteudo = f"Estoque baixo: {descricao}. Rascunho do pedido #{pedido.id_pedido} criado para reposição."
+            db.session.add(Mensagem(
+                fornecedor_id=id_fornecedor, conteudo=conteudo[:2000], status=MENSAGEM_ALERTA,
+                produto_id=itens_fornecedor[0].id_produto if len(itens_fornecedor) == 1 else None,
+            ))
+
+        if itens:
+            db.session.execute(Estoque.__table__.update().where(
+                Estoque.id_estoque.in_([i.id_estoque for i in itens])
+            ).values(last_alert=agora))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {'alertados': len(itens), 'rascunhos': rascunhos, 'rearmados': rearmados}
+
+
+# =======================================================================
+# SNAPSHOT DO RAZÃO DO ESTOQUE
+# =======================================================================
+
+def gerar_snapshot_estoque():
+    """Grava o snapshot do início do mês, se ainda não existir. Devolve o número de produtos gravados."""
+    try:
+        linhas = movimentacoes.gerar_snapshot()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if linhas:
+        app.logger.info('Snapshot do estoque gravado: %d produto(s)', linhas)
+    return linhas
+
+
+
+# =======================================================================
+# SNAPSHOTS DAS ANÁLISES
+# =======================================================================
+
+def atualizar_analises():
+    """Acrescenta aos snapshots das análises os dias fechados desde o último corte."""
+    return analises.atualizar()
@@ -0,0 +1,29 @@
+"""
+Ponto de entrada WSGI para produção (o 'flask run' e o app.run(debug=True)
+são só para desenvolvimento).
+
+    gunicorn -c gunicorn.conf.py wsgi:app     # Linux
+    python wsgi.py                            # Windows (waitress)
+
+Cada processo que importa este módulo aquece o seu pool de conexões. Atrás de
+proxies reversos, PROXY_SALTOS diz quantos são, para que request.remote_addr
+(usado no limite de tentativas de login por IP) seja o IP do cliente.
+"""
+import os
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import app
+import servidor
+
+servidor.aquecer_pool()
+
+if int(os.getenv('PROXY_SALTOS', '0')):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.getenv('PROXY_SALTOS')), x_proto=1)
+
+if __name__ == '__main__':
+    from waitress import serve
+
+    # Um processo com várias threads; DB_POOL_TAMANHO + DB_POOL_EXTRA deve ser
+    # ao menos WEB_THREADS + TAREFAS_THREADS.
+    serve(app, host=os.getenv('HOST', '0.0.0.0'), port=int(os.getenv('PORT', '5000')),
+          threads=int(os.getenv('WEB_THREADS', str(min(32, (os.cpu_count() or 1) * 4)))))